@@ -0,0 +1,85 @@
+from datetime import date, datetime
+
+from awards import MAX_BATCH_SIZE
+from pagination import PaginationError, get_cursor, get_datetime_arg, get_int_arg, get_limit
+from serializers import row_serializer
+
+# Разбор тел и параметров запросов и сборка ответов, общие для WSGI- (routes.py) и ASGI-приложения (asgi.py)
+
+serialize_user = row_serializer('id', 'username', 'language')
+serialize_achievement = row_serializer('id', 'name', 'points', 'description')
+serialize_user_achievement = row_serializer('name', 'points', 'description', 'date_awarded')
+
+
+class InvalidInput(ValueError):
+    """Некорректное тело запроса; сообщение отдаётся клиенту с кодом 400."""
+
+
+def parse_user(data):
+    """Поля нового пользователя из JSON-тела запроса."""
+    if not isinstance(data, dict) or 'username' not in data or 'language' not in data:
+        raise InvalidInput('Invalid input')
+    return {'username': data['username'], 'language': data['language']}
+
+
+def parse_achievement(data):
+    """Поля нового достижения из JSON-тела запроса."""
+    if not isinstance(data, dict) or not {'name', 'points', 'description'} <= data.keys():
+        raise InvalidInput('Invalid input')
+    return {'name': data['name'], 'points': data['points'], 'description': data['description']}
+
+
+def parse_batch(data):
+    """Элементы пачки выдач из JSON-тела запроса {"awards": [...]}."""
+    items = data.get('awards') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        raise InvalidInput('Invalid input')
+    if len(items) > MAX_BATCH_SIZE:
+        raise InvalidInput(f'Batch size exceeds {MAX_BATCH_SIZE}')
+    return items
+
+
+def award_row(user_id, achievement_id, points, key):
+    """Строка одной выдачи для awards.record_awards."""
+    return {
+        'user_id': user_id,
+        'achievement_id': achievement_id,
+        'date_awarded': datetime.utcnow(),
+        'points': points,
+        'award_key': key
+    }
+
+
+def batch_summary(results):
+    """Ответ на пачку выдач: число выданных, число ошибок (без повторов) и статусы элементов."""
+    awarded = sum(1 for result in results if result['status'] == 'awarded')
+    duplicates = sum(1 for result in results if result['status'] == 'duplicate')
+    return {'awarded': awarded, 'failed': len(results) - awarded - duplicates, 'results': results}
+
+
+def user_achievements_args(args=None):
+    """Параметры страницы достижений пользователя: limit, курсор, since и until."""
+    return (get_limit(args), get_cursor(datetime, int, args=args),
+            get_datetime_arg('since', args), get_datetime_arg('until', args))
+
+
+def streak_args(args=None):
+    """Параметры списка серий: минимальная длина days, limit и курсор; PaginationError при ошибке."""
+    days = get_int_arg('days', 7, args)
+    if days < 1:
+        raise PaginationError('days must be a positive integer')
+    return days, get_limit(args), get_cursor(int, int, args=args)
+
+
+def streak_cursor_key(row):
+    return row.best_streak, row.user_id
+
+
+def serialize_streak(row):
+    return {
+        'user_id': row.user_id,
+        'username': row.username,
+        'best_streak': row.best_streak,
+        'current_streak': row.current_streak,
+        'last_award_date': date.fromordinal(row.last_award_day).isoformat()
+    }
@@ -1,52 +1,147 @@
 import logging
+import os
+
 from flask import Flask
-from sqlalchemy_utils import database_exists, create_database
 from flask_migrate import Migrate
-
-import os
 from flasgger import Swagger
 
+from cache import cache
+from events import broadcaster
 from models import db
+from pool import engine_options
+from leaderboard import leaderboard
+from logs import log_pipeline
+from metrics import metrics
+from partitions import partition_maintainer
+from replicas import replica_router
 from routes import set_routes
+from serializers import FastJSONProvider
+from sharding import shard_router
+from commands import set_commands
+from translations import translations
+from writebehind import award_queue
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
 
-app = Flask(__name__)
-
-# Инициализация приложения Flask и конфигурации базы данных
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://postgres:q1w2e3r4@db/achievements_db'
-# app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.dirname(__file__)}/achievements.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SWAGGER'] = {
-    'title': 'Тестовое задание. Разработка API для работы с достижениями',
-    'uiversion': 3,
-    'description': 'Это простой сервер для работы с достижениями пользователей. Вы можете добавлять пользователей, добавлять достижения и выдавать их пользователям.',
-    'termsOfService': 'http://example.com/terms/',
-    'contact': {
-        'name': 'API Support',
-        'url': 'http://www.example.com/support',
-        'email': 'support@example.com'
-    },
-    'license': {
-        'name': 'Apache 2.0',
-        'url': 'http://www.apache.org/licenses/LICENSE-2.0.html'
-    }
-}
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, filename='app.log', filemode='w')
 logger = logging.getLogger(__name__)
 
-db.init_app(app)
-set_routes(app, logger)
 
-# Инициализация базы данных и миграций
-if not database_exists(app.config['SQLALCHEMY_DATABASE_URI']):
-    create_database(app.config['SQLALCHEMY_DATABASE_URI'])
+def default_config():
+    """Конфигурация по умолчанию из переменных окружения."""
+    config = {}
+    # Инициализация приложения Flask и конфигурации базы данных
+    config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'postgresql://postgres:q1w2e3r4@db/achievements_db')
+    # config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.dirname(__file__)}/achievements.db'
+    config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Реплики для чтения через запятую; маршруты REPLICA_ENDPOINTS читают с них, если отставание не больше
+    # REPLICA_MAX_LAG_SECONDS (проверяется раз в REPLICA_LAG_CHECK_SECONDS)
+    config['DATABASE_REPLICA_URLS'] = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    config['REPLICA_MAX_LAG_SECONDS'] = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 1))
+    config['REPLICA_LAG_CHECK_SECONDS'] = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', 1))
+    # Шарды пользователей и их выдач через запятую; пользователь попадает в корзину user_id % SHARD_BUCKETS,
+    # корзины распределяются по шардам по SHARD_MAP ('0-511=0,512-1023=1'), без него - поровну
+    config['DATABASE_SHARD_URLS'] = [url for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url]
+    config['SHARD_BUCKETS'] = int(os.environ.get('SHARD_BUCKETS', 1024))
+    config['SHARD_MAP'] = os.environ.get('SHARD_MAP', '')
+    # Как часто (в секундах) перестраивать рейтинг, чтобы учесть выдачи в других процессах; 0 - никогда
+    config['LEADERBOARD_REFRESH_SECONDS'] = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 300))
+    # Кэш ответов: memory - в памяти процесса, redis - общий для всех процессов, none - выключен
+    config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+    config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    # Пороги (мс), начиная с которых SQL-запрос и HTTP-запрос пишутся в лог как медленные
+    config['METRICS_SLOW_QUERY_MS'] = int(os.environ.get('METRICS_SLOW_QUERY_MS', 200))
+    config['METRICS_SLOW_REQUEST_MS'] = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 1000))
+    # Отложенная запись выдач: POST /user/<id>/achieve/<id> отвечает 202, выдачи коммитятся группами в фоне
+    config['AWARD_WRITE_BEHIND'] = os.environ.get('AWARD_WRITE_BEHIND', '0') == '1'
+    # Каждый процесс занимает первый свободный из журналов AWARD_JOURNAL_PATH, AWARD_JOURNAL_PATH.1, ...;
+    # слотов нужно не меньше, чем рабочих процессов
+    config['AWARD_JOURNAL_PATH'] = os.environ.get('AWARD_JOURNAL_PATH', 'awards.journal')
+    config['AWARD_JOURNAL_SLOTS'] = int(os.environ.get('AWARD_JOURNAL_SLOTS', 64))
+    config['AWARD_JOURNAL_FSYNC'] = os.environ.get('AWARD_JOURNAL_FSYNC', '0') == '1'
+    config['AWARD_JOURNAL_COMPACT_ROWS'] = int(os.environ.get('AWARD_JOURNAL_COMPACT_ROWS', 100000))
+    config['AWARD_FLUSH_INTERVAL_MS'] = int(os.environ.get('AWARD_FLUSH_INTERVAL_MS', 50))
+    config['AWARD_FLUSH_MAX_ROWS'] = int(os.environ.get('AWARD_FLUSH_MAX_ROWS', 1000))
+    # После стольких неудачных сбросов подряд группа пишется по одной выдаче, чтобы отбросить ошибочные
+    config['AWARD_FLUSH_MAX_RETRIES'] = int(os.environ.get('AWARD_FLUSH_MAX_RETRIES', 5))
+    # Поток GET /events: буфер событий на клиента (медленный клиент отключается), история для Last-Event-ID,
+    # интервал комментариев keepalive; EVENTS_PG_NOTIFY - рассылка между воркерами через LISTEN/NOTIFY PostgreSQL
+    config['EVENTS_BUFFER_SIZE'] = int(os.environ.get('EVENTS_BUFFER_SIZE', 1000))
+    config['EVENTS_HISTORY_SIZE'] = int(os.environ.get('EVENTS_HISTORY_SIZE', 10000))
+    config['EVENTS_KEEPALIVE_SECONDS'] = float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+    config['EVENTS_MAX_CLIENTS'] = int(os.environ.get('EVENTS_MAX_CLIENTS', 50))
+    config['EVENTS_PG_NOTIFY'] = os.environ.get('EVENTS_PG_NOTIFY', '0') == '1'
+    config['EVENTS_CHANNEL'] = os.environ.get('EVENTS_CHANNEL', 'award_events')
+    # Секции таблицы выдач на PostgreSQL создаются на столько месяцев вперёд командой flask bootstrap и воркерами
+    config['AWARD_PARTITIONS_AHEAD'] = int(os.environ.get('AWARD_PARTITIONS_AHEAD', 3))
+    # Как часто (в секундах) рабочий процесс проверяет и создаёт секции наступающих месяцев; 0 - никогда
+    config['AWARD_PARTITIONS_CHECK_SECONDS'] = int(os.environ.get('AWARD_PARTITIONS_CHECK_SECONDS', 3600))
+    # Логи: JSON в файл с ротацией по размеру ('-' - в stdout), запись в фоновом потоке
+    config['LOG_FILE'] = os.environ.get('LOG_FILE', 'app.log')
+    config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+    config['LOG_MAX_BYTES'] = int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024))
+    config['LOG_BACKUP_COUNT'] = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+    config['LOG_QUEUE_SIZE'] = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    # Доля запросов, для которых пишутся INFO-записи маршрута: '/user/<int:user_id>/achieve/<int:achievement_id>=0.01,...'
+    config['LOG_SAMPLE_RATES'] = os.environ.get('LOG_SAMPLE_RATES', '')
+    # Собрать спецификацию Swagger при создании приложения, а не на первом запросе к /apispec_1.json:
+    # при предзагрузке кода (gunicorn --preload) воркеры получают её готовой
+    config['SWAGGER_PRECOMPILE'] = os.environ.get('SWAGGER_PRECOMPILE', '0') == '1'
+    config['SWAGGER'] = {
+        'title': 'Тестовое задание. Разработка API для работы с достижениями',
+        'uiversion': 3,
+        'description': 'Это простой сервер для работы с достижениями пользователей. Вы можете добавлять пользователей, добавлять достижения и выдавать их пользователям.',
+        'termsOfService': 'http://example.com/terms/',
+        'contact': {
+            'name': 'API Support',
+            'url': 'http://www.example.com/support',
+            'email': 'support@example.com'
+        },
+        'license': {
+            'name': 'Apache 2.0',
+            'url': 'http://www.apache.org/licenses/LICENSE-2.0.html'
+        }
+    }
+    return config
+
+
+def create_app(config=None):
+    """Создаёт приложение Flask; config дополняет и переопределяет default_config().
+
+    Создание приложения не обращается к базе: схема создаётся и обновляется
+    командой flask bootstrap, рейтинг строится при первом запросе к нему,
+    очередь отложенной записи запускается при первой выдаче.
+    """
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config.update(default_config())
+    app.config.update(config or {})
+    # Пул соединений настраивается переменными DB_POOL_* и DB_PGBOUNCER, см. pool.engine_options
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options())
+
+    log_pipeline.init_app(app)
+    replica_router.init_app(app)
+    shard_router.init_app(app)
+    db.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    award_queue.init_app(app)
+    leaderboard.init_app(app)
+    translations.init_app(app)
+    broadcaster.init_app(app)
+    partition_maintainer.init_app(app)
+    set_routes(app, logger)
+    set_commands(app)
+    Migrate(app, db, directory=MIGRATIONS_DIRECTORY)
 
-with app.app_context():
-    db.create_all()
-    db.session.commit()
+    # Flasgger собирает спецификацию при первом запросе и кэширует её вне режима отладки
+    swagger = Swagger(app)
+    if app.config['SWAGGER_PRECOMPILE']:
+        with app.test_request_context():
+            swagger.get_apispecs()
+    return app
 
-migrate = Migrate(app, db)
-Swagger(app)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,249 @@
+import logging
+import os
+
+from quart import Quart, Response, jsonify, request
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from api import (InvalidInput, award_row, batch_summary, parse_achievement, parse_batch, parse_user,
+                 serialize_achievement, serialize_streak, serialize_user, serialize_user_achievement, streak_args,
+                 streak_cursor_key, user_achievements_args)
+from awards import IDEMPOTENCY_HEADER, AwardError, IdempotencyConflict, award_batch, record_awards, validate_award_key
+from etags import CATALOG, bump_version
+from models import User, Achievement
+from pagination import (NDJSON_MIMETYPE, NEXT_CURSOR_HEADER, STREAM_BATCH_SIZE, PaginationError, get_cursor,
+                        get_limit, split_page, wants_ndjson)
+from pool import engine_options
+from queries import achievements_query, award_points_query, user_achievements_query, users_query
+from serializers import JSON_MIMETYPE, FastJSONProvider, dumps, rows_json
+from stats import collect_stats, streak_users_query
+
+DEFAULT_DATABASE_URL = 'postgresql://postgres:q1w2e3r4@db/achievements_db'
+
+# Асинхронные драйверы для синхронных URL из конфигурации Flask-приложения
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+logger = logging.getLogger(__name__)
+
+
+def async_database_url(url):
+    """Заменяет драйвер в URL базы на асинхронный: postgresql:// -> postgresql+asyncpg://."""
+    scheme, rest = url.split('://', 1)
+    return f'{ASYNC_DRIVERS.get(scheme.split("+")[0], scheme)}://{rest}'
+
+
+def create_asgi_app(database_url=None):
+    """Асинхронный вариант API для запуска под ASGI-сервером (hypercorn, uvicorn).
+
+    Обработчики не держат поток на время запроса к базе: запросы идут через
+    асинхронный драйвер, и конкурентные чтения и выдачи достижений делят один
+    цикл событий. Запросы и запись выдач - те же, что у WSGI-приложения
+    (queries, stats, awards); синхронный код записи выполняется через
+    AsyncSession.run_sync; разбор запросов и сборка ответов общие с ним (api).
+    Схему базы создаёт команда flask bootstrap.
+
+    Сервер запускает фабрику сам: hypercorn "asgi:create_asgi_app()".
+    """
+    app = Quart(__name__)
+    app.json = FastJSONProvider(app)
+    url = async_database_url(database_url or os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL))
+    engine = create_async_engine(url, **({} if url.startswith('sqlite') else engine_options(async_driver=True)))
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    app.config['ASYNC_ENGINE'] = engine
+
+    @app.after_serving
+    async def dispose_engine():
+        await engine.dispose()
+
+    def stream_ndjson(query, serialize):
+        """Отдаёт результат запроса построчно в NDJSON, читая строки пачками из серверного курсора."""
+        async def generate():
+            async with Session() as session:
+                result = await session.stream(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+                async for row in result:
+                    yield dumps(serialize(row)) + b'\n'
+
+        return Response(generate(), mimetype=NDJSON_MIMETYPE)
+
+    async def keyset_page(query_for, serialize, name):
+        try:
+            after = get_cursor(int, args=request.args)
+            limit = None if wants_ndjson(request) else get_limit(request.args)
+        except PaginationError as e:
+            logger.warning('Invalid pagination parameters for %s: %s', name, e)
+            return jsonify({'error': str(e)}), 400
+
+        if limit is None:
+            return stream_ndjson(query_for(after=after), serialize)
+
+        async with Session() as session:
+            rows = (await session.execute(query_for(limit, after))).all()
+        rows, next_cursor = split_page(rows, limit, key=lambda row: (row.id,))
+        response = Response(rows_json(rows, serialize), mimetype=JSON_MIMETYPE)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response
+
+    @app.route('/')
+    async def index():
+        return '<h1>Started Page</h1>'
+
+    @app.route('/user', methods=['POST'])
+    async def add_user():
+        """Добавляет нового пользователя."""
+        try:
+            data = parse_user(await request.get_json(silent=True))
+        except InvalidInput as e:
+            logger.warning('Invalid input data for user creation')
+            return jsonify({'error': str(e)}), 400
+
+        async with Session() as session:
+            new_user = User(**data)
+            session.add(new_user)
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                logger.warning('User %s already exists', data['username'])
+                return jsonify({'error': 'User already exists'}), 409
+        logger.info('User %s added successfully', data['username'])
+        return jsonify({'message': 'User created successfully', 'user_id': new_user.id}), 201
+
+    @app.route('/users', methods=['GET'])
+    async def get_users():
+        """Получить список всех пользователей."""
+        return await keyset_page(users_query, serialize_user, 'users')
+
+    @app.route('/user/<int:user_id>', methods=['GET'])
+    async def get_user(user_id):
+        """Возвращает информацию о пользователе по его ID."""
+        async with Session() as session:
+            user = await session.get(User, user_id)
+        if not user:
+            logger.warning('User with id %s not found', user_id)
+            return jsonify({'error': 'User not found'}), 404
+        return jsonify({'username': user.username, 'language': user.language})
+
+    @app.route('/achievements', methods=['GET'])
+    async def get_achievements():
+        """Возвращает список всех достижений."""
+        return await keyset_page(achievements_query, serialize_achievement, 'achievements')
+
+    @app.route('/achievement', methods=['POST'])
+    async def add_achievement():
+        """Добавляет новое достижение."""
+        try:
+            data = parse_achievement(await request.get_json(silent=True))
+        except InvalidInput as e:
+            logger.warning('Invalid input data for achievement creation')
+            return jsonify({'error': str(e)}), 400
+
+        async with Session() as session:
+            new_achievement = Achievement(**data)
+            session.add(new_achievement)
+            try:
+                await session.run_sync(lambda sync_session: bump_version(CATALOG, sync_session))
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                logger.warning('Achievement %s already exists', data['name'])
+                return jsonify({'error': 'Achievement already exists'}), 409
+        logger.info('Achievement %s added successfully', data['name'])
+        return jsonify({'message': 'Achievement added successfully', 'id': new_achievement.id}), 201
+
+    @app.route('/user/<int:user_id>/achieve/<int:achievement_id>', methods=['POST'])
+    async def award_achievement(user_id, achievement_id):
+        """Выдаёт достижение пользователю."""
+        try:
+            key = validate_award_key(request.headers.get(IDEMPOTENCY_HEADER))
+        except AwardError as e:
+            return jsonify({'error': str(e)}), 400
+        async with Session() as session:
+            points = await session.scalar(award_points_query(user_id, achievement_id))
+            if points is None:
+                logger.warning('User or Achievement not found (user_id=%s, achievement_id=%s)',
+                               user_id, achievement_id)
+                return jsonify({'error': 'User or Achievement not found'}), 404
+            rows = [award_row(user_id, achievement_id, points, key)]
+            written = await session.run_sync(lambda sync_session: record_awards(rows, sync_session))
+            await session.commit()
+        if not written:
+            logger.info('Repeated award of %s to user %s with key %s ignored', achievement_id, user_id, key)
+            return jsonify({'message': 'Achievement already awarded'}), 200
+        logger.info('Achievement %s awarded to user %s', achievement_id, user_id)
+        return jsonify({'message': 'Achievement awarded successfully'}), 201
+
+    @app.route('/awards/batch', methods=['POST'])
+    async def award_batch_achievements():
+        """Выдаёт пачку достижений одной транзакцией."""
+        try:
+            items = parse_batch(await request.get_json(silent=True))
+        except InvalidInput as e:
+            logger.warning('Invalid input data for batch award: %s', e)
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            key = validate_award_key(request.headers.get(IDEMPOTENCY_HEADER))
+        except AwardError as e:
+            return jsonify({'error': str(e)}), 400
+
+        async with Session() as session:
+            try:
+                summary = batch_summary(
+                    await session.run_sync(lambda sync_session: award_batch(items, sync_session, key))
+                )
+            except IdempotencyConflict as e:
+                logger.warning('Batch award rejected: %s', e)
+                return jsonify({'error': str(e)}), 422
+        logger.info('Batch award: %s of %s achievements awarded, %s failed',
+                    summary['awarded'], len(items), summary['failed'])
+        return jsonify(summary)
+
+    @app.route('/user/<int:user_id>/achievements', methods=['GET'])
+    async def get_user_achievements(user_id):
+        """Возвращает список достижений пользователя."""
+        try:
+            limit, after, since, until = user_achievements_args(request.args)
+        except PaginationError as e:
+            logger.warning('Invalid pagination parameters for user %s: %s', user_id, e)
+            return jsonify({'error': str(e)}), 400
+
+        async with Session() as session:
+            rows = (await session.execute(user_achievements_query(user_id, limit, after, since, until))).all()
+            if not rows and not await session.get(User, user_id):
+                logger.warning('User with id %s not found', user_id)
+                return jsonify({'error': 'User not found'}), 404
+        rows, next_cursor = split_page(rows, limit, key=lambda row: (row.date_awarded, row.id))
+
+        response = Response(rows_json(rows, serialize_user_achievement), mimetype=JSON_MIMETYPE)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response
+
+    @app.route('/stats', methods=['GET'])
+    async def get_stats():
+        """Возвращает статистику по пользователям и достижениям."""
+        async with Session() as session:
+            return jsonify(await session.run_sync(collect_stats))
+
+    @app.route('/stats/streaks', methods=['GET'])
+    async def get_streak_users():
+        """Возвращает пользователей с сериями выдач не короче заданной длины."""
+        try:
+            days, limit, after = streak_args(request.args)
+        except PaginationError as e:
+            logger.warning('Invalid pagination parameters for streaks: %s', e)
+            return jsonify({'error': str(e)}), 400
+
+        async with Session() as session:
+            rows = (await session.execute(streak_users_query(days, limit, after))).all()
+        rows, next_cursor = split_page(rows, limit, key=streak_cursor_key)
+        response = jsonify([serialize_streak(row) for row in rows])
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response
+
+    return app
@@ -0,0 +1,231 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+
+from models import User, Achievement, AwardKey, UserAchievement, db
+from sharding import shard_router
+from stats import apply_awards, insert_for
+
+MAX_BATCH_SIZE = 10000
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# Ключ пачки дополняется номером элемента, поэтому он короче колонки award_key
+MAX_KEY_LENGTH = 64
+# Начиная с этого размера пачки на PostgreSQL (psycopg2) вставка идёт через COPY
+COPY_THRESHOLD = 1000
+
+
+logger = logging.getLogger(__name__)
+
+# Обработчики, вызываемые после коммита транзакции с выдачами
+_committed_listeners = []
+
+
+class AwardError(ValueError):
+    """Некорректный элемент пачки выдачи достижений."""
+
+
+class IdempotencyConflict(Exception):
+    """Ключ идемпотентности уже использован запросом с другим телом."""
+
+
+def parse_award(item):
+    """Разбирает элемент пачки: объект или массив (user_id, achievement_id[, awarded_at])."""
+    if isinstance(item, dict):
+        user_id, achievement_id, awarded_at = item.get('user_id'), item.get('achievement_id'), item.get('awarded_at')
+    elif isinstance(item, (list, tuple)) and len(item) in (2, 3):
+        user_id, achievement_id, awarded_at = (list(item) + [None])[:3]
+    else:
+        raise AwardError('Expected object or [user_id, achievement_id, awarded_at]')
+    if type(user_id) is not int or type(achievement_id) is not int:
+        raise AwardError('user_id and achievement_id must be integers')
+    if awarded_at is None:
+        return user_id, achievement_id, None
+    try:
+        awarded_at = datetime.fromisoformat(awarded_at)
+    except (TypeError, ValueError):
+        raise AwardError('awarded_at must be an ISO 8601 date-time')
+    # В базе даты хранятся в UTC без часового пояса
+    if awarded_at.tzinfo is not None:
+        awarded_at = awarded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return user_id, achievement_id, awarded_at
+
+
+def validate_award_key(key):
+    """Проверяет ключ идемпотентности из заголовка запроса; None - ключ не передан."""
+    if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise AwardError(f'{IDEMPOTENCY_HEADER} must be from 1 to {MAX_KEY_LENGTH} characters')
+    return key
+
+
+def _copy_rows(rows, session):
+    """Вставляет строки через COPY в рамках текущей транзакции сессии."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((row['user_id'], row['achievement_id'], row['date_awarded'].isoformat()))
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY user_achievement (user_id, achievement_id, date_awarded) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def on_awards_committed(listener):
+    """Регистрирует обработчик, получающий список выдач после коммита их транзакции.
+
+    Обработчик вызывается вне транзакции и не должен обращаться к сессии
+    за данными; ошибки обработчиков логируются и не влияют на выдачу.
+    """
+    _committed_listeners.append(listener)
+    return listener
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_committed(session):
+    rows = session.info.pop('committed_awards', None)
+    if not rows:
+        return
+    for listener in _committed_listeners:
+        try:
+            listener(rows)
+        except Exception:
+            logger.exception('Award listener %s failed', listener.__name__)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('committed_awards', None)
+
+
+def record_awards(rows, session=None):
+    """Записывает выдачи достижений и обновляет агрегаты в текущей транзакции.
+
+    rows - список словарей с ключами user_id, achievement_id, date_awarded, points
+    и необязательным award_key. Выдача с уже записанным award_key пропускается:
+    ключи вставляются в AwardKey через INSERT ... ON CONFLICT DO NOTHING, и
+    записываются только выдачи с новыми ключами. Существование пользователей и
+    достижений должно быть проверено заранее; коммит остаётся за вызывающим
+    кодом, после него записанные выдачи получат обработчики on_awards_committed.
+    Возвращает список действительно записанных rows.
+    """
+    if not rows:
+        return []
+    session = session or db.session
+    now = datetime.utcnow()
+    keys = [{'key': row['award_key'], 'created_at': now} for row in rows if row.get('award_key')]
+    if keys:
+        stmt = insert_for(AwardKey, session).on_conflict_do_nothing(index_elements=['key'])
+        inserted = set(session.scalars(stmt.returning(AwardKey.key), keys))
+        rows = [row for row in rows if row.get('award_key') is None or row['award_key'] in inserted]
+        if not rows:
+            return []
+    values = [{
+        'user_id': row['user_id'],
+        'achievement_id': row['achievement_id'],
+        'date_awarded': row['date_awarded']
+    } for row in rows]
+    dialect = session.get_bind().dialect
+    if len(values) >= COPY_THRESHOLD and dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        _copy_rows(values, session)
+    else:
+        session.execute(insert(UserAchievement), values)
+    apply_awards(((row['user_id'], row['points'], row['date_awarded']) for row in rows), session)
+    session.info.setdefault('committed_awards', []).extend(rows)
+    return rows
+
+
+def request_hash(items):
+    """SHA-256 канонического JSON элементов пачки."""
+    return hashlib.sha256(json.dumps(items, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _claim_batch_key(key, items, session, now):
+    """Закрепляет ключ пачки за хешем её элементов; IdempotencyConflict, если ключ пришёл с другой пачкой.
+
+    Ключи элементов "<key>:<index>" зависят от позиции, поэтому повтор с другими
+    или переставленными элементами иначе получил бы чужие статусы duplicate.
+    """
+    digest = request_hash(items)
+    # Ключ пачки хранится в основной базе и коммитится вместе с выдачами
+    with shard_router.routed(None, session):
+        session.execute(insert_for(AwardKey, session).values(
+            key=key, created_at=now, request_hash=digest
+        ).on_conflict_do_nothing(index_elements=['key']))
+        stored = session.scalar(select(AwardKey.request_hash).where(AwardKey.key == key))
+    if stored != digest:
+        session.rollback()
+        raise IdempotencyConflict(f'{IDEMPOTENCY_HEADER} {key} was used with a different request')
+
+
+def _award_on_shard(parsed, results, session, now, key):
+    """Проверяет и записывает разобранные элементы пачки, заполняя их статусы в results."""
+    user_ids = {user_id for _, (user_id, _, _) in parsed}
+    achievement_ids = {achievement_id for _, (_, achievement_id, _) in parsed}
+    existing_users = set(session.scalars(select(User.id).where(User.id.in_(user_ids)))) if user_ids else set()
+    points = dict(session.execute(
+        select(Achievement.id, Achievement.points).where(Achievement.id.in_(achievement_ids))
+    ).all()) if achievement_ids else {}
+
+    rows = []
+    for index, (user_id, achievement_id, awarded_at) in parsed:
+        if user_id not in existing_users:
+            results[index] = {'index': index, 'status': 'user_not_found'}
+        elif achievement_id not in points:
+            results[index] = {'index': index, 'status': 'achievement_not_found'}
+        else:
+            rows.append({
+                'user_id': user_id,
+                'achievement_id': achievement_id,
+                'date_awarded': awarded_at or now,
+                'points': points[achievement_id],
+                'award_key': f'{key}:{index}' if key else None,
+                'index': index
+            })
+            results[index] = {'index': index, 'status': 'awarded'}
+
+    written = {row['index'] for row in record_awards(rows, session)}
+    for row in rows:
+        if row['index'] not in written:
+            results[row['index']] = {'index': row['index'], 'status': 'duplicate'}
+
+
+def award_batch(items, session=None, key=None):
+    """Выдаёт пачку достижений одной транзакцией.
+
+    Пользователи и достижения проверяются двумя запросами по множествам id,
+    все найденные выдачи вставляются одной операцией. С ключом идемпотентности
+    элемент получает award_key "<key>:<index>", и при повторе пачки уже
+    записанные элементы получают статус duplicate; повтор ключа с другими
+    элементами - IdempotencyConflict. Возвращает статусы по каждому элементу
+    в порядке входного списка.
+    """
+    session = session or db.session
+    now = datetime.utcnow()
+    if key:
+        _claim_batch_key(key, items, session, now)
+    results = []
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_award(item)))
+            results.append(None)
+        except AwardError as e:
+            results.append({'index': index, 'status': 'invalid', 'error': str(e)})
+
+    # С шардированием каждая группа проверяется и пишется на шарде своих пользователей; транзакции
+    # шардов коммитятся одна за другой
+    for shard, shard_items in shard_router.group(parsed, lambda item: item[1][0]).items():
+        with shard_router.routed(shard, session):
+            _award_on_shard(shard_items, results, session, now, key)
+    session.commit()
+    return results
@@ -0,0 +1,187 @@
+"""Нагрузочный драйвер: смешанная нагрузка чтения и записи по всем эндпоинтам API.
+
+Каждый поток держит своё keep-alive соединение и выбирает сценарий по весам
+WORKLOAD. Задержки всех запросов сохраняются в JSON для bench.report. Для
+потока GET /events замеряется время до первой строки ответа.
+
+    python -m bench.load --url http://localhost:5000 --users 1000000 --duration 60 --output results.json
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+
+def _period(rng, a):
+    start = date.today() - timedelta(days=rng.randrange(365))
+    return f'from={start.isoformat()}&to={(start + timedelta(days=30)).isoformat()}'
+
+
+def _users_csv(rng, a):
+    return 'username,language\n' + ''.join(
+        f'load-{rng.getrandbits(64):x},{rng.choice(("ru", "en"))}\n' for _ in range(a.batch_size))
+
+
+def _achievements_csv(rng, a):
+    return 'name,points,description\n' + ''.join(
+        f'load-{rng.getrandbits(64):x},{rng.choice((1, 5, 10))},Load achievement\n' for _ in range(a.batch_size))
+
+
+# Сценарий: имя, вес, функция (rng, args) -> (method, path, body); body-словарь отправляется как JSON, строка - как CSV
+WORKLOAD = [
+    ('get_user', 20, lambda rng, a: ('GET', f'/user/{rng.randint(1, a.users)}', None)),
+    ('get_user_achievements', 25, lambda rng, a: ('GET', f'/user/{rng.randint(1, a.users)}/achievements', None)),
+    ('get_users', 5, lambda rng, a: ('GET', '/users?limit=100', None)),
+    ('get_achievements', 5, lambda rng, a: ('GET', f'/achievements?lang={rng.choice(("ru", "en"))}', None)),
+    ('get_stats', 5, lambda rng, a: ('GET', '/stats', None)),
+    ('get_period_stats', 2, lambda rng, a: ('GET', f'/stats?{_period(rng, a)}', None)),
+    ('get_streak_users', 3, lambda rng, a: ('GET', '/stats/streaks?days=7&limit=50', None)),
+    ('get_user_daily_stats', 3, lambda rng, a: (
+        'GET', f'/user/{rng.randint(1, a.users)}/stats/daily?{_period(rng, a)}', None)),
+    ('get_leaderboard', 5, lambda rng, a: ('GET', '/leaderboard?limit=50', None)),
+    ('get_user_rank', 5, lambda rng, a: ('GET', f'/user/{rng.randint(1, a.users)}/rank?around=5', None)),
+    ('get_award_status', 2, lambda rng, a: ('GET', f'/awards/{rng.randint(1, a.users)}', None)),
+    ('get_events', 1, lambda rng, a: ('GET', f'/events?user_id={rng.randint(1, a.users)}', None)),
+    ('get_pool_status', 1, lambda rng, a: ('GET', '/internal/pool', None)),
+    ('get_metrics', 1, lambda rng, a: ('GET', '/metrics', None)),
+    ('award_achievement', 20, lambda rng, a: (
+        'POST', f'/user/{rng.randint(1, a.users)}/achieve/{rng.randint(1, a.achievements)}', None)),
+    ('award_batch', 2, lambda rng, a: ('POST', '/awards/batch', {'awards': [
+        [rng.randint(1, a.users), rng.randint(1, a.achievements)] for _ in range(a.batch_size)
+    ]})),
+    ('add_user', 5, lambda rng, a: (
+        'POST', '/user', {'username': f'load-{rng.getrandbits(64):x}', 'language': rng.choice(('ru', 'en'))})),
+    ('add_achievement', 1, lambda rng, a: ('POST', '/achievement', {
+        'name': f'load-{rng.getrandbits(64):x}', 'points': rng.choice((1, 5, 10)), 'description': 'Load achievement'
+    })),
+    ('put_achievement_translation', 1, lambda rng, a: (
+        'PUT', f'/achievement/{rng.randint(1, a.achievements)}/translations/{rng.choice(("ru", "en"))}',
+        {'name': f'load-{rng.getrandbits(32):x}', 'description': 'Load translation'})),
+    ('import_users', 1, lambda rng, a: ('POST', '/users/import', _users_csv(rng, a))),
+    ('import_achievements', 1, lambda rng, a: ('POST', '/achievements/import', _achievements_csv(rng, a))),
+]
+# Бесконечные потоки: читается только первая строка, затем соединение закрывается
+STREAMING = {'get_events'}
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, args, deadline, scenarios):
+        super().__init__(name=f'load-{index}', daemon=True)
+        self.args = args
+        self.deadline = deadline
+        self.scenarios = scenarios
+        self.rng = random.Random(args.seed + index)
+        self.samples = {}
+        self.errors = {}
+
+    def _connect(self):
+        url = urlsplit(self.args.url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(url.hostname, url.port, timeout=self.args.timeout)
+
+    def run(self):
+        names, weights, builders = zip(*self.scenarios)
+        connection = self._connect()
+        while time.monotonic() < self.deadline:
+            index = self.rng.choices(range(len(names)), weights)[0]
+            method, path, body = builders[index](self.rng, self.args)
+            if isinstance(body, str):
+                payload, headers = body.encode(), {'Content-Type': 'text/csv'}
+            elif body is not None:
+                payload, headers = json.dumps(body).encode(), {'Content-Type': 'application/json'}
+            else:
+                payload, headers = None, {}
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                if names[index] in STREAMING:
+                    response.readline()
+                    connection.close()
+                    connection = self._connect()
+                else:
+                    response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = self._connect()
+                status = 'connection_error'
+            elapsed = time.perf_counter() - started
+            self.samples.setdefault(names[index], []).append(elapsed)
+            # 404 для случайных id - ожидаемый ответ, ошибками считаются 5xx и обрывы соединения
+            if status == 'connection_error' or status >= 500:
+                errors = self.errors.setdefault(names[index], {})
+                errors[str(status)] = errors.get(str(status), 0) + 1
+        connection.close()
+
+
+def run(args):
+    scenarios = [scenario for scenario in WORKLOAD if not args.only or scenario[0] in args.only]
+    if args.read_only:
+        scenarios = [scenario for scenario in scenarios if scenario[0].startswith('get_')]
+    deadline = time.monotonic() + args.warmup + args.duration
+    workers = [Worker(index, args, deadline, scenarios) for index in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+    if args.warmup:
+        time.sleep(args.warmup)
+        # Прогрев (кэши, пул соединений) не попадает в результаты
+        for worker in workers:
+            worker.samples, worker.errors = {}, {}
+    started = time.monotonic()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    samples, errors = {}, {}
+    for worker in workers:
+        for name, values in worker.samples.items():
+            samples.setdefault(name, []).extend(values)
+        for name, counts in worker.errors.items():
+            merged = errors.setdefault(name, {})
+            for status, count in counts.items():
+                merged[status] = merged.get(status, 0) + count
+    return {
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration': elapsed,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'samples': samples,
+        'errors': errors
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Смешанная нагрузка на API достижений.')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--users', type=int, default=10000, help='Диапазон id пользователей, как у bench.generate.')
+    parser.add_argument('--achievements', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=60, help='Секунд измерения.')
+    parser.add_argument('--warmup', type=float, default=5, help='Секунд прогрева перед измерением.')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--only', nargs='*', help='Запускать только перечисленные сценарии.')
+    parser.add_argument('--read-only', action='store_true', help='Только GET-сценарии.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='bench_results.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(result, f)
+    total = sum(len(values) for values in result['samples'].values())
+    print(f'{total} requests in {result["duration"]:.1f}s, results written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Отчёт по результатам bench.load: p50/p95/p99 и пропускная способность по эндпоинтам.
+
+Сравнивает результаты с сохранённым baseline и завершается с кодом 1, если
+перцентили выросли или пропускная способность упала больше допустимого.
+
+    python -m bench.report bench_results.json --baseline bench/baseline.json
+    python -m bench.report bench_results.json --baseline bench/baseline.json --save-baseline
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """Перцентиль методом ближайшего ранга."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(result):
+    """Сводка по эндпоинтам: число запросов, ошибки, rps и перцентили задержки в мс."""
+    summary = {}
+    for name, values in sorted(result['samples'].items()):
+        values = sorted(values)
+        summary[name] = {
+            'requests': len(values),
+            'errors': sum(result.get('errors', {}).get(name, {}).values()),
+            'rps': round(len(values) / result['duration'], 2),
+            **{f'p{p}': round(percentile(values, p) * 1000, 2) for p in PERCENTILES}
+        }
+    return summary
+
+
+def compare(summary, baseline, latency_tolerance, throughput_tolerance):
+    """Регрессии относительно baseline: список строк с описанием."""
+    regressions = []
+    for name, current in summary.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for p in PERCENTILES:
+            key = f'p{p}'
+            if previous[key] and current[key] > previous[key] * (1 + latency_tolerance):
+                regressions.append(f'{name} {key}: {previous[key]} ms -> {current[key]} ms')
+        if previous['rps'] and current['rps'] < previous['rps'] * (1 - throughput_tolerance):
+            regressions.append(f'{name} rps: {previous["rps"]} -> {current["rps"]}')
+        if current['errors'] > previous.get('errors', 0):
+            regressions.append(f'{name} errors: {previous.get("errors", 0)} -> {current["errors"]}')
+    return regressions
+
+
+def _delta(current, previous):
+    if not previous:
+        return ''
+    return f' ({(current - previous) / previous * 100:+.0f}%)'
+
+
+def render(summary, baseline):
+    columns = ['requests', 'errors', 'rps'] + [f'p{p}' for p in PERCENTILES]
+    header = f'{"endpoint":<24}' + ''.join(f'{column:>18}' for column in columns)
+    lines = [header, '-' * len(header)]
+    for name, row in summary.items():
+        previous = baseline.get(name, {})
+        cells = [str(row['requests']), str(row['errors'])]
+        for column in columns[2:]:
+            cells.append(f'{row[column]}{_delta(row[column], previous.get(column))}')
+        lines.append(f'{name:<24}' + ''.join(f'{cell:>18}' for cell in cells))
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Отчёт и сравнение с baseline по результатам bench.load.')
+    parser.add_argument('results')
+    parser.add_argument('--baseline', default=os.path.join(os.path.dirname(__file__), 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='Сохранить текущую сводку как baseline.')
+    parser.add_argument('--latency-tolerance', type=float, default=0.2,
+                        help='Допустимый рост перцентилей задержки, доля (0.2 = 20%%).')
+    parser.add_argument('--throughput-tolerance', type=float, default=0.2,
+                        help='Допустимое падение rps, доля.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.results) as f:
+        summary = summarize(json.load(f))
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(render(summary, baseline))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    if not baseline:
+        print(f'No baseline at {args.baseline}, run with --save-baseline to store one')
+        return 0
+    regressions = compare(summary, baseline, args.latency_tolerance, args.throughput_tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
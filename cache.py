@@ -0,0 +1,225 @@
+import functools
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.test import EnvironBuilder
+
+from replicas import replica_router
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1024
+# Сколько версий тегов хранит MemoryBackend на одну запись кэша
+TAGS_PER_ENTRY = 4
+# Ключ окружения WSGI, которым фоновое обновление просит маршрут посчитать ответ заново;
+# из HTTP-запроса его передать нельзя
+REFRESH_ENVIRON_KEY = 'response_cache.refresh'
+
+
+class MemoryBackend:
+    """LRU-кэш в памяти процесса.
+
+    Версии тегов тоже ограничены: хранятся max_tags последних изменённых.
+    Версия - значение общего счётчика на момент инвалидации, а у вытесненного
+    тега она считается равной наибольшей вытесненной версии. Поэтому
+    вытеснение тега может только сделать запись устаревшей, но не вернуть
+    актуальность записи, посчитанной до инвалидации.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_tags=None):
+        self.max_entries = max_entries
+        self.max_tags = max_tags or max_entries * TAGS_PER_ENTRY
+        self._entries = OrderedDict()
+        self._tags = OrderedDict()
+        self._clock = 0
+        self._evicted_version = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, ttl):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def tag_versions(self, tags):
+        with self._lock:
+            return {tag: self._tags.get(tag, self._evicted_version) for tag in tags}
+
+    def bump_tags(self, tags):
+        with self._lock:
+            self._clock += 1
+            for tag in tags:
+                self._tags[tag] = self._clock
+                self._tags.move_to_end(tag)
+            while len(self._tags) > self.max_tags:
+                _, version = self._tags.popitem(last=False)
+                self._evicted_version = max(self._evicted_version, version)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._clock = self._evicted_version = 0
+
+
+class RedisBackend:
+    """Общий для всех процессов кэш в Redis; требует установленного пакета redis."""
+
+    def __init__(self, url, prefix='response-cache:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, entry, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(entry), ex=max(int(ttl), 1))
+
+    def tag_versions(self, tags):
+        tags = list(tags)
+        if not tags:
+            return {}
+        values = self.client.mget([f'{self.prefix}tag:{tag}' for tag in tags])
+        return {tag: int(value or 0) for tag, value in zip(tags, values)}
+
+    def bump_tags(self, tags):
+        pipeline = self.client.pipeline()
+        for tag in tags:
+            pipeline.incr(f'{self.prefix}tag:{tag}')
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    """Кэш ответов GET-маршрутов с инвалидацией по тегам.
+
+    Запись хранит версии своих тегов на момент вычисления ответа; invalidate
+    увеличивает версии, после чего запись считается устаревшей. Для маршрутов
+    с stale_ttl устаревшая запись ещё stale_ttl секунд отдаётся клиентам, пока
+    ответ пересчитывается в фоновом потоке (stale-while-revalidate).
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.enabled = True
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+
+    def init_app(self, app):
+        name = app.config.get('CACHE_BACKEND', 'memory')
+        self.enabled = name != 'none'
+        if name == 'redis':
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+        else:
+            self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+
+    def invalidate(self, *tags):
+        if tags:
+            self.backend.bump_tags(set(tags))
+
+    def clear(self):
+        self.backend.clear()
+
+    @staticmethod
+    def _key():
+        # Accept-Language - тексты каталога достижений переводятся на язык клиента
+        accept, language = request.headers.get('Accept', ''), request.headers.get('Accept-Language', '')
+        return f'{request.method}:{request.full_path}:{accept}:{language}'
+
+    def _render(self, view, kwargs, tags):
+        """Вызывает обработчик и возвращает ответ и запись для кэша (или None, если кэшировать нельзя)."""
+        versions = self.backend.tag_versions(tags)
+        response = current_app.make_response(view(**kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response, None
+        entry = {
+            'body': response.get_data(),
+            'headers': [(name, value) for name, value in response.headers if name != 'Content-Length'],
+            'created': time.time(),
+            'versions': versions
+        }
+        return response, entry
+
+    def _refresh_in_background(self, key, path, headers):
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        app = current_app._get_current_object()
+
+        def refresh():
+            # Запрос проходит весь конвейер Flask (before/after_request: маршрутизация по репликам и шардам,
+            # id запроса в логах, метрики); маршрут сам пересчитывает и сохраняет ответ
+            environ = EnvironBuilder(path=path, headers=headers).get_environ()
+            environ[REFRESH_ENVIRON_KEY] = True
+            try:
+                with app.request_context(environ):
+                    app.full_dispatch_request()
+            except Exception:
+                logger.exception('Background refresh of %s failed', path)
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='cache-refresh', daemon=True).start()
+
+    def cached(self, tags, ttl=30, stale_ttl=0):
+        """Декоратор маршрута.
+
+        tags - список тегов, в которых можно ссылаться на аргументы маршрута:
+        'user:{user_id}'. ttl - сколько секунд ответ свежий, stale_ttl - сколько
+        ещё секунд после ttl или инвалидации его можно отдавать, обновляя в фоне.
+        Запросы, требующие свежих данных, идут мимо кэша (см. ReplicaRouter.skip_cache),
+        ответ, прочитанный с реплики, свеж не дольше её допустимого отставания
+        (ReplicaRouter.cache_ttl).
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**kwargs):
+                refresh = request.environ.get(REFRESH_ENVIRON_KEY)
+                if refresh:
+                    # Фоновое обновление читает с основного сервера, иначе новый ответ нельзя было бы сохранить
+                    replica_router.use_primary()
+                if not self.enabled or request.method != 'GET' or replica_router.skip_cache():
+                    return view(**kwargs)
+                entry_tags = [tag.format(**kwargs) for tag in tags]
+                key = self._key()
+                lifetime = ttl + stale_ttl
+                # Фоновое обновление устаревшей записи всегда считает ответ заново
+                entry = None if refresh else self.backend.get(key)
+                if entry is not None:
+                    age = time.time() - entry['created']
+                    current = self.backend.tag_versions(entry_tags) == entry['versions']
+                    if current and age < entry.get('ttl', ttl):
+                        return current_app.response_class(entry['body'], headers=entry['headers'])
+                    if stale_ttl and age < lifetime:
+                        self._refresh_in_background(key, request.full_path, list(request.headers))
+                        return current_app.response_class(entry['body'], headers=entry['headers'])
+
+                response, entry = self._render(view, kwargs, entry_tags)
+                if entry is not None:
+                    entry['ttl'] = replica_router.cache_ttl(ttl)
+                    self.backend.set(key, entry, lifetime)
+                return response
+            return wrapper
+        return decorator
+
+
+cache = ResponseCache()
@@ -0,0 +1,177 @@
+import os
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect
+from sqlalchemy_utils import create_database, database_exists
+
+from importer import CONFLICT_POLICIES, DEFAULT_CHUNK_SIZE, FORMATS, IMPORT_SPECS, ImportFileError, \
+    import_records, iter_records
+from models import db
+from partitions import DEFAULT_MONTHS_AHEAD, archive_partitions, ensure_partitions, is_partitioned, \
+    list_partitions, month_start
+from sharding import shard_router
+from stats import rebuild_daily_stats, rebuild_user_stats, verify_user_stats
+
+# Ревизия, соответствующая схеме баз, созданных db.create_all() до появления миграций
+INITIAL_REVISION = 'd052ee39fb78'
+
+
+def bootstrap_database(months_ahead=DEFAULT_MONTHS_AHEAD, log=click.echo):
+    """Создаёт базу, если её нет, применяет миграции и создаёт секции таблицы выдач.
+
+    С шардированием то же повторяется для каждого шарда из DATABASE_SHARD_URLS.
+    """
+    url = current_app.config['SQLALCHEMY_DATABASE_URI']
+    if not database_exists(url):
+        create_database(url)
+        log('Database created')
+    tables = inspect(db.engine).get_table_names()
+    if 'user' in tables and 'alembic_version' not in tables:
+        # База создана db.create_all() до появления миграций
+        stamp(revision=INITIAL_REVISION)
+        log(f'Existing schema stamped as {INITIAL_REVISION}')
+    upgrade()
+    for key in shard_router.shards:
+        url = current_app.config['SQLALCHEMY_BINDS'][key]
+        if not database_exists(url):
+            create_database(url)
+            log(f'Shard {key} created')
+        upgrade(x_arg=[f'bind={key}'])
+    for key in shard_router.each():
+        created = ensure_partitions(months_ahead)
+        if created:
+            log(f'Created partitions{f" on {key}" if key else ""}: {", ".join(created)}')
+    shard_router.sync_catalog()
+
+
+def set_commands(app):
+    @app.cli.command('bootstrap')
+    @click.option('--months-ahead', default=None, type=int,
+                  help='На сколько месяцев вперёд создать секции; по умолчанию AWARD_PARTITIONS_AHEAD.')
+    def bootstrap(months_ahead):
+        """Готовит базу к работе: создаёт её, применяет миграции и создаёт секции. Запускать перед воркерами."""
+        if months_ahead is None:
+            months_ahead = current_app.config.get('AWARD_PARTITIONS_AHEAD', DEFAULT_MONTHS_AHEAD)
+        bootstrap_database(months_ahead)
+        click.echo('Database is up to date')
+
+    stats_cli = AppGroup('stats', help='Обслуживание агрегатов статистики.')
+
+    @stats_cli.command('rebuild')
+    def stats_rebuild():
+        """Пересобирает таблицу UserStats по истории выдач достижений."""
+        # С шардированием агрегаты пересобираются на каждом шарде по его выдачам
+        total = sum(rebuild_user_stats() for _ in shard_router.each())
+        click.echo(f'UserStats rebuilt: {total} users')
+
+    @stats_cli.command('rebuild-daily')
+    @click.option('--since', default=None, type=click.DateTime(formats=['%Y-%m-%d']),
+                  help='Пересобрать дни начиная с этого (YYYY-MM-DD); по умолчанию - всю историю.')
+    def stats_rebuild_daily(since):
+        """Пересобирает дневные итоги UserDailyStats по истории выдач.
+
+        После архивации секций пересобирайте только дни после архива (--since),
+        иначе итоги архивных дней пропадут вместе с их выдачами.
+        """
+        first_day = since.date().toordinal() if since else None
+        total = sum(rebuild_daily_stats(first_day) for _ in shard_router.each())
+        click.echo(f'UserDailyStats rebuilt: {total} rows')
+
+    @stats_cli.command('verify')
+    @click.option('--limit', default=20, show_default=True, help='Сколько расхождений вывести.')
+    def stats_verify(limit):
+        """Сверяет UserStats с пересчётом по истории выдач достижений."""
+        mismatches = [mismatch for _ in shard_router.each() for mismatch in verify_user_stats()]
+        for mismatch in mismatches[:limit]:
+            click.echo(f'user_id={mismatch["user_id"]} expected={mismatch["expected"]} actual={mismatch["actual"]}')
+        if mismatches:
+            raise click.ClickException(f'{len(mismatches)} users have inconsistent stats, run "flask stats rebuild"')
+        click.echo('UserStats is consistent')
+
+    app.cli.add_command(stats_cli)
+
+    @app.cli.command('import')
+    @click.argument('kind', type=click.Choice(list(IMPORT_SPECS)))
+    @click.argument('file', type=click.File('rb'))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+                  help='Формат файла; по умолчанию определяется по расширению.')
+    @click.option('--on-conflict', type=click.Choice(CONFLICT_POLICIES), default='skip', show_default=True,
+                  help='Что делать с уже существующими username/name.')
+    @click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Строк в одной транзакции.')
+    def import_file(kind, file, fmt, on_conflict, chunk_size):
+        """Импортирует пользователей или достижения из CSV/NDJSON файла."""
+        fmt = fmt or ('csv' if file.name.endswith('.csv') else 'ndjson')
+
+        def progress(counters):
+            click.echo(f'processed={counters["processed"]} written={counters["written"]} '
+                       f'skipped={counters["skipped"]} invalid={counters["invalid"]}')
+
+        try:
+            counters = import_records(kind, iter_records(file, fmt), on_conflict, chunk_size, progress)
+        except ImportFileError as e:
+            raise click.ClickException(str(e))
+        for error in counters['errors']:
+            click.echo(f'record {error["record"]}: {error["error"]}', err=True)
+        click.echo(f'Import finished: {counters["written"]} of {counters["processed"]} records written')
+
+    partitions_cli = AppGroup('partitions', help='Обслуживание месячных секций таблицы выдач (PostgreSQL).')
+
+    @partitions_cli.command('create')
+    @click.option('--months-ahead', default=DEFAULT_MONTHS_AHEAD, show_default=True,
+                  help='На сколько месяцев вперёд создать секции.')
+    def partitions_create(months_ahead):
+        """Создаёт недостающие секции с текущего месяца; воркеры делают это сами (AWARD_PARTITIONS_CHECK_SECONDS)."""
+        created = [name for _ in shard_router.each() for name in ensure_partitions(months_ahead)]
+        click.echo(f'Created partitions: {", ".join(created)}' if created else 'All partitions exist')
+
+    @partitions_cli.command('list')
+    def partitions_list():
+        """Выводит месячные секции таблицы выдач."""
+        for key in shard_router.each():
+            if not is_partitioned():
+                raise click.ClickException('Table user_achievement is not partitioned')
+            for name, month in list_partitions():
+                click.echo(f'{key} {name} {month:%Y-%m}' if key else f'{name} {month:%Y-%m}')
+
+    @partitions_cli.command('archive')
+    @click.option('--before', required=True, type=click.DateTime(formats=['%Y-%m']),
+                  help='Архивировать месяцы раньше этого (YYYY-MM).')
+    @click.option('--output-dir', required=True, type=click.Path(file_okay=False),
+                  help='Каталог для выгрузок <секция>.csv.gz.')
+    @click.option('--keep', is_flag=True, help='Оставить отсоединённые таблицы вместо удаления.')
+    def partitions_archive(before, output_dir, keep):
+        """Отсоединяет секции старше --before, выгружает их в CSV и удаляет.
+
+        Агрегаты UserStats сохраняют архивные выдачи; "flask stats rebuild"
+        после архивации пересчитает их только по оставшейся истории.
+        """
+        before = month_start(before)
+        if before > month_start(datetime.utcnow()):
+            raise click.BadParameter('must not be later than the current month', param_hint='--before')
+        exported = []
+        for key in shard_router.each():
+            if not is_partitioned():
+                raise click.ClickException('Table user_achievement is not partitioned')
+            # Имена секций на шардах совпадают, поэтому выгрузки шарда лежат в своём подкаталоге
+            exported += archive_partitions(before, os.path.join(output_dir, key) if key else output_dir,
+                                           drop=not keep,
+                                           progress=lambda name, path: click.echo(f'{name} -> {path}'))
+        click.echo(f'Archived partitions: {len(exported)}')
+
+    app.cli.add_command(partitions_cli)
+
+    shards_cli = AppGroup('shards', help='Обслуживание шардов (DATABASE_SHARD_URLS).')
+
+    @shards_cli.command('sync-catalog')
+    def shards_sync_catalog():
+        """Копирует каталог достижений из основной базы на все шарды."""
+        if not shard_router.enabled:
+            raise click.ClickException('Sharding is not configured')
+        shard_router.sync_catalog()
+        click.echo(f'Catalog copied to {len(shard_router.shards)} shards')
+
+    app.cli.add_command(shards_cli)
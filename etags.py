@@ -0,0 +1,75 @@
+import functools
+
+from flask import current_app, g, request
+from sqlalchemy import func, select
+
+from models import DataVersion, User, UserStats, db
+from pagination import requested_language, wants_ndjson
+from stats import insert_for
+
+CATALOG = 'catalog'
+
+
+def bump_version(name, session=None):
+    """Увеличивает версию данных в текущей транзакции; коммит остаётся за вызывающим кодом."""
+    session = session or db.session
+    stmt = insert_for(DataVersion, session).values(name=name, value=1)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[DataVersion.name],
+        set_={'value': DataVersion.value + 1}
+    ))
+
+
+def _catalog_version_query():
+    return select(func.coalesce(func.max(DataVersion.value), 0)).where(DataVersion.name == CATALOG).scalar_subquery()
+
+
+def current_catalog_version():
+    """Версия каталога достижений; в пределах запроса читается из базы один раз."""
+    if 'catalog_version' not in g:
+        g.catalog_version = db.session.execute(select(_catalog_version_query())).scalar()
+    return g.catalog_version
+
+
+def catalog_version():
+    """ETag каталога достижений."""
+    return f'catalog-{current_catalog_version()}'
+
+
+def user_achievements_version(user_id):
+    """ETag достижений пользователя: счётчик его выдач, версия каталога и язык пользователя одним запросом."""
+    awards = select(func.coalesce(func.max(UserStats.achievements_count), 0)) \
+        .where(UserStats.user_id == user_id).scalar_subquery()
+    language = select(User.language).where(User.id == user_id).scalar_subquery()
+    count, g.catalog_version, language = db.session.execute(
+        select(awards, _catalog_version_query(), language)
+    ).one()
+    return f'user-{user_id}-{count}-catalog-{g.catalog_version}-{language}'
+
+
+def etag(version):
+    """Декоратор маршрута: ETag по версии данных и 304 на совпадающий If-None-Match.
+
+    version(**view_args) должна быть дешёвой - на 304 обработчик не вызывается
+    и данные не читаются.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            tag = version(**kwargs)
+            if wants_ndjson():
+                tag += '-ndjson'
+            # Тексты каталога переводятся на язык клиента
+            language = requested_language()
+            if language:
+                tag += f'-{language}'
+            if request.if_none_match.contains(tag):
+                response = current_app.response_class(status=304)
+                response.set_etag(tag)
+                return response
+            response = current_app.make_response(view(**kwargs))
+            if response.status_code == 200:
+                response.set_etag(tag)
+            return response
+        return wrapper
+    return decorator
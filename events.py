@@ -0,0 +1,262 @@
+import atexit
+import logging
+import os
+import queue
+import re
+import select
+import threading
+import time
+from collections import deque
+from itertools import count
+
+from sqlalchemy import create_engine, func
+from sqlalchemy import select as sql_select
+from sqlalchemy.pool import NullPool
+
+from awards import on_awards_committed
+from models import db
+from serializers import dumps, loads
+
+DEFAULT_BUFFER_SIZE = 1000
+DEFAULT_HISTORY_SIZE = 10000
+DEFAULT_KEEPALIVE_SECONDS = 15
+# Каждый открытый поток занимает поток воркера: у воркера должно оставаться больше потоков, см. README
+DEFAULT_MAX_CLIENTS = 50
+DEFAULT_CHANNEL = 'award_events'
+EVENT_MIMETYPE = 'text/event-stream'
+# Через сколько миллисекунд браузер переподключается после обрыва потока
+RETRY_MS = 3000
+# Полезная нагрузка NOTIFY в PostgreSQL ограничена 8000 байтами
+MAX_NOTIFY_BYTES = 7500
+
+logger = logging.getLogger(__name__)
+
+
+class TooManyClients(Exception):
+    """Число подписчиков потока событий достигло EVENTS_MAX_CLIENTS."""
+
+
+class Subscription:
+    """Подписчик потока событий: фильтр и ограниченный буфер ещё не отправленных событий.
+
+    Если клиент не успевает читать и буфер заполняется, подписка помечается
+    переполненной и поток закрывается; клиент переподключается с
+    Last-Event-ID и дочитывает пропущенное из истории.
+    """
+
+    def __init__(self, user_id=None, achievement_id=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.user_id = user_id
+        self.achievement_id = achievement_id
+        self.events = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def matches(self, event):
+        return ((self.user_id is None or event['user_id'] == self.user_id) and
+                (self.achievement_id is None or event['achievement_id'] == self.achievement_id))
+
+    def offer(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+def format_event(event):
+    """Событие в формате text/event-stream (bytes)."""
+    data = dumps({key: value for key, value in event.items() if key != 'id'})
+    return b'id: %s\nevent: award\ndata: %s\n\n' % (event['id'].encode(), data)
+
+
+class EventBroadcaster:
+    """Рассылка выдач достижений подписчикам потока GET /events в памяти процесса.
+
+    Выдачи попадают сюда после коммита их транзакции (on_awards_committed).
+    Каждое событие получает id "<процесс>-<номер>" и хранится в кольцевой
+    истории из history_size событий, по которой клиент с Last-Event-ID
+    дочитывает пропущенное после переподключения.
+
+    Когда воркеров несколько, с EVENTS_PG_NOTIFY события рассылаются через
+    PostgreSQL: процесс, закоммитивший выдачи, отправляет их в NOTIFY, а
+    каждый процесс получает их фоновым потоком LISTEN и раздаёт своим
+    подписчикам. Все процессы получают уведомления в одном порядке, поэтому
+    история и id событий у них совпадают и переподключаться можно к любому.
+    """
+
+    def __init__(self):
+        self.buffer_size = DEFAULT_BUFFER_SIZE
+        self.keepalive = DEFAULT_KEEPALIVE_SECONDS
+        self.max_clients = DEFAULT_MAX_CLIENTS
+        self.notify = False
+        self.channel = DEFAULT_CHANNEL
+        self._app = None
+        self._origin = None
+        self._counter = count(1)
+        self._history = deque(maxlen=DEFAULT_HISTORY_SIZE)
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def init_app(self, app):
+        self.buffer_size = app.config.get('EVENTS_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
+        self.keepalive = app.config.get('EVENTS_KEEPALIVE_SECONDS', DEFAULT_KEEPALIVE_SECONDS)
+        self.max_clients = app.config.get('EVENTS_MAX_CLIENTS', DEFAULT_MAX_CLIENTS)
+        self.notify = app.config.get('EVENTS_PG_NOTIFY', False)
+        self.channel = app.config.get('EVENTS_CHANNEL', DEFAULT_CHANNEL)
+        if self.notify and not app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+            raise RuntimeError('EVENTS_PG_NOTIFY requires PostgreSQL')
+        if not re.fullmatch(r'[a-z_][a-z0-9_]*', self.channel):
+            raise RuntimeError(f'Invalid EVENTS_CHANNEL {self.channel!r}')
+        self._app = app
+        with self._lock:
+            self._history = deque(maxlen=app.config.get('EVENTS_HISTORY_SIZE', DEFAULT_HISTORY_SIZE))
+        if 'event_broadcaster' not in app.extensions:
+            app.extensions['event_broadcaster'] = self
+            # Поток LISTEN запускается в рабочем процессе на первом запросе, как и очередь отложенной записи
+            app.before_request(self._start_on_request)
+
+    def _start_on_request(self):
+        if self.notify and self._thread is None and not self._stopping:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._listen, name='award-events', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping = True
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    @property
+    def clients(self):
+        return len(self._subscriptions)
+
+    def publish(self, rows):
+        """Присваивает выдачам id событий и рассылает их: через NOTIFY или сразу подписчикам процесса."""
+        if self._origin is None:
+            self._origin = f'{os.getpid():x}{int(time.time()) & 0xffff:04x}'
+        events = [{
+            'id': f'{self._origin}-{next(self._counter)}',
+            'user_id': row['user_id'],
+            'achievement_id': row['achievement_id'],
+            'points': row['points'],
+            'date_awarded': row['date_awarded']
+        } for row in rows]
+        if self.notify:
+            self._send_notify(events)
+        else:
+            self.broadcast(events)
+
+    def broadcast(self, events):
+        """Добавляет события в историю и раскладывает их по буферам подходящих подписчиков."""
+        with self._lock:
+            self._history.extend(events)
+            for subscription in self._subscriptions:
+                for event in events:
+                    if subscription.matches(event):
+                        subscription.offer(event)
+
+    def subscribe(self, user_id=None, achievement_id=None, last_event_id=None):
+        """Регистрирует подписчика; возвращает подписку и события истории после last_event_id.
+
+        Подписка и снимок истории берутся под одной блокировкой с рассылкой,
+        поэтому между историей и буфером событий нет ни пропусков, ни повторов.
+        Если last_event_id уже вытеснен из истории или не известен процессу,
+        пропущенное не восстанавливается.
+        """
+        subscription = Subscription(user_id, achievement_id, self.buffer_size)
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                raise TooManyClients(f'Too many event stream clients ({self.max_clients})')
+            self._subscriptions.add(subscription)
+            backlog = []
+            if last_event_id:
+                for position in range(len(self._history) - 1, -1, -1):
+                    if self._history[position]['id'] == last_event_id:
+                        backlog = [event for event in list(self._history)[position + 1:] if subscription.matches(event)]
+                        break
+        return subscription, backlog
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stream(self, subscription, backlog):
+        """Тело ответа text/event-stream: история, затем новые события и комментарии keepalive."""
+        try:
+            yield b'retry: %d\n\n' % RETRY_MS
+            for event in backlog:
+                yield format_event(event)
+            while not subscription.overflowed:
+                try:
+                    event = subscription.events.get(timeout=self.keepalive)
+                except queue.Empty:
+                    # Комментарий не даёт прокси закрыть простаивающее соединение
+                    yield b': keepalive\n\n'
+                    continue
+                yield format_event(event)
+            logger.warning('Event stream client is too slow, closing the stream')
+        finally:
+            self.unsubscribe(subscription)
+
+    def _send_notify(self, events):
+        payloads, chunk, size = [], [], 0
+        for event in events:
+            encoded = dumps(event)
+            if chunk and size + len(encoded) + 1 > MAX_NOTIFY_BYTES:
+                payloads.append(b'[' + b','.join(chunk) + b']')
+                chunk, size = [], 0
+            chunk.append(encoded)
+            size += len(encoded) + 1
+        payloads.append(b'[' + b','.join(chunk) + b']')
+        # Отдельная короткая транзакция в основной базе: транзакция выдач к этому моменту уже закоммичена
+        with db.engine.begin() as connection:
+            for payload in payloads:
+                connection.execute(sql_select(func.pg_notify(self.channel, payload.decode())))
+
+    def _receive(self, payload):
+        try:
+            events = loads(payload)
+        except ValueError:
+            logger.warning('Skipping malformed notification on channel %s', self.channel)
+            return
+        self.broadcast(events)
+
+    def _listen(self):
+        # Соединение LISTEN живёт всё время работы процесса, поэтому оно не берётся из пула приложения
+        engine = create_engine(self._app.config['SQLALCHEMY_DATABASE_URI'], poolclass=NullPool)
+        while not self._stopping:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                driver_connection = connection.driver_connection
+                driver_connection.autocommit = True
+                with driver_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                while not self._stopping:
+                    if select.select([driver_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    driver_connection.poll()
+                    while driver_connection.notifies:
+                        self._receive(driver_connection.notifies.pop(0).payload)
+            except Exception:
+                # Уведомления, пришедшие до переподключения, теряются
+                logger.exception('Listening on channel %s failed, reconnecting', self.channel)
+                time.sleep(1)
+            finally:
+                if connection is not None:
+                    connection.close()
+        engine.dispose()
+
+
+broadcaster = EventBroadcaster()
+
+
+@on_awards_committed
+def _publish_awards(rows):
+    broadcaster.publish(rows)
@@ -0,0 +1,157 @@
+import csv
+import io
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from etags import CATALOG, bump_version
+from models import User, Achievement, db
+from sharding import shard_router
+from stats import insert_for
+
+DEFAULT_CHUNK_SIZE = 1000
+CONFLICT_POLICIES = ('skip', 'update', 'error')
+FORMATS = ('csv', 'ndjson')
+
+
+class ImportFileError(ValueError):
+    """Ошибка разбора или записи импортируемого файла."""
+
+
+class ImportFormatError(ImportFileError):
+    """Файл не разбирается в заявленном формате."""
+
+
+def _validate_user(record):
+    username, language = record.get('username'), record.get('language')
+    if not isinstance(username, str) or not 0 < len(username) <= 80:
+        raise ValueError('username must be a non-empty string up to 80 characters')
+    if language not in ('ru', 'en'):
+        raise ValueError('language must be "ru" or "en"')
+    return {'username': username, 'language': language}
+
+
+def _validate_achievement(record):
+    name, points, description = record.get('name'), record.get('points'), record.get('description')
+    if not isinstance(name, str) or not 0 < len(name) <= 80:
+        raise ValueError('name must be a non-empty string up to 80 characters')
+    if not isinstance(description, str) or len(description) > 200:
+        raise ValueError('description must be a string up to 200 characters')
+    try:
+        points = int(points)
+    except (TypeError, ValueError):
+        raise ValueError('points must be an integer')
+    return {'name': name, 'points': points, 'description': description}
+
+
+# Что импортируется: модель, уникальный ключ для политики конфликтов, проверка записи
+# и версия данных, которую нужно увеличить после записи
+IMPORT_SPECS = {
+    'users': (User, 'username', _validate_user, None),
+    'achievements': (Achievement, 'name', _validate_achievement, CATALOG),
+}
+
+
+def _iter_ndjson(text):
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ValueError(f'line {line_number}: invalid JSON')
+
+
+def _iter_csv(text):
+    # strict: незакрытая кавычка - ошибка файла, а не поле до его конца
+    reader = csv.DictReader(text, strict=True)
+    try:
+        yield from reader
+    except csv.Error as e:
+        raise ImportFormatError(f'line {reader.line_num}: invalid CSV: {e}')
+
+
+def iter_records(stream, fmt):
+    """Читает записи из бинарного потока построчно, не загружая файл в память."""
+    if fmt not in FORMATS:
+        raise ImportFileError(f'Unknown format {fmt}, expected one of {", ".join(FORMATS)}')
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    return _iter_csv(text) if fmt == 'csv' else _iter_ndjson(text)
+
+
+def _write_chunk(model, key, rows, on_conflict, version):
+    """Пишет пачку одним многострочным INSERT и коммитит её. Возвращает число вставленных строк."""
+    if model is User and shard_router.enabled:
+        # Пользователи разнесены по шардам, а уникальность username держит справочник основной базы
+        written = shard_router.import_users(rows, on_conflict)
+    else:
+        stmt = insert_for(model)
+        if on_conflict == 'skip':
+            stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+        elif on_conflict == 'update':
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[key],
+                set_={column: getattr(stmt.excluded, column) for column in rows[0] if column != key}
+            )
+        written = len(db.session.execute(stmt.returning(model.id), rows).all())
+    if written and version:
+        bump_version(version)
+    db.session.commit()
+    if written and version == CATALOG:
+        shard_router.sync_catalog()
+    return written
+
+
+def import_records(kind, records, on_conflict='skip', chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Импортирует записи пачками по chunk_size строк, каждая пачка - отдельная транзакция.
+
+    on_conflict определяет, что делать с уже существующим username/name:
+    skip - пропустить, update - обновить остальные поля, error - остановить импорт.
+    progress вызывается со счётчиками после каждой записанной пачки.
+    """
+    if on_conflict not in CONFLICT_POLICIES:
+        raise ImportFileError(f'Unknown conflict policy {on_conflict}, expected one of {", ".join(CONFLICT_POLICIES)}')
+    model, key, validate, version = IMPORT_SPECS[kind]
+    counters = {'processed': 0, 'written': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+
+    def flush(chunk):
+        try:
+            written = _write_chunk(model, key, list(chunk.values()), on_conflict, version)
+        except IntegrityError:
+            db.session.rollback()
+            raise ImportFileError(f'Duplicate {key} in chunk ending at record {counters["processed"]}, '
+                                  f'{counters["written"]} records imported before it')
+        counters['written'] += written
+        counters['skipped'] += len(chunk) - written
+        if progress:
+            progress(counters)
+
+    chunk = {}
+    for record in records:
+        counters['processed'] += 1
+        try:
+            if isinstance(record, Exception):
+                raise record
+            if not isinstance(record, dict):
+                raise ValueError('record must be an object')
+            row = validate(record)
+        except ValueError as e:
+            counters['invalid'] += 1
+            if len(counters['errors']) < 100:
+                counters['errors'].append({'record': counters['processed'], 'error': str(e)})
+            continue
+        # Повтор ключа внутри одной пачки: при skip остаётся первая запись, при update - последняя
+        if row[key] in chunk:
+            if on_conflict == 'error':
+                raise ImportFileError(f'Duplicate {key} "{row[key]}" at record {counters["processed"]}, '
+                                      f'{counters["written"]} records imported before it')
+            counters['skipped'] += 1
+            if on_conflict == 'skip':
+                continue
+        chunk[row[key]] = row
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = {}
+    if chunk:
+        flush(chunk)
+    return counters
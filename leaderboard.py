@@ -0,0 +1,266 @@
+import random
+import threading
+import time
+
+from sqlalchemy import select
+
+from awards import on_awards_committed
+from models import User, UserStats
+from sharding import shard_router
+
+DEFAULT_REFRESH_SECONDS = 300
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankIndex:
+    """Упорядоченное множество ключей с поиском позиции и элемента по позиции за O(log n).
+
+    Skip list, в котором каждая ссылка хранит ширину - сколько элементов она
+    перепрыгивает. Сумма ширин по пути поиска даёт позицию ключа.
+    """
+    MAX_LEVELS = 32
+
+    def __init__(self):
+        self.head = _Node(None, self.MAX_LEVELS)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_levels(self):
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def _find(self, key):
+        """Последние узлы перед key на каждом уровне и число элементов до них."""
+        chain = [None] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps_at_level = self._find(key)
+        levels = self._random_levels()
+        node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def bisect_left(self, key):
+        """Число ключей строго меньше key."""
+        _, steps = self._find(key)
+        return sum(steps)
+
+    def slice(self, start, count):
+        """До count ключей начиная с позиции start."""
+        if start >= self.size or count <= 0:
+            return []
+        node = self.head
+        remaining = start + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Leaderboard:
+    """Рейтинг пользователей по очкам в памяти процесса.
+
+    Строится по UserStats и обновляется после коммита каждой выдачи. Ключ
+    индекса - (-points, user_id): больше очков - выше, при равенстве выше
+    пользователь с меньшим id. Пользователи без достижений в индекс не входят
+    и делят последнее место с нулём очков. Выдачи в других процессах
+    подхватываются периодической перестройкой раз в refresh_seconds.
+    """
+
+    def __init__(self, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._index = RankIndex()
+        self._points = {}
+        self._built_at = None
+        # Пользователи, получившие очки во время перестройки; None - перестройка не идёт
+        self._touched = None
+
+    def init_app(self, app):
+        """Настраивает рейтинг для приложения; индекс строится при первом обращении к нему."""
+        self.refresh_seconds = app.config.get('LEADERBOARD_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+        with self._lock:
+            self._index, self._points, self._built_at, self._touched = RankIndex(), {}, None, None
+
+    @staticmethod
+    def _read_totals(user_ids=None):
+        """Очки пользователей из UserStats (с шардированием - со всех шардов параллельно): словарь user_id -> очки."""
+        query = select(UserStats.user_id, UserStats.points_total).where(UserStats.achievements_count > 0)
+        if user_ids is not None:
+            query = query.where(UserStats.user_id.in_(user_ids))
+        query = query.execution_options(yield_per=10000)
+
+        def read(session):
+            # Строки разбираются по мере чтения пачками yield_per, а не загружаются списком целиком
+            return {user_id: total for user_id, total in session.execute(query)}
+
+        totals = {}
+        for part in shard_router.scatter(read):
+            totals.update(part)
+        return totals
+
+    @staticmethod
+    def _set_total(index, points, user_id, total):
+        previous = points.pop(user_id, None)
+        if previous is not None:
+            index.remove((-previous, user_id))
+        if total is not None:
+            points[user_id] = total
+            index.insert((-total, user_id))
+
+    def build(self):
+        """Перестраивает индекс по текущим агрегатам UserStats.
+
+        Выдача, закоммиченная во время чтения, могла попасть в снимок, а могла и
+        нет, поэтому её очки не прибавляются к новому индексу: очки затронутых
+        пользователей перечитываются, пока за перечитывание не придут новые выдачи.
+        """
+        with self._lock:
+            self._touched = set()
+        try:
+            points = self._read_totals()
+            index = RankIndex()
+            for user_id, total in points.items():
+                index.insert((-total, user_id))
+            while True:
+                with self._lock:
+                    touched, self._touched = self._touched, set()
+                    if not touched:
+                        self._index, self._points, self._built_at = index, points, time.monotonic()
+                        return
+                totals = self._read_totals(touched)
+                for user_id in touched:
+                    self._set_total(index, points, user_id, totals.get(user_id))
+        finally:
+            with self._lock:
+                self._touched = None
+
+    def _is_stale(self):
+        return self._built_at is None or (self.refresh_seconds and
+                                          time.monotonic() - self._built_at > self.refresh_seconds)
+
+    def ensure_built(self):
+        """Строит индекс, если он ещё не построен или устарел; перестраивает один поток.
+
+        Пока устаревший индекс перестраивается, остальные запросы отвечают по нему, а не ждут.
+        """
+        if not self._is_stale():
+            return
+        if not self._build_lock.acquire(blocking=self._built_at is None):
+            return
+        try:
+            if self._is_stale():
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    def add_points(self, deltas):
+        """Прибавляет очки пользователям: deltas - словарь user_id -> очки."""
+        with self._lock:
+            if self._touched is not None:
+                self._touched.update(deltas)
+            if self._built_at is None:
+                return
+            for user_id, delta in deltas.items():
+                self._set_total(self._index, self._points, user_id, self._points.get(user_id, 0) + delta)
+
+    def __len__(self):
+        return len(self._index)
+
+    def points(self, user_id):
+        return self._points.get(user_id, 0)
+
+    def rank(self, user_id):
+        """Место пользователя: 1 + число пользователей со строго большим числом очков."""
+        with self._lock:
+            total = self._points.get(user_id)
+            if total is None:
+                return len(self._index) + 1
+            return self._index.bisect_left((-total, 0)) + 1
+
+    def position(self, user_id):
+        """Позиция пользователя в упорядоченном рейтинге, начиная с 0."""
+        with self._lock:
+            total = self._points.get(user_id)
+            if total is None:
+                return len(self._index)
+            return self._index.bisect_left((-total, user_id))
+
+    def page(self, offset, limit):
+        """Пользователи рейтинга с позиции offset: список (rank, user_id, points)."""
+        with self._lock:
+            entries = []
+            for points, user_id in self._index.slice(offset, limit):
+                rank = self._index.bisect_left((points, 0)) + 1
+                entries.append((rank, user_id, -points))
+            return entries
+
+
+leaderboard = Leaderboard()
+
+
+@on_awards_committed
+def _update_leaderboard(rows):
+    deltas = {}
+    for row in rows:
+        deltas[row['user_id']] = deltas.get(row['user_id'], 0) + row['points']
+    leaderboard.add_points(deltas)
+
+
+def usernames(user_ids):
+    """Имена пользователей одним запросом (с шардированием - по запросу на шард): словарь user_id -> username."""
+    if not user_ids:
+        return {}
+    query = select(User.id, User.username).where(User.id.in_(user_ids))
+    names = {}
+    for rows in shard_router.scatter(lambda session: session.execute(query).all()):
+        names.update(rows)
+    return names
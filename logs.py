@@ -0,0 +1,180 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+# Служебные атрибуты LogRecord; остальные (переданные через extra) попадают в JSON как поля
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_sample_rates(value):
+    """Разбирает LOG_SAMPLE_RATES: 'правило=доля,правило=доля' -> словарь правило маршрута -> доля."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        rule, _, rate = item.rpartition('=')
+        if not rule:
+            raise ValueError(f'Expected "<route rule>=<rate>", got "{item}"')
+        rates[rule] = float(rate)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, логгер, сообщение, id и маршрут запроса."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextQueueHandler(QueueHandler):
+    """Ставит записи в очередь, не форматируя их в потоке запроса.
+
+    В вызывающем потоке только подставляются аргументы сообщения (они могут
+    измениться позже) и добавляются id и маршрут запроса; JSON собирает и
+    пишет в файл поток QueueListener. При переполнении очереди запись
+    отбрасывается, а не блокирует запрос.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def filter(self, record):
+        if has_request_context():
+            if record.levelno <= logging.INFO and not g.get('log_sampled', True):
+                return False
+            record.request_id = g.get('request_id')
+            record.route = request.url_rule.rule if request.url_rule is not None else None
+        return super().filter(record)
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Асинхронный вывод логов: очередь в памяти и поток, пишущий JSON в файл с ротацией.
+
+    Каждому запросу присваивается id (из заголовка X-Request-ID или новый),
+    он добавляется ко всем записям запроса и возвращается в ответе. Записи
+    уровня INFO и ниже по маршрутам из LOG_SAMPLE_RATES пишутся только для
+    доли запросов: решение принимается один раз на запрос, поэтому записи
+    выбранного запроса не теряются по отдельности. Предупреждения и ошибки
+    пишутся всегда. Файл дописывается и ротируется по размеру; при нескольких
+    процессах каждому нужен свой LOG_FILE или вывод в stdout (LOG_FILE=-).
+    """
+
+    def __init__(self):
+        self.sample_rates = {}
+        self._handler = None
+        self._listener = None
+        self._target = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.sample_rates = parse_sample_rates(app.config.get('LOG_SAMPLE_RATES'))
+        self.configure(
+            path=app.config.get('LOG_FILE', 'app.log'),
+            level=app.config.get('LOG_LEVEL', 'INFO'),
+            queue_size=app.config.get('LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+            max_bytes=app.config.get('LOG_MAX_BYTES', DEFAULT_MAX_BYTES),
+            backup_count=app.config.get('LOG_BACKUP_COUNT', DEFAULT_BACKUP_COUNT)
+        )
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def configure(self, path='app.log', level='INFO', queue_size=DEFAULT_QUEUE_SIZE,
+                  max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+        """Подключает к корневому логгеру очередь и запускает поток записи; повторный вызов заменяет их."""
+        root = logging.getLogger()
+        with self._lock:
+            self._stop()
+            if self._handler is not None:
+                root.removeHandler(self._handler)
+            if path == '-':
+                target = logging.StreamHandler(sys.stdout)
+            else:
+                target = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            target.setFormatter(JsonFormatter())
+            self._target = target
+            self._handler = _ContextQueueHandler(queue.Queue(queue_size))
+            root.addHandler(self._handler)
+            root.setLevel(level)
+            self._start()
+
+    @property
+    def dropped(self):
+        return self._handler.dropped if self._handler is not None else 0
+
+    def _start(self):
+        self._listener = QueueListener(self._handler.queue, self._target)
+        self._listener.start()
+
+    def _stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._target is not None:
+            self._target.close()
+
+    def stop(self):
+        """Дописывает оставшиеся в очереди записи и останавливает поток записи."""
+        with self._lock:
+            self._stop()
+
+    def _after_fork(self):
+        # Поток записи не переживает fork: дочерний процесс получает свою очередь и свой поток
+        if self._listener is not None:
+            self._handler.queue = queue.Queue(self._handler.queue.maxsize)
+            self._start()
+
+    def _before_request(self):
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        rate = self.sample_rates.get(request.url_rule.rule) if request.url_rule is not None else None
+        g.log_sampled = rate is None or random.random() < rate
+
+    def _after_request(self, response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
+
+
+log_pipeline = LogPipeline()
+atexit.register(log_pipeline.stop)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=log_pipeline._after_fork)
@@ -0,0 +1,184 @@
+import bisect
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from pool import WAIT_BUCKETS_MS, pool_stats
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+DEFAULT_SLOW_QUERY_MS = 200
+DEFAULT_SLOW_REQUEST_MS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts, total = self._values.get(label_values, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[label_values] = counts, total + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    bucket_labels = _labels(self.labels + ('le',), label_values + (bound,))
+                    lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """Метрики запросов и SQL в формате Prometheus.
+
+    Маршрут в метках - шаблон правила ('/user/<int:user_id>'), а не путь, чтобы
+    число рядов не зависело от id. SQL-запросы считаются событиями движка
+    SQLAlchemy и относятся к текущему запросу Flask; запросы дольше
+    slow_query_ms и ответы дольше slow_request_ms пишутся в лог. Метрики
+    хранятся в памяти процесса, каждый воркер отдаёт свои.
+    """
+
+    def __init__(self):
+        self.slow_query_ms = DEFAULT_SLOW_QUERY_MS
+        self.slow_request_ms = DEFAULT_SLOW_REQUEST_MS
+        self.requests = Counter('http_requests_total', 'HTTP requests by route, method and status',
+                                ('route', 'method', 'status'))
+        self.latency = Histogram('http_request_duration_seconds', 'HTTP request latency',
+                                 LATENCY_BUCKETS, ('route', 'method'))
+        self.sql_statements = Histogram('http_request_sql_statements', 'SQL statements per HTTP request',
+                                        STATEMENT_BUCKETS, ('route',))
+        self.sql_duration = Histogram('http_request_sql_duration_seconds', 'SQL time per HTTP request',
+                                      LATENCY_BUCKETS, ('route',))
+        self.slow_queries = Counter('sql_slow_queries_total', 'SQL statements slower than the threshold', ('route',))
+
+    def init_app(self, app):
+        self.slow_query_ms = app.config.get('METRICS_SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+        self.slow_request_ms = app.config.get('METRICS_SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    @staticmethod
+    def _route():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    def _after_request(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = self._route()
+        self.requests.inc(route, request.method, response.status_code)
+        self.latency.observe(elapsed, route, request.method)
+        self.sql_statements.observe(g.sql_statements, route)
+        self.sql_duration.observe(g.sql_seconds, route)
+        if elapsed * 1000 >= self.slow_request_ms:
+            logger.warning('Slow request %s %s: %.0f ms, %s SQL statements in %.0f ms', request.method,
+                           request.full_path, elapsed * 1000, g.sql_statements, g.sql_seconds * 1000)
+        return response
+
+    def record_query(self, statement, seconds):
+        in_request = has_request_context() and 'sql_statements' in g
+        if in_request:
+            g.sql_statements += 1
+            g.sql_seconds += seconds
+        if seconds * 1000 >= self.slow_query_ms:
+            route = self._route() if in_request else 'background'
+            self.slow_queries.inc(route)
+            logger.warning('Slow query (%.0f ms, %s): %s', seconds * 1000, route, ' '.join(statement.split())[:1000])
+
+    def render(self):
+        lines = []
+        for metric in (self.requests, self.latency, self.sql_statements, self.sql_duration, self.slow_queries):
+            lines.extend(metric.render())
+        lines.extend(self._render_pool())
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_pool():
+        snapshot = pool_stats.snapshot()
+        wait = snapshot['wait_ms']
+        lines = [
+            '# HELP db_pool_checkouts_total Connections handed out by the pool',
+            '# TYPE db_pool_checkouts_total counter',
+            f'db_pool_checkouts_total {snapshot["checkouts"]}',
+            '# HELP db_pool_timeouts_total Connection checkouts that timed out',
+            '# TYPE db_pool_timeouts_total counter',
+            f'db_pool_timeouts_total {snapshot["timeouts"]}',
+            '# HELP db_pool_wait_seconds Time spent waiting for a pooled connection',
+            '# TYPE db_pool_wait_seconds histogram',
+        ]
+        for bound in WAIT_BUCKETS_MS + ('+Inf',):
+            le = bound if bound == '+Inf' else bound / 1000
+            lines.append(f'db_pool_wait_seconds_bucket{{le="{le}"}} {wait["buckets"][str(bound)]}')
+        lines.append(f'db_pool_wait_seconds_sum {wait["sum"] / 1000}')
+        lines.append(f'db_pool_wait_seconds_count {wait["buckets"]["+Inf"]}')
+        return lines
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    metrics.record_query(statement, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
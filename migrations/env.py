@@ -11,11 +11,16 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# Логгеры приложения остаются включены: миграции запускаются и из flask bootstrap
+fileConfig(config.config_file_name, disable_existing_loggers=False)
 logger = logging.getLogger('alembic.env')
 
 
 def get_engine():
+    # -x bind=shard_0 применяет миграции к шарду (см. commands.bootstrap_database)
+    bind = context.get_x_argument(as_dictionary=True).get('bind')
+    if bind:
+        return current_app.extensions['migrate'].db.engines[bind]
     try:
         # this works with Flask-SQLAlchemy<3 and Alchemical
         return current_app.extensions['migrate'].db.get_engine()
@@ -0,0 +1,113 @@
+"""user stats and data versions
+
+Таблицы user_stats (агрегаты и серии по пользователю) и data_version.
+user_stats заполняется по существующей истории выдач так же, как
+stats.rebuild_user_stats; дальше обновляется вместе с каждой выдачей.
+
+Revision ID: 1f6b2d9c4a57
+Revises: d052ee39fb78
+Create Date: 2026-10-18 12:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1f6b2d9c4a57'
+down_revision = 'd052ee39fb78'
+branch_labels = None
+depends_on = None
+
+user_achievement = sa.table(
+    'user_achievement',
+    sa.column('user_id', sa.Integer()),
+    sa.column('date_awarded', sa.DateTime())
+)
+user_stats = sa.table(
+    'user_stats',
+    sa.column('user_id', sa.Integer()),
+    sa.column('last_award_day', sa.Integer()),
+    sa.column('current_streak', sa.Integer()),
+    sa.column('best_streak', sa.Integer())
+)
+
+
+def _streaks(days):
+    """Текущая и лучшая серии по отсортированным номерам дней, как stats._streaks."""
+    current = best = 0
+    previous = None
+    for day in days:
+        if previous is not None and day == previous:
+            continue
+        current = current + 1 if previous is not None and day == previous + 1 else 1
+        best = max(best, current)
+        previous = day
+    return current, best, previous
+
+
+def _iter_user_streaks(bind):
+    """Серии по истории выдач: (user_id, current_streak, best_streak, last_award_day)."""
+    rows = bind.execute(sa.select(user_achievement.c.user_id, user_achievement.c.date_awarded)
+                        .order_by(user_achievement.c.user_id, user_achievement.c.date_awarded))
+    user_id, days = None, []
+    for row in rows:
+        if row.user_id != user_id:
+            if days:
+                yield (user_id,) + _streaks(days)
+            user_id, days = row.user_id, []
+        days.append(row.date_awarded.date().toordinal())
+    if days:
+        yield (user_id,) + _streaks(days)
+
+
+def _backfill_streaks(bind):
+    stmt = user_stats.update().where(user_stats.c.user_id == sa.bindparam('b_user_id')).values(
+        current_streak=sa.bindparam('b_current_streak'),
+        best_streak=sa.bindparam('b_best_streak'),
+        last_award_day=sa.bindparam('b_last_award_day')
+    )
+    batch = [{'b_user_id': user_id, 'b_current_streak': current,
+              'b_best_streak': best, 'b_last_award_day': last_day}
+             for user_id, current, best, last_day in list(_iter_user_streaks(bind))]
+    if batch:
+        bind.execute(stmt, batch)
+
+
+def upgrade():
+    op.create_table(
+        'user_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('achievements_count', sa.Integer(), nullable=False),
+        sa.Column('points_total', sa.Integer(), nullable=False),
+        sa.Column('last_awarded', sa.DateTime(), nullable=True),
+        sa.Column('last_award_day', sa.Integer(), nullable=True),
+        sa.Column('current_streak', sa.Integer(), nullable=False),
+        sa.Column('best_streak', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_user_stats_achievements_count', 'user_stats', ['achievements_count'])
+    op.create_index('ix_user_stats_points_total', 'user_stats', ['points_total'])
+    op.create_index('ix_user_stats_best_streak_user_id', 'user_stats', ['best_streak', 'user_id'])
+    op.create_table(
+        'data_version',
+        sa.Column('name', sa.String(length=40), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    # Агрегаты по истории выдач - тот же запрос, что stats._aggregate_query
+    op.execute('INSERT INTO user_stats (user_id, achievements_count, points_total, last_awarded, '
+               'current_streak, best_streak) '
+               'SELECT ua.user_id, COUNT(ua.id), SUM(a.points), MAX(ua.date_awarded), 0, 0 '
+               'FROM user_achievement ua JOIN achievement a ON a.id = ua.achievement_id '
+               'GROUP BY ua.user_id')
+    _backfill_streaks(op.get_bind())
+
+
+def downgrade():
+    op.drop_table('data_version')
+    op.drop_index('ix_user_stats_best_streak_user_id', table_name='user_stats')
+    op.drop_index('ix_user_stats_points_total', table_name='user_stats')
+    op.drop_index('ix_user_stats_achievements_count', table_name='user_stats')
+    op.drop_table('user_stats')
@@ -0,0 +1,50 @@
+"""user daily stats rollup
+
+Таблица user_daily_stats - выдачи и очки пользователя по дням (номер дня -
+date.toordinal() даты выдачи). Заполняется по существующей истории выдач;
+дальше обновляется вместе с каждой выдачей.
+
+Revision ID: 3a9d5c7e1f08
+Revises: e7b3f0a19c42
+Create Date: 2026-10-18 18:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a9d5c7e1f08'
+down_revision = 'e7b3f0a19c42'
+branch_labels = None
+depends_on = None
+
+# Номер дня в счёте date.toordinal(), как stats.day_number
+DAY_NUMBER = {
+    'postgresql': "(CAST(ua.date_awarded AS DATE) - DATE '0001-01-01' + 1)",
+    'sqlite': 'CAST(julianday(date(ua.date_awarded)) - 1721424.5 AS INTEGER)',
+}
+
+
+def upgrade():
+    op.create_table(
+        'user_daily_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Integer(), nullable=False),
+        sa.Column('award_count', sa.Integer(), nullable=False),
+        sa.Column('points', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+    op.create_index('ix_user_daily_stats_day_user_id', 'user_daily_stats', ['day', 'user_id'])
+    day = DAY_NUMBER.get(op.get_bind().dialect.name)
+    if day is not None:
+        op.execute(f'INSERT INTO user_daily_stats (user_id, day, award_count, points) '
+                   f'SELECT ua.user_id, {day}, COUNT(*), SUM(a.points) '
+                   f'FROM user_achievement ua JOIN achievement a ON a.id = ua.achievement_id '
+                   f'GROUP BY ua.user_id, {day}')
+
+
+def downgrade():
+    op.drop_index('ix_user_daily_stats_day_user_id', table_name='user_daily_stats')
+    op.drop_table('user_daily_stats')
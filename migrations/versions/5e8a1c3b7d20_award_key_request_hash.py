@@ -0,0 +1,29 @@
+"""award key request hash
+
+Колонка award_key.request_hash - хеш элементов пачки, записанной с ключом
+идемпотентности: повтор ключа с другой пачкой отклоняется.
+
+Revision ID: 5e8a1c3b7d20
+Revises: 9c2f4b7d1a36
+Create Date: 2026-10-18 22:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a1c3b7d20'
+down_revision = '9c2f4b7d1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('award_key') as batch_op:
+        batch_op.add_column(sa.Column('request_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('award_key') as batch_op:
+        batch_op.drop_column('request_hash')
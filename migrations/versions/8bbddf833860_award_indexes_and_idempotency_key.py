@@ -0,0 +1,43 @@
+"""award indexes and idempotency key
+
+Индексы под чтения user_achievement и уникальный award_key для идемпотентной
+выдачи. Индексы строятся CREATE INDEX CONCURRENTLY вне транзакции и не
+блокируют запись в таблицу; nullable-колонка без значения по умолчанию
+добавляется в PostgreSQL без перезаписи таблицы. Если построение прервалось,
+PostgreSQL оставляет невалидный индекс - его нужно удалить и повторить upgrade.
+
+Revision ID: 8bbddf833860
+Revises: 1f6b2d9c4a57
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8bbddf833860'
+down_revision = '1f6b2d9c4a57'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_user_achievement_user_id_date_awarded', ['user_id', 'date_awarded', 'id'], False),
+    ('ix_user_achievement_achievement_id', ['achievement_id'], False),
+    ('ix_user_achievement_date_awarded', ['date_awarded'], False),
+    ('uq_user_achievement_award_key', ['award_key'], True),
+]
+
+
+def upgrade():
+    op.add_column('user_achievement', sa.Column('award_key', sa.String(length=80), nullable=True))
+    with op.get_context().autocommit_block():
+        for name, columns, unique in INDEXES:
+            op.create_index(name, 'user_achievement', columns, unique=unique, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name='user_achievement', postgresql_concurrently=True)
+    op.drop_column('user_achievement', 'award_key')
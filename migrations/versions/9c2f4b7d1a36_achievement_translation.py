@@ -0,0 +1,35 @@
+"""achievement translations
+
+Таблица achievement_translation - названия и описания достижений на языках
+пользователей. Тексты Achievement остаются текстами по умолчанию.
+
+Revision ID: 9c2f4b7d1a36
+Revises: 3a9d5c7e1f08
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2f4b7d1a36'
+down_revision = '3a9d5c7e1f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'achievement_translation',
+        sa.Column('achievement_id', sa.Integer(), nullable=False),
+        sa.Column('language', sa.String(length=2), nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('description', sa.String(length=200), nullable=False),
+        sa.ForeignKeyConstraint(['achievement_id'], ['achievement.id']),
+        sa.PrimaryKeyConstraint('achievement_id', 'language')
+    )
+
+
+def downgrade():
+    op.drop_table('achievement_translation')
@@ -0,0 +1,130 @@
+"""partition user_achievement by month
+
+Ключи идемпотентности переезжают из user_achievement.award_key в таблицу
+award_key: уникальный индекс секционированной таблицы обязан включать
+date_awarded. На PostgreSQL user_achievement пересоздаётся как
+PARTITION BY RANGE (date_awarded) с месячными секциями от первой выдачи до
+MONTHS_AHEAD месяцев вперёд и секцией по умолчанию; строки копируются, id
+продолжают ту же последовательность. Копирование держит блокировку таблицы -
+на большой истории миграцию нужно проводить в окно обслуживания. На других
+СУБД таблица остаётся обычной.
+
+Revision ID: c41e7a9d2b56
+Revises: 8bbddf833860
+Create Date: 2026-10-18 14:10:00.000000
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41e7a9d2b56'
+down_revision = '8bbddf833860'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+INDEXES = [
+    ('ix_user_achievement_user_id_date_awarded', ['user_id', 'date_awarded', 'id']),
+    ('ix_user_achievement_achievement_id', ['achievement_id']),
+    ('ix_user_achievement_date_awarded', ['date_awarded']),
+]
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_user_achievement():
+    bind = op.get_bind()
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='user_achievement')
+    op.execute('ALTER TABLE user_achievement RENAME TO user_achievement_legacy')
+    op.execute('ALTER TABLE user_achievement_legacy RENAME CONSTRAINT user_achievement_pkey '
+               'TO user_achievement_legacy_pkey')
+    op.execute('ALTER SEQUENCE user_achievement_id_seq OWNED BY NONE')
+    op.execute("""
+        CREATE TABLE user_achievement (
+            id INTEGER NOT NULL DEFAULT nextval('user_achievement_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            achievement_id INTEGER NOT NULL REFERENCES achievement (id),
+            date_awarded TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, date_awarded)
+        ) PARTITION BY RANGE (date_awarded)
+    """)
+    op.execute('ALTER SEQUENCE user_achievement_id_seq OWNED BY user_achievement.id')
+
+    today = datetime.utcnow().date()
+    first_awarded = bind.execute(sa.text('SELECT min(date_awarded) FROM user_achievement_legacy')).scalar()
+    month = date((first_awarded or today).year, (first_awarded or today).month, 1)
+    last = _add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute(f'CREATE TABLE user_achievement_y{month.year:04d}m{month.month:02d} '
+                   f"PARTITION OF user_achievement FOR VALUES FROM ('{month.isoformat()}') "
+                   f"TO ('{_add_months(month, 1).isoformat()}')")
+        month = _add_months(month, 1)
+    op.execute('CREATE TABLE user_achievement_default PARTITION OF user_achievement DEFAULT')
+
+    op.execute('INSERT INTO user_achievement (id, user_id, achievement_id, date_awarded) '
+               'SELECT id, user_id, achievement_id, date_awarded FROM user_achievement_legacy')
+    op.execute('DROP TABLE user_achievement_legacy')
+    # Индексы на секционированной таблице создаются в каждой секции; строятся после загрузки строк
+    for name, columns in INDEXES:
+        op.create_index(name, 'user_achievement', columns)
+    op.execute('ANALYZE user_achievement')
+
+
+def _merge_user_achievement():
+    op.execute('ALTER TABLE user_achievement RENAME TO user_achievement_partitioned')
+    for name, _ in INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO {name}_partitioned')
+    op.execute('ALTER TABLE user_achievement_partitioned RENAME CONSTRAINT user_achievement_pkey '
+               'TO user_achievement_partitioned_pkey')
+    op.execute('ALTER SEQUENCE user_achievement_id_seq OWNED BY NONE')
+    op.execute("""
+        CREATE TABLE user_achievement (
+            id INTEGER NOT NULL DEFAULT nextval('user_achievement_id_seq') PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            achievement_id INTEGER NOT NULL REFERENCES achievement (id),
+            date_awarded TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+    """)
+    op.execute('ALTER SEQUENCE user_achievement_id_seq OWNED BY user_achievement.id')
+    op.execute('INSERT INTO user_achievement (id, user_id, achievement_id, date_awarded) '
+               'SELECT id, user_id, achievement_id, date_awarded FROM user_achievement_partitioned')
+    # Секции удаляются вместе с родительской таблицей
+    op.execute('DROP TABLE user_achievement_partitioned')
+    for name, columns in INDEXES:
+        op.create_index(name, 'user_achievement', columns)
+
+
+def upgrade():
+    op.create_table(
+        'award_key',
+        sa.Column('key', sa.String(length=80), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_award_key_created_at', 'award_key', ['created_at'])
+    op.execute('INSERT INTO award_key (key, created_at) '
+               'SELECT award_key, date_awarded FROM user_achievement WHERE award_key IS NOT NULL')
+    op.drop_index('uq_user_achievement_award_key', table_name='user_achievement')
+    with op.batch_alter_table('user_achievement') as batch_op:
+        batch_op.drop_column('award_key')
+    if op.get_bind().dialect.name == 'postgresql':
+        _partition_user_achievement()
+
+
+def downgrade():
+    # Связь ключей идемпотентности с конкретными выдачами не сохраняется: award_key возвращается пустым
+    if op.get_bind().dialect.name == 'postgresql':
+        _merge_user_achievement()
+    with op.batch_alter_table('user_achievement') as batch_op:
+        batch_op.add_column(sa.Column('award_key', sa.String(length=80), nullable=True))
+    op.create_index('uq_user_achievement_award_key', 'user_achievement', ['award_key'], unique=True)
+    op.drop_index('ix_award_key_created_at', table_name='award_key')
+    op.drop_table('award_key')
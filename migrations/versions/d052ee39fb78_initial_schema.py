@@ -0,0 +1,54 @@
+"""initial schema
+
+Схема, которую до появления миграций создавал db.create_all(). Для базы,
+созданной так, выполните "flask db stamp d052ee39fb78" перед "flask db upgrade".
+
+Revision ID: d052ee39fb78
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd052ee39fb78'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=80), nullable=False),
+        sa.Column('language', sa.String(length=2), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table(
+        'achievement',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('points', sa.Integer(), nullable=False),
+        sa.Column('description', sa.String(length=200), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table(
+        'user_achievement',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('achievement_id', sa.Integer(), nullable=False),
+        sa.Column('date_awarded', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['achievement_id'], ['achievement.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+def downgrade():
+    op.drop_table('user_achievement')
+    op.drop_table('achievement')
+    op.drop_table('user')
@@ -0,0 +1,35 @@
+"""user directory for sharding
+
+Справочник user_directory в основной базе выдаёт глобальные id
+пользователей и следит за уникальностью username, когда пользователи
+разнесены по шардам (DATABASE_SHARD_URLS). Без шардирования таблица
+остаётся пустой.
+
+Revision ID: e7b3f0a19c42
+Revises: c41e7a9d2b56
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3f0a19c42'
+down_revision = 'c41e7a9d2b56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user_directory',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=80), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username')
+    )
+
+
+def downgrade():
+    op.drop_table('user_directory')
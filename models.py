@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+# Чтение маршрутов из REPLICA_ENDPOINTS может идти с реплики, см. replicas.ReplicaRouter
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(db.Model):
@@ -9,6 +12,16 @@ class User(db.Model):
     language = db.Column(db.String(2), nullable=False)
 
 
+class UserDirectory(db.Model):
+    """Справочник пользователей в основной базе при шардировании (см. sharding.ShardRouter).
+
+    Выдаёт глобально уникальные id пользователей и следит за уникальностью
+    username между шардами; строка User живёт на шарде своего id.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+
+
 class Achievement(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
@@ -16,8 +29,80 @@ class Achievement(db.Model):
     description = db.Column(db.String(200), nullable=False)
 
 
+class AchievementTranslation(db.Model):
+    """Перевод названия и описания достижения на язык пользователей (см. translations.TranslationCatalog).
+
+    Хранится в основной базе; без перевода на язык клиента отдаются тексты Achievement.
+    """
+    achievement_id = db.Column(db.Integer, db.ForeignKey('achievement.id'), primary_key=True)
+    language = db.Column(db.String(2), primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    description = db.Column(db.String(200), nullable=False)
+
+
 class UserAchievement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     achievement_id = db.Column(db.Integer, db.ForeignKey('achievement.id'), nullable=False)
     date_awarded = db.Column(db.DateTime, nullable=False)
+
+    # На PostgreSQL таблица секционирована по месяцам date_awarded (см. partitions.py) и её первичный
+    # ключ - (id, date_awarded); уникальность id обеспечивает последовательность
+    __table_args__ = (
+        # Достижения пользователя в порядке выдачи и фильтры since/until - ключ пагинации (date_awarded, id)
+        db.Index('ix_user_achievement_user_id_date_awarded', 'user_id', 'date_awarded', 'id'),
+        db.Index('ix_user_achievement_achievement_id', 'achievement_id'),
+        db.Index('ix_user_achievement_date_awarded', 'date_awarded'),
+    )
+
+
+class AwardKey(db.Model):
+    """Ключи идемпотентности записанных выдач (заголовок Idempotency-Key).
+
+    Хранятся отдельно от UserAchievement: уникальный индекс секционированной
+    таблицы обязан включать ключ секционирования, а повтор запроса приходит с
+    другим date_awarded. Ключ пачки хранится вместе с хешем её тела
+    request_hash: повтор с тем же ключом обязан прислать те же элементы.
+    """
+    key = db.Column(db.String(80), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    request_hash = db.Column(db.String(64), nullable=True)
+
+
+class UserStats(db.Model):
+    """Агрегаты по пользователю, обновляемые в одной транзакции с выдачей достижения."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    achievements_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    points_total = db.Column(db.Integer, nullable=False, default=0, index=True)
+    last_awarded = db.Column(db.DateTime)
+    # Серии дней подряд с выдачами; день хранится как date.toordinal(), чтобы сравнивать дни целыми числами
+    last_award_day = db.Column(db.Integer)
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    best_streak = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_user_stats_best_streak_user_id', 'best_streak', 'user_id'),
+    )
+
+
+class UserDailyStats(db.Model):
+    """Выдачи и очки пользователя за день, обновляемые в одной транзакции с выдачей достижения.
+
+    День хранится как date.toordinal() даты выдачи в UTC, как и UserStats.last_award_day.
+    Статистика за период читается только отсюда и не зависит от числа выдач в UserAchievement.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Integer, primary_key=True)
+    award_count = db.Column(db.Integer, nullable=False, default=0)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Статистика за период по всем пользователям - диапазон дней
+        db.Index('ix_user_daily_stats_day_user_id', 'day', 'user_id'),
+    )
+
+
+class DataVersion(db.Model):
+    """Счётчики версий данных, по которым строятся ETag ответов."""
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,145 @@
+import base64
+import json
+from datetime import date, datetime
+
+from flask import Response, request, stream_with_context
+
+from serializers import dumps
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = 1000
+# Языки пользователей (User.language), на которые переводится каталог достижений
+LANGUAGES = ('ru', 'en')
+
+
+class PaginationError(ValueError):
+    """Некорректные параметры пагинации или фильтрации в запросе."""
+
+
+def encode_cursor(*values):
+    """Упаковывает значения ключа последней строки страницы в непрозрачный курсор."""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """Распаковывает курсор, приводя значения к переданным типам."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+        return tuple(datetime.fromisoformat(value) if type_ is datetime else type_(value)
+                     for type_, value in zip(types, values))
+    except (ValueError, TypeError):
+        raise PaginationError('Invalid cursor')
+
+
+def get_int_arg(name, default=None, args=None):
+    """Целое число из параметра запроса или default, если параметр не передан.
+
+    В отличие от args.get(name, type=int) нечисловое значение - ошибка, а не default.
+    """
+    value = (request.args if args is None else args).get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise PaginationError(f'{name} must be an integer')
+
+
+def get_limit(args=None):
+    """Размер страницы из параметра limit; args по умолчанию - параметры текущего запроса Flask."""
+    limit = get_int_arg('limit', DEFAULT_LIMIT, args)
+    if limit < 1:
+        raise PaginationError('limit must be a positive integer')
+    return min(limit, MAX_LIMIT)
+
+
+def get_cursor(*types, args=None):
+    """Курсор из параметра cursor или None для первой страницы."""
+    cursor = (request.args if args is None else args).get('cursor')
+    return decode_cursor(cursor, *types) if cursor else None
+
+
+def get_datetime_arg(name, args=None):
+    """Дата из параметра запроса в формате ISO 8601 или None."""
+    value = (request.args if args is None else args).get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise PaginationError(f'{name} must be an ISO 8601 date-time')
+
+
+def get_date_arg(name, args=None):
+    """Дата из параметра запроса в формате YYYY-MM-DD или None."""
+    value = (request.args if args is None else args).get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise PaginationError(f'{name} must be a date in YYYY-MM-DD format')
+
+
+def split_page(rows, limit, key):
+    """Отделяет лишнюю строку, выбранную сверх limit, и строит курсор на следующую страницу."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def wants_ndjson(req=None):
+    """Клиент запросил потоковую выдачу: ?format=ndjson или Accept: application/x-ndjson.
+
+    req - объект запроса с args и accept_mimetypes, по умолчанию текущий запрос Flask.
+    """
+    req = request if req is None else req
+    if req.args.get('format') == 'ndjson':
+        return True
+    return req.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def requested_language(req=None):
+    """Язык, запрошенный клиентом: ?lang=, иначе лучший из LANGUAGES по Accept-Language; None - не запрошен.
+
+    Значение lang не проверяется, см. get_language.
+    """
+    req = request if req is None else req
+    return req.args.get('lang') or req.accept_languages.best_match(LANGUAGES)
+
+
+def get_language():
+    """Язык ответа из параметра lang или заголовка Accept-Language; None - язык не запрошен."""
+    language = requested_language()
+    if language is not None and language not in LANGUAGES:
+        raise PaginationError(f'lang must be one of: {", ".join(LANGUAGES)}')
+    return language
+
+
+def ndjson_response(rows, serialize):
+    """Отдаёт строки итерируемого rows построчно в NDJSON; rows читается во время отправки ответа."""
+    def generate():
+        for row in rows:
+            yield dumps(serialize(row)) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def stream_ndjson(session, query, serialize):
+    """Отдаёт результат запроса построчно в NDJSON.
+
+    Строки читаются пачками через yield_per (на PostgreSQL - серверный курсор),
+    поэтому память не зависит от размера таблицы.
+    """
+    def rows():
+        yield from session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+    return ndjson_response(rows(), serialize)
@@ -0,0 +1,210 @@
+import atexit
+import gzip
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import delete, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import AwardKey, db
+from sharding import shard_router
+
+PARENT_TABLE = 'user_achievement'
+DEFAULT_MONTHS_AHEAD = 3
+DEFAULT_CHECK_SECONDS = 3600
+# Месячные секции называются user_achievement_yYYYYmMM, секция по умолчанию - user_achievement_default
+PARTITION_NAME = re.compile(rf'^{PARENT_TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}'
+
+
+def is_partitioned(session=None):
+    """Таблица выдач секционирована (PostgreSQL после миграции секционирования)."""
+    session = session or db.session
+    if session.get_bind().dialect.name != 'postgresql':
+        return False
+    return session.execute(text(
+        'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+        'WHERE c.relname = :name AND pg_table_is_visible(c.oid)'
+    ), {'name': PARENT_TABLE}).first() is not None
+
+
+def list_partitions(session=None):
+    """Месячные секции таблицы выдач: список (name, первый день месяца) по возрастанию."""
+    session = session or db.session
+    names = session.scalars(text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :name'
+    ), {'name': PARENT_TABLE})
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_partitions(months_ahead=DEFAULT_MONTHS_AHEAD, today=None, session=None):
+    """Создаёт секции с текущего месяца на months_ahead месяцев вперёд. Возвращает имена созданных.
+
+    Выдачи вне существующих секций попадают в секцию по умолчанию; пока она
+    содержит строки из нового месяца, секцию для него создать нельзя, поэтому
+    секции создаются заранее.
+    """
+    session = session or db.session
+    if not is_partitioned(session):
+        return []
+    existing = {name for name, _ in list_partitions(session)}
+    first = month_start(today or datetime.utcnow().date())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        created.append(name)
+    session.commit()
+    if created:
+        logger.info('Created award partitions: %s', ', '.join(created))
+    return created
+
+
+def _export(session, name, path):
+    """Выгружает таблицу в gzip CSV с заголовком через COPY."""
+    cursor = session.connection().connection.cursor()
+    try:
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+            cursor.copy_expert(f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)', f)
+    finally:
+        cursor.close()
+
+
+def archive_partitions(before, output_dir, drop=True, progress=None, session=None):
+    """Отсоединяет и выгружает секции за месяцы раньше before (первый день месяца).
+
+    Каждая секция отсоединяется (DETACH PARTITION) отдельной короткой
+    транзакцией: она держит ACCESS EXCLUSIVE на таблице выдач, поэтому
+    выгрузка в output_dir/<секция>.csv.gz и удаление (если drop) идут уже
+    после коммита и блокируют только отсоединённую таблицу. DETACH ...
+    CONCURRENTLY не используется: он невозможен при секции по умолчанию. Ключи
+    идемпотентности старше before удаляются: повторов таких старых запросов
+    уже не будет. UserStats не меняется - агрегаты продолжают учитывать
+    архивные выдачи. Возвращает список путей к выгрузкам; на
+    несекционированной таблице (в том числе не на PostgreSQL) ничего не
+    делает и возвращает пустой список.
+    """
+    session = session or db.session
+    if not is_partitioned(session):
+        return []
+    os.makedirs(output_dir, exist_ok=True)
+    exported = []
+    for name, month in list_partitions(session):
+        if add_months(month, 1) > before:
+            break
+        session.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}'))
+        session.commit()
+        path = os.path.join(output_dir, f'{name}.csv.gz')
+        _export(session, name, path)
+        if drop:
+            session.execute(text(f'DROP TABLE {name}'))
+        session.commit()
+        exported.append(path)
+        if progress:
+            progress(name, path)
+    session.execute(delete(AwardKey).where(AwardKey.created_at < before))
+    session.commit()
+    return exported
+
+
+class PartitionMaintainer:
+    """Создаёт секции наступающих месяцев из работающего приложения, без cron.
+
+    Фоновый поток сразу после запуска и затем раз в check_seconds вызывает
+    ensure_partitions на основной базе и на каждом шарде, поэтому секции
+    всегда есть на months_ahead месяцев вперёд. Поток запускается в рабочем
+    процессе на первом запросе и только на PostgreSQL. Проверки из нескольких
+    процессов не мешают друг другу (CREATE TABLE IF NOT EXISTS), а
+    неудачная проверка повторяется в следующий раз.
+    """
+
+    def __init__(self):
+        self.months_ahead = DEFAULT_MONTHS_AHEAD
+        self.check_seconds = DEFAULT_CHECK_SECONDS
+        self._app = None
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self.months_ahead = app.config.get('AWARD_PARTITIONS_AHEAD', DEFAULT_MONTHS_AHEAD)
+        self.check_seconds = app.config.get('AWARD_PARTITIONS_CHECK_SECONDS', DEFAULT_CHECK_SECONDS)
+        self._app = app
+        if 'partition_maintainer' not in app.extensions:
+            app.extensions['partition_maintainer'] = self
+            # Поток запускается в рабочем процессе на первом запросе, как и очередь отложенной записи
+            app.before_request(self._start_on_request)
+
+    def _start_on_request(self):
+        if self._started or not self.check_seconds:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            if db.engine.dialect.name != 'postgresql':
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='award-partitions', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                self.check()
+                if self._stopping.wait(self.check_seconds):
+                    return
+
+    def check(self):
+        """Создаёт недостающие секции на основной базе и шардах; возвращает имена созданных."""
+        created = []
+        try:
+            for _ in shard_router.each():
+                try:
+                    created += ensure_partitions(self.months_ahead)
+                except SQLAlchemyError:
+                    logger.exception('Award partition check failed, will retry in %s s', self.check_seconds)
+                    db.session.rollback()
+        finally:
+            db.session.remove()
+        return created
+
+
+partition_maintainer = PartitionMaintainer()
@@ -0,0 +1,119 @@
+import bisect
+import os
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Границы корзин гистограммы ожидания соединения, мс
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _env_bool(environ, name, default):
+    value = environ.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(environ=None, async_driver=False):
+    """Параметры create_engine для пула соединений из переменных окружения.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (с), DB_POOL_RECYCLE (с, -1 -
+    не пересоздавать), DB_POOL_PRE_PING. При DB_PGBOUNCER=1 соединения держит
+    PgBouncer в режиме transaction pooling: пул приложения выключается, а для
+    asyncpg отключаются подготовленные выражения, которые не переживают смену
+    серверного соединения.
+    """
+    environ = os.environ if environ is None else environ
+    if _env_bool(environ, 'DB_PGBOUNCER', False):
+        options = {'poolclass': NullPool}
+        if async_driver:
+            options['connect_args'] = {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+        return options
+    options = {
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', -1)),
+        'pool_pre_ping': _env_bool(environ, 'DB_POOL_PRE_PING', True),
+    }
+    if not async_driver:
+        options['poolclass'] = InstrumentedQueuePool
+    return options
+
+
+class PoolStats:
+    """Счётчики выдачи соединений из пула: число выдач, тайм-ауты и гистограмма ожидания."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_sum = 0.0
+            self.wait_max = 0.0
+            self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def observe(self, wait_ms, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_sum += wait_ms
+            self.wait_max = max(self.wait_max, wait_ms)
+            self.buckets[bisect.bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, histogram = 0, {}
+            for bound, count in zip(WAIT_BUCKETS_MS + ('+Inf',), self.buckets):
+                cumulative += count
+                histogram[str(bound)] = cumulative
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms': {
+                    'sum': round(self.wait_sum, 3),
+                    'max': round(self.wait_max, 3),
+                    # Накопительные счётчики: сколько выдач дождались соединения не дольше границы
+                    'buckets': histogram
+                }
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool, замеряющий время ожидания соединения и считающий тайм-ауты."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.observe((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        pool_stats.observe((time.perf_counter() - started) * 1000)
+        return connection
+
+
+def pool_status(engine):
+    """Текущее состояние пула движка и накопленная статистика ожидания."""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            # QueuePool считает overflow от -pool_size, пока пул не заполнен
+            'overflow': max(pool.overflow(), 0),
+            'timeout': pool.timeout()
+        })
+    status.update(pool_stats.snapshot())
+    return status
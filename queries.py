@@ -0,0 +1,56 @@
+from sqlalchemy import and_, exists, or_, select
+
+from models import User, Achievement, UserAchievement
+
+
+def user_achievements_query(user_id, limit, after=None, since=None, until=None):
+    """Страница достижений пользователя одним JOIN-запросом.
+
+    Ключ пагинации - (date_awarded, id); after - ключ последней строки предыдущей
+    страницы. Выбирается limit + 1 строка, чтобы понять, есть ли следующая страница.
+    """
+    query = select(
+        UserAchievement.id,
+        UserAchievement.achievement_id,
+        UserAchievement.date_awarded,
+        Achievement.name,
+        Achievement.points,
+        Achievement.description
+    ).join(Achievement, UserAchievement.achievement_id == Achievement.id).where(UserAchievement.user_id == user_id)
+    if since is not None:
+        query = query.where(UserAchievement.date_awarded >= since)
+    if until is not None:
+        query = query.where(UserAchievement.date_awarded < until)
+    if after is not None:
+        after_date, after_id = after
+        query = query.where(or_(
+            UserAchievement.date_awarded > after_date,
+            and_(UserAchievement.date_awarded == after_date, UserAchievement.id > after_id)
+        ))
+    return query.order_by(UserAchievement.date_awarded, UserAchievement.id).limit(limit + 1)
+
+
+def _keyset_by_id(query, column, after, limit):
+    """Keyset-пагинация по первичному ключу; без limit возвращает все строки после курсора."""
+    if after is not None:
+        query = query.where(column > after[0])
+    query = query.order_by(column)
+    return query if limit is None else query.limit(limit + 1)
+
+
+def users_query(limit=None, after=None):
+    """Пользователи в порядке id."""
+    return _keyset_by_id(select(User.id, User.username, User.language), User.id, after, limit)
+
+
+def achievements_query(limit=None, after=None):
+    """Достижения в порядке id."""
+    return _keyset_by_id(
+        select(Achievement.id, Achievement.name, Achievement.points, Achievement.description),
+        Achievement.id, after, limit
+    )
+
+
+def award_points_query(user_id, achievement_id):
+    """Очки достижения, если и пользователь, и достижение существуют, - одним запросом."""
+    return select(Achievement.points).where(Achievement.id == achievement_id, exists().where(User.id == user_id))
@@ -0,0 +1,179 @@
+import itertools
+import logging
+import threading
+import time
+
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+DEFAULT_ENDPOINTS = ('get_users', 'get_user', 'get_achievements', 'get_user_achievements', 'get_stats',
+                     'get_user_daily_stats')
+DEFAULT_MAX_LAG_SECONDS = 1.0
+DEFAULT_LAG_CHECK_SECONDS = 1.0
+WRITE_COOKIE = 'db_last_write'
+CONSISTENCY_HEADER = 'X-Read-Consistency'
+# Отставание реплики PostgreSQL в секундах; 0, если всё полученное WAL уже применено
+LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingSession(Session):
+    """Сессия, читающая с реплики, выбранной для текущего запроса (info['replica']).
+
+    Запись (flush) всегда идёт на основной сервер. Если сессия направлена на
+    шард (info['shard'], см. sharding.ShardRouter), на него идут и чтение, и запись.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = self.info.get('shard')
+        if bind is None and shard is not None:
+            return self._db.engines[shard]
+        replica = self.info.get('replica')
+        if bind is None and replica is not None and not self._flushing:
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """Направляет чтение маршрутов из REPLICA_ENDPOINTS на реплики по кругу.
+
+    Реплики задаются в DATABASE_REPLICA_URLS и подключаются как binds
+    Flask-SQLAlchemy replica_0, replica_1, ... Отставание реплики
+    проверяется не чаще раза в lag_check_seconds; реплика с отставанием
+    больше max_lag_seconds или недоступная пропускается, а без подходящих
+    реплик запрос читает с основного сервера.
+
+    Чтение своих записей: после успешного изменяющего запроса клиент
+    получает cookie со временем записи, и пока реплика отстаёт больше, чем
+    прошло с этой записи, его запросы читают с основного сервера. Заголовок
+    X-Read-Consistency: strong всегда читает с основного сервера.
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.endpoints = set(DEFAULT_ENDPOINTS)
+        self.max_lag = DEFAULT_MAX_LAG_SECONDS
+        self.lag_check_interval = DEFAULT_LAG_CHECK_SECONDS
+        self._lag = {}
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    def init_app(self, app):
+        """Добавляет реплики в SQLALCHEMY_BINDS; вызывается до db.init_app."""
+        urls = app.config.get('DATABASE_REPLICA_URLS') or []
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        self.replicas = []
+        # Параметры пула из SQLALCHEMY_ENGINE_OPTIONS Flask-SQLAlchemy применяет ко всем binds
+        for index, url in enumerate(urls):
+            key = f'replica_{index}'
+            binds[key] = url
+            self.replicas.append(key)
+        self.endpoints = set(app.config.get('REPLICA_ENDPOINTS', DEFAULT_ENDPOINTS))
+        self.max_lag = app.config.get('REPLICA_MAX_LAG_SECONDS', DEFAULT_MAX_LAG_SECONDS)
+        self.lag_check_interval = app.config.get('REPLICA_LAG_CHECK_SECONDS', DEFAULT_LAG_CHECK_SECONDS)
+        self._lag = {}
+        if self.replicas:
+            app.before_request(self._before_request)
+            app.after_request(self._after_request)
+
+    def lag(self, key):
+        """Отставание реплики в секундах по последней проверке; None - реплика недоступна."""
+        now = time.monotonic()
+        with self._lock:
+            checked_at, lag = self._lag.get(key, (None, None))
+            if checked_at is not None and now - checked_at < self.lag_check_interval:
+                return lag
+            # Пока идёт проверка, другие запросы используют прежнее значение
+            self._lag[key] = (now, lag)
+        engine = current_app.extensions['sqlalchemy'].engines[key]
+        try:
+            with engine.connect() as connection:
+                lag = float(connection.execute(text(LAG_QUERY)).scalar()) \
+                    if engine.dialect.name == 'postgresql' else 0.0
+        except SQLAlchemyError as e:
+            logger.warning('Replica %s is unavailable: %s', key, e)
+            lag = None
+        with self._lock:
+            self._lag[key] = (time.monotonic(), lag)
+        return lag
+
+    def choose(self, last_write=None):
+        """Реплика для чтения или None - читать с основного сервера.
+
+        last_write - время (unix) последней записи клиента; реплика подходит,
+        только если её отставание меньше прошедшего с тех пор времени.
+        """
+        allowed = self.max_lag
+        if last_write is not None:
+            allowed = min(allowed, time.time() - last_write)
+        start = next(self._next)
+        for offset in range(len(self.replicas)):
+            key = self.replicas[(start + offset) % len(self.replicas)]
+            lag = self.lag(key)
+            if lag is not None and lag <= allowed:
+                return key
+        return None
+
+    @staticmethod
+    def use_primary():
+        """Текущий запрос дальше читает с основного сервера."""
+        current_app.extensions['sqlalchemy'].session.info.pop('replica', None)
+
+    @staticmethod
+    def skip_cache():
+        """Ответ текущего запроса нельзя брать из кэша ответов и сохранять в него.
+
+        Клиент с X-Read-Consistency: strong или недавней записью (cookie
+        db_last_write) должен видеть данные основного сервера, а не ответ,
+        закэшированный до его записи.
+        """
+        return request.headers.get(CONSISTENCY_HEADER) == 'strong' or WRITE_COOKIE in request.cookies
+
+    def cache_ttl(self, ttl):
+        """Сколько секунд ответ текущего запроса остаётся в кэше свежим.
+
+        Ответ, прочитанный с реплики, может не содержать записей, уже учтённых
+        в версиях тегов кэша, поэтому он свеж не дольше допустимого отставания
+        реплики: дольше устаревшим он не останется.
+        """
+        if current_app.extensions['sqlalchemy'].session.info.get('replica') is not None:
+            return min(ttl, self.max_lag)
+        return ttl
+
+    def status(self):
+        """Последние измеренные отставания реплик для служебного эндпоинта."""
+        with self._lock:
+            return {key: self._lag.get(key, (None, None))[1] for key in self.replicas}
+
+    def _before_request(self):
+        # Сессия может пережить запрос, если контекст приложения открыт снаружи (CLI, тесты)
+        info = current_app.extensions['sqlalchemy'].session.info
+        info.pop('replica', None)
+        if request.endpoint not in self.endpoints or request.method not in ('GET', 'HEAD'):
+            return
+        if request.headers.get(CONSISTENCY_HEADER) == 'strong':
+            return
+        try:
+            last_write = float(request.cookies[WRITE_COOKIE])
+        except (KeyError, ValueError):
+            last_write = None
+        replica = self.choose(last_write)
+        if replica is not None:
+            info['replica'] = replica
+
+    def _after_request(self, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            response.set_cookie(WRITE_COOKIE, f'{time.time():.3f}', max_age=max(int(self.max_lag) + 1, 1),
+                                httponly=True, samesite='Lax')
+        return response
+
+
+replica_router = ReplicaRouter()
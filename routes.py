@@ -1,10 +1,38 @@
 import logging
-from datetime import datetime, timedelta
-from flask import jsonify, request
-from sqlalchemy import func
+from datetime import date
+from operator import attrgetter
+from flask import Response, jsonify, request
 from flasgger import swag_from
+from sqlalchemy.exc import IntegrityError
 
-from models import User, Achievement, UserAchievement, db
+from api import (InvalidInput, award_row, batch_summary, parse_achievement, parse_batch, parse_user,
+                 serialize_achievement, serialize_streak, serialize_user, serialize_user_achievement, streak_args,
+                 streak_cursor_key, user_achievements_args)
+from awards import (IDEMPOTENCY_HEADER, AwardError, IdempotencyConflict, award_batch, on_awards_committed,
+                    record_awards, validate_award_key)
+from cache import cache
+from etags import CATALOG, bump_version, catalog_version, etag, user_achievements_version
+from events import EVENT_MIMETYPE, TooManyClients, broadcaster
+from importer import CONFLICT_POLICIES, FORMATS, ImportFileError, ImportFormatError, import_records, iter_records
+from leaderboard import leaderboard, usernames
+from metrics import PROMETHEUS_MIMETYPE, metrics
+from models import User, Achievement, db
+from pagination import (LANGUAGES, NEXT_CURSOR_HEADER, PaginationError, get_cursor, get_date_arg, get_int_arg,
+                        get_language, get_limit, ndjson_response, split_page, stream_ndjson, wants_ndjson)
+from pool import pool_status
+from queries import achievements_query, award_points_query, user_achievements_query, users_query
+from replicas import replica_router
+from serializers import JSON_MIMETYPE, rows_json
+from sharding import shard_router
+from stats import (DEFAULT_TOP_USERS, MAX_TOP_USERS, collect_stats, merge_period_stats, merge_stats,
+                   partial_period_stats, partial_stats, streak_users_query, user_daily_stats_query)
+from translations import translations
+from writebehind import QueueFull, award_queue
+
+
+@on_awards_committed
+def invalidate_awarded(rows):
+    cache.invalidate('stats', *{f'user:{row["user_id"]}' for row in rows})
 
 
 def set_routes(app, logger):
@@ -48,26 +76,42 @@ def set_routes(app, logger):
                         'error': {'type': 'string'}
                     }
                 }
+            },
+            409: {
+                'description': 'User already exists',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
             }
         }
     })
     def add_user():
         """Добавляет нового пользователя."""
-        data = request.get_json()
-        if 'username' not in data or 'language' not in data:
+        try:
+            data = parse_user(request.get_json(silent=True))
+        except InvalidInput as e:
             logger.warning('Invalid input data for user creation')
-            return jsonify({'error': 'Invalid input'}), 400
+            return jsonify({'error': str(e)}), 400
 
-        new_user = User(
-            username=data['username'],
-            language=data['language']
-        )
-        db.session.add(new_user)
-        db.session.commit()
-        logger.info(f'User {data["username"]} added successfully')
+        new_user = User(**data)
+        try:
+            # С шардированием id выдаёт справочник основной базы, а пользователь пишется на свой шард
+            shard_router.assign_user(new_user)
+            db.session.add(new_user)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            logger.warning('User %s already exists', data['username'])
+            return jsonify({'error': 'User already exists'}), 409
+        cache.invalidate('users')
+        logger.info('User %s added successfully', data['username'])
         return jsonify({'message': 'User created successfully', 'user_id': new_user.id}), 201
 
     @app.route('/users', methods=['GET'])
+    @cache.cached(tags=['users'])
     def get_users():
         """Получить список всех пользователей
         ---
@@ -88,12 +132,54 @@ def set_routes(app, logger):
                             language:
                                 type: string
                                 description: Язык пользователя
+                headers:
+                    X-Next-Cursor:
+                        type: string
+                        description: Курсор следующей страницы, отсутствует на последней странице
+            400:
+                description: Некорректные параметры пагинации
+        parameters:
+            - name: limit
+              in: query
+              type: integer
+              required: false
+              description: Размер страницы (по умолчанию 100, не больше 1000)
+            - name: cursor
+              in: query
+              type: string
+              required: false
+              description: Курсор следующей страницы из заголовка X-Next-Cursor
+            - name: format
+              in: query
+              type: string
+              enum: [ndjson]
+              required: false
+              description: Потоковая выдача всех пользователей в NDJSON без пагинации
         """
-        users = User.query.all()
-        users_list = [{'id': user.id, 'username': user.username, 'language': user.language} for user in users]
-        return jsonify(users_list)
+        try:
+            after = get_cursor(int)
+            limit = None if wants_ndjson() else get_limit()
+        except PaginationError as e:
+            logger.warning('Invalid pagination parameters for users: %s', e)
+            return jsonify({'error': str(e)}), 400
+
+        serialize = serialize_user
+
+        if limit is None:
+            if shard_router.enabled:
+                return ndjson_response(shard_router.iter_merged(users_query(after=after), key=attrgetter('id')),
+                                       serialize)
+            return stream_ndjson(db.session, users_query(after=after), serialize)
+
+        rows = shard_router.merge_pages(users_query(limit, after), attrgetter('id'), limit)
+        rows, next_cursor = split_page(rows, limit, key=lambda row: (row.id,))
+        response = Response(rows_json(rows, serialize), mimetype=JSON_MIMETYPE)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response
 
     @app.route('/user/<int:user_id>', methods=['GET'])
+    @cache.cached(tags=['users'])
     @swag_from({
         'parameters': [
             {
@@ -130,37 +216,106 @@ def set_routes(app, logger):
         """Возвращает информацию о пользователе по его ID."""
         user = User.query.get(user_id)
         if not user:
-            logger.warning(f'User with id {user_id} not found')
+            logger.warning('User with id %s not found', user_id)
             return jsonify({'error': 'User not found'}), 404
         return jsonify({'username': user.username, 'language': user.language})
 
     @app.route('/achievements', methods=['GET'])
+    @etag(catalog_version)
+    @cache.cached(tags=['achievements'], ttl=300)
     @swag_from({
+        'parameters': [
+            {
+                'name': 'limit',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Размер страницы (по умолчанию 100, не больше 1000)'
+            },
+            {
+                'name': 'cursor',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'description': 'Курсор следующей страницы из заголовка X-Next-Cursor'
+            },
+            {
+                'name': 'format',
+                'in': 'query',
+                'type': 'string',
+                'enum': ['ndjson'],
+                'required': False,
+                'description': 'Потоковая выдача всех достижений в NDJSON без пагинации'
+            },
+            {
+                'name': 'lang',
+                'in': 'query',
+                'type': 'string',
+                'enum': list(LANGUAGES),
+                'required': False,
+                'description': 'Язык названий и описаний; по умолчанию - по заголовку Accept-Language'
+            }
+        ],
         'responses': {
             200: {
                 'description': 'Список достижений',
+                'headers': {
+                    'X-Next-Cursor': {
+                        'type': 'string',
+                        'description': 'Курсор следующей страницы, отсутствует на последней странице'
+                    }
+                },
                 'schema': {
                     'type': 'array',
                     'items': {
                         'type': 'object',
                         'properties': {
+                            'id': {'type': 'integer'},
                             'name': {'type': 'string'},
                             'points': {'type': 'integer'},
                             'description': {'type': 'string'}
                         }
                     }
                 }
+            },
+            304: {
+                'description': 'Not Modified, ETag совпадает с If-None-Match'
+            },
+            400: {
+                'description': 'Invalid pagination parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
             }
         }
     })
     def get_achievements():
         """Возвращает список всех достижений."""
-        achievements = Achievement.query.all()
-        return jsonify([{
-            'name': achievement.name,
-            'points': achievement.points,
-            'description': achievement.description
-        } for achievement in achievements])
+        try:
+            after = get_cursor(int)
+            limit = None if wants_ndjson() else get_limit()
+            language = get_language()
+        except PaginationError as e:
+            logger.warning('Invalid pagination parameters for achievements: %s', e)
+            return jsonify({'error': str(e)}), 400
+
+        serialize = translations.localize(serialize_achievement, language)
+
+        if limit is None:
+            response = stream_ndjson(db.session, achievements_query(after=after), serialize)
+            response.vary.add('Accept-Language')
+            return response
+
+        rows = db.session.execute(achievements_query(limit, after)).all()
+        rows, next_cursor = split_page(rows, limit, key=lambda row: (row.id,))
+        response = Response(rows_json(rows, serialize), mimetype=JSON_MIMETYPE)
+        response.vary.add('Accept-Language')
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response
 
     @app.route('/achievement', methods=['POST'])
     @swag_from({
@@ -186,7 +341,26 @@ def set_routes(app, logger):
                 'schema': {
                     'type': 'object',
                     'properties': {
-                        'message': {'type': 'string'}
+                        'message': {'type': 'string'},
+                        'id': {'type': 'integer'}
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid input',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            409: {
+                'description': 'Achievement already exists',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
                     }
                 }
             }
@@ -194,16 +368,218 @@ def set_routes(app, logger):
     })
     def add_achievement():
         """Добавляет новое достижение."""
-        data = request.get_json()
-        new_achievement = Achievement(
-            name=data['name'],
-            points=data['points'],
-            description=data['description']
-        )
+        try:
+            data = parse_achievement(request.get_json(silent=True))
+        except InvalidInput as e:
+            logger.warning('Invalid input data for achievement creation')
+            return jsonify({'error': str(e)}), 400
+
+        new_achievement = Achievement(**data)
         db.session.add(new_achievement)
+        try:
+            bump_version(CATALOG)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            logger.warning('Achievement %s already exists', data['name'])
+            return jsonify({'error': 'Achievement already exists'}), 409
+        shard_router.sync_catalog()
+        cache.invalidate('achievements')
+        logger.info('Achievement %s added successfully', data['name'])
+        return jsonify({'message': 'Achievement added successfully', 'id': new_achievement.id}), 201
+
+    @app.route('/achievement/<int:achievement_id>/translations/<language>', methods=['PUT'])
+    @swag_from({
+        'parameters': [
+            {
+                'name': 'achievement_id',
+                'in': 'path',
+                'type': 'integer',
+                'required': True,
+                'description': 'ID достижения'
+            },
+            {
+                'name': 'language',
+                'in': 'path',
+                'type': 'string',
+                'enum': list(LANGUAGES),
+                'required': True,
+                'description': 'Язык перевода'
+            },
+            {
+                'name': 'body',
+                'in': 'body',
+                'required': True,
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'name': {'type': 'string'},
+                        'description': {'type': 'string'}
+                    },
+                    'required': ['name', 'description']
+                }
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Translation saved',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'message': {'type': 'string'}
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid input',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            404: {
+                'description': 'Achievement not found',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    })
+    def put_achievement_translation(achievement_id, language):
+        """Добавляет или заменяет перевод названия и описания достижения."""
+        data = request.get_json(silent=True) or {}
+        if language not in LANGUAGES or not isinstance(data.get('name'), str) or \
+                not isinstance(data.get('description'), str):
+            logger.warning('Invalid translation of achievement %s to %s', achievement_id, language)
+            return jsonify({'error': 'Invalid input'}), 400
+        if not db.session.get(Achievement, achievement_id):
+            logger.warning('Achievement with id %s not found', achievement_id)
+            return jsonify({'error': 'Achievement not found'}), 404
+
+        translations.save(achievement_id, language, data['name'], data['description'])
         db.session.commit()
-        logger.info(f'Achievement {data["name"]} added successfully')
-        return jsonify({'message': 'Achievement added successfully'}), 201
+        # Новая версия каталога нужна и шардам: по ней строятся ETag достижений пользователей
+        shard_router.sync_catalog()
+        cache.invalidate('achievements')
+        logger.info('Translation of achievement %s to %s saved', achievement_id, language)
+        return jsonify({'message': 'Translation saved'})
+
+    import_spec = {
+        'consumes': ['text/csv', 'application/x-ndjson'],
+        'parameters': [
+            {
+                'name': 'body',
+                'in': 'body',
+                'required': True,
+                'description': 'CSV с заголовком или NDJSON, по одной записи на строку',
+                'schema': {'type': 'string'}
+            },
+            {
+                'name': 'format',
+                'in': 'query',
+                'type': 'string',
+                'enum': list(FORMATS),
+                'required': False,
+                'description': 'Формат файла; по умолчанию определяется по Content-Type'
+            },
+            {
+                'name': 'on_conflict',
+                'in': 'query',
+                'type': 'string',
+                'enum': list(CONFLICT_POLICIES),
+                'required': False,
+                'description': 'Что делать с уже существующими записями (по умолчанию skip)'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Import finished',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'processed': {'type': 'integer'},
+                        'written': {'type': 'integer'},
+                        'skipped': {'type': 'integer'},
+                        'invalid': {'type': 'integer'},
+                        'errors': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'record': {'type': 'integer'},
+                                    'error': {'type': 'string'}
+                                }
+                            }
+                        }
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid input',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            409: {
+                'description': 'Duplicate record with on_conflict=error',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    }
+
+    def import_upload(kind):
+        """Импортирует тело запроса потоково, не читая его целиком в память."""
+        fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        on_conflict = request.args.get('on_conflict', 'skip')
+        if fmt not in FORMATS or on_conflict not in CONFLICT_POLICIES:
+            logger.warning('Invalid import parameters: format=%s, on_conflict=%s', fmt, on_conflict)
+            return jsonify({'error': 'Invalid input'}), 400
+
+        def progress(counters):
+            logger.info('Import of %s: %s processed, %s written', kind, counters['processed'], counters['written'])
+
+        try:
+            counters = import_records(kind, iter_records(request.stream, fmt), on_conflict, progress=progress)
+        except ImportFormatError as e:
+            logger.warning('Import of %s stopped: %s', kind, e)
+            return jsonify({'error': str(e)}), 400
+        except ImportFileError as e:
+            logger.warning('Import of %s stopped: %s', kind, e)
+            return jsonify({'error': str(e)}), 409
+        except UnicodeDecodeError:
+            logger.warning('Import of %s stopped: file is not UTF-8', kind)
+            return jsonify({'error': 'File must be UTF-8 encoded'}), 400
+        finally:
+            # Пачки, записанные до ошибки, уже закоммичены
+            cache.invalidate(kind)
+        logger.info('Import of %s finished: %s of %s records written',
+                    kind, counters['written'], counters['processed'])
+        return jsonify(counters)
+
+    @app.route('/users/import', methods=['POST'])
+    @swag_from(import_spec)
+    def import_users():
+        """Импортирует пользователей из CSV/NDJSON."""
+        return import_upload('users')
+
+    @app.route('/achievements/import', methods=['POST'])
+    @swag_from(import_spec)
+    def import_achievements():
+        """Импортирует достижения из CSV/NDJSON."""
+        return import_upload('achievements')
 
     @app.route('/user/<int:user_id>/achieve/<int:achievement_id>', methods=['POST'])
     @swag_from({
@@ -221,9 +597,25 @@ def set_routes(app, logger):
                 'type': 'integer',
                 'required': True,
                 'description': 'ID достижения'
+            },
+            {
+                'name': 'Idempotency-Key',
+                'in': 'header',
+                'type': 'string',
+                'required': False,
+                'description': 'Ключ идемпотентности: повтор запроса с тем же ключом не создаёт вторую выдачу'
             }
         ],
         'responses': {
+            200: {
+                'description': 'Award with this Idempotency-Key already exists, nothing changed',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'message': {'type': 'string'}
+                    }
+                }
+            },
             201: {
                 'description': 'Achievement awarded successfully',
                 'schema': {
@@ -233,6 +625,25 @@ def set_routes(app, logger):
                     }
                 }
             },
+            202: {
+                'description': 'Award queued for write-behind, status at /awards/{award_id}',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'message': {'type': 'string'},
+                        'award_id': {'type': 'integer'}
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid Idempotency-Key',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
             404: {
                 'description': 'User or Achievement not found',
                 'schema': {
@@ -241,55 +652,75 @@ def set_routes(app, logger):
                         'error': {'type': 'string'}
                     }
                 }
+            },
+            503: {
+                'description': 'Write-behind queue is full',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
             }
         }
     })
     def award_achievement(user_id, achievement_id):
         """Выдаёт достижение пользователю."""
-        user = User.query.get(user_id)
-        achievement = Achievement.query.get(achievement_id)
-        if not user or not achievement:
-            logger.warning(f'User or Achievement not found (user_id={user_id}, achievement_id={achievement_id})')
+        try:
+            key = validate_award_key(request.headers.get(IDEMPOTENCY_HEADER))
+        except AwardError as e:
+            return jsonify({'error': str(e)}), 400
+        if award_queue.enabled:
+            try:
+                award_id = award_queue.submit(user_id, achievement_id, key)
+            except QueueFull as e:
+                logger.warning('Award of %s to user %s rejected: %s', achievement_id, user_id, e)
+                return jsonify({'error': 'Too many pending awards, retry later'}), 503, {'Retry-After': '1'}
+            if award_id is None:
+                logger.warning('User or Achievement not found (user_id=%s, achievement_id=%s)',
+                               user_id, achievement_id)
+                return jsonify({'error': 'User or Achievement not found'}), 404
+            logger.info('Achievement %s award to user %s queued as %s', achievement_id, user_id, award_id)
+            return jsonify({'message': 'Achievement award accepted', 'award_id': award_id}), 202
+
+        points = db.session.scalar(award_points_query(user_id, achievement_id))
+        if points is None:
+            logger.warning('User or Achievement not found (user_id=%s, achievement_id=%s)',
+                           user_id, achievement_id)
             return jsonify({'error': 'User or Achievement not found'}), 404
-        user_achievement = UserAchievement(
-            user_id=user_id,
-            achievement_id=achievement_id,
-            date_awarded=datetime.utcnow()
-        )
-        db.session.add(user_achievement)
+        written = record_awards([award_row(user_id, achievement_id, points, key)])
         db.session.commit()
-        logger.info(f'Achievement {achievement_id} awarded to user {user_id}')
+        if not written:
+            logger.info('Repeated award of %s to user %s with key %s ignored', achievement_id, user_id, key)
+            return jsonify({'message': 'Achievement already awarded'}), 200
+        logger.info('Achievement %s awarded to user %s', achievement_id, user_id)
         return jsonify({'message': 'Achievement awarded successfully'}), 201
 
-    @app.route('/user/<int:user_id>/achievements', methods=['GET'])
+    @app.route('/awards/<int:award_id>', methods=['GET'])
     @swag_from({
         'parameters': [
             {
-                'name': 'user_id',
+                'name': 'award_id',
                 'in': 'path',
                 'type': 'integer',
                 'required': True,
-                'description': 'ID пользователя'
+                'description': 'award_id из ответа 202 на выдачу достижения'
             }
         ],
         'responses': {
             200: {
-                'description': 'List of user achievements',
+                'description': 'Состояние отложенной выдачи',
                 'schema': {
-                    'type': 'array',
-                    'items': {
-                        'type': 'object',
-                        'properties': {
-                            'name': {'type': 'string'},
-                            'points': {'type': 'integer'},
-                            'description': {'type': 'string'},
-                            'date_awarded': {'type': 'string', 'format': 'date-time'}
-                        }
+                    'type': 'object',
+                    'properties': {
+                        'award_id': {'type': 'integer'},
+                        'status': {'type': 'string', 'enum': ['pending', 'committed', 'failed']},
+                        'pending': {'type': 'integer', 'description': 'Сколько выдач ждут записи'}
                     }
                 }
             },
             404: {
-                'description': 'User not found',
+                'description': 'Award not found or write-behind mode is disabled',
                 'schema': {
                     'type': 'object',
                     'properties': {
@@ -299,43 +730,285 @@ def set_routes(app, logger):
             }
         }
     })
-    def get_user_achievements(user_id):
-        """Возвращает список достижений пользователя."""
-        user = User.query.get(user_id)
-        if not user:
-            logger.warning(f'User with id {user_id} not found')
-            return jsonify({'error': 'User not found'}), 404
-        achievements = UserAchievement.query.filter_by(user_id=user_id).all()
-        user_achievements = []
-        for ua in achievements:
-            achievement = Achievement.query.get(ua.achievement_id)
-            user_achievements.append({
-                'name': achievement.name,
-                'points': achievement.points,
-                'description': achievement.description,
-                'date_awarded': ua.date_awarded.strftime('%Y-%m-%d %H:%M:%S')
-            })
-        return jsonify(user_achievements)
+    def get_award_status(award_id):
+        """Возвращает состояние выдачи, поставленной в очередь отложенной записи."""
+        if not award_queue.enabled:
+            return jsonify({'error': 'Write-behind mode is disabled'}), 404
+        status = award_queue.status(award_id)
+        if status is None:
+            return jsonify({'error': 'Award not found'}), 404
+        return jsonify({'award_id': award_id, 'status': status, 'pending': award_queue.pending_count()})
 
-    @app.route('/stats', methods=['GET'])
+    @app.route('/awards/batch', methods=['POST'])
     @swag_from({
+        'parameters': [
+            {
+                'name': 'body',
+                'in': 'body',
+                'required': True,
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'awards': {
+                            'type': 'array',
+                            'description': 'Объекты или массивы [user_id, achievement_id, awarded_at]',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'user_id': {'type': 'integer'},
+                                    'achievement_id': {'type': 'integer'},
+                                    'awarded_at': {'type': 'string', 'format': 'date-time'}
+                                },
+                                'required': ['user_id', 'achievement_id']
+                            }
+                        }
+                    },
+                    'required': ['awards']
+                }
+            },
+            {
+                'name': 'Idempotency-Key',
+                'in': 'header',
+                'type': 'string',
+                'required': False,
+                'description': 'Ключ идемпотентности пачки: при повторе уже записанные элементы получают статус '
+                               'duplicate, другая пачка с тем же ключом отклоняется с 422'
+            }
+        ],
         'responses': {
             200: {
-                'description': 'Статистические данные системы',
+                'description': 'Batch processed',
                 'schema': {
                     'type': 'object',
                     'properties': {
-                        'max_achievements_user': {
-                            'type': 'object',
-                            'properties': {
-                                'total': {'type': 'integer'},
-                                'username': {'type': 'string'}
+                        'awarded': {'type': 'integer'},
+                        'failed': {'type': 'integer'},
+                        'results': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'index': {'type': 'integer'},
+                                    'status': {
+                                        'type': 'string',
+                                        'enum': ['awarded', 'duplicate', 'invalid', 'user_not_found',
+                                                 'achievement_not_found']
+                                    },
+                                    'error': {'type': 'string'}
+                                }
                             }
-                        },
-                        'max_diff_users': {
-                            'type': 'object',
-                            'properties': {
-                                'total': {'type': 'integer'},
+                        }
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid input',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            422: {
+                'description': 'Idempotency-Key was used with a different batch',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    })
+    def award_batch_achievements():
+        """Выдаёт пачку достижений одной транзакцией."""
+        try:
+            items = parse_batch(request.get_json(silent=True))
+        except InvalidInput as e:
+            logger.warning('Invalid input data for batch award: %s', e)
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            key = validate_award_key(request.headers.get(IDEMPOTENCY_HEADER))
+        except AwardError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            summary = batch_summary(award_batch(items, key=key))
+        except IdempotencyConflict as e:
+            logger.warning('Batch award rejected: %s', e)
+            return jsonify({'error': str(e)}), 422
+        logger.info('Batch award: %s of %s achievements awarded, %s failed',
+                    summary['awarded'], len(items), summary['failed'])
+        return jsonify(summary)
+
+    @app.route('/user/<int:user_id>/achievements', methods=['GET'])
+    @etag(user_achievements_version)
+    @cache.cached(tags=['user:{user_id}', 'achievements'])
+    @swag_from({
+        'parameters': [
+            {
+                'name': 'user_id',
+                'in': 'path',
+                'type': 'integer',
+                'required': True,
+                'description': 'ID пользователя'
+            },
+            {
+                'name': 'limit',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Размер страницы (по умолчанию 100, не больше 1000)'
+            },
+            {
+                'name': 'cursor',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'description': 'Курсор следующей страницы из заголовка X-Next-Cursor'
+            },
+            {
+                'name': 'since',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date-time',
+                'required': False,
+                'description': 'Только достижения, выданные не раньше этой даты'
+            },
+            {
+                'name': 'until',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date-time',
+                'required': False,
+                'description': 'Только достижения, выданные раньше этой даты'
+            },
+            {
+                'name': 'lang',
+                'in': 'query',
+                'type': 'string',
+                'enum': list(LANGUAGES),
+                'required': False,
+                'description': 'Язык названий и описаний; по умолчанию - по заголовку Accept-Language, иначе язык пользователя'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'List of user achievements',
+                'headers': {
+                    'X-Next-Cursor': {
+                        'type': 'string',
+                        'description': 'Курсор следующей страницы, отсутствует на последней странице'
+                    }
+                },
+                'schema': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'name': {'type': 'string'},
+                            'points': {'type': 'integer'},
+                            'description': {'type': 'string'},
+                            'date_awarded': {'type': 'string', 'format': 'date-time'}
+                        }
+                    }
+                }
+            },
+            304: {
+                'description': 'Not Modified, ETag совпадает с If-None-Match'
+            },
+            400: {
+                'description': 'Invalid pagination parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            404: {
+                'description': 'User not found',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    })
+    def get_user_achievements(user_id):
+        """Возвращает список достижений пользователя."""
+        try:
+            limit, after, since, until = user_achievements_args()
+            language = get_language()
+        except PaginationError as e:
+            logger.warning('Invalid pagination parameters for user %s: %s', user_id, e)
+            return jsonify({'error': str(e)}), 400
+
+        rows = db.session.execute(user_achievements_query(user_id, limit, after, since, until)).all()
+        # Пользователь читается, только если страница пуста (проверка существования) или клиент не запросил язык
+        user = db.session.get(User, user_id) if not rows or language is None else None
+        if not rows and not user:
+            logger.warning('User with id %s not found', user_id)
+            return jsonify({'error': 'User not found'}), 404
+        rows, next_cursor = split_page(rows, limit, key=lambda row: (row.date_awarded, row.id))
+
+        serialize = translations.localize(serialize_user_achievement, language or user.language, key='achievement_id')
+        response = Response(rows_json(rows, serialize), mimetype=JSON_MIMETYPE)
+        response.vary.add('Accept-Language')
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response
+
+    @app.route('/stats', methods=['GET'])
+    @cache.cached(tags=['stats'], ttl=10, stale_ttl=300)
+    @swag_from({
+        'parameters': [
+            {
+                'name': 'from',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'required': False,
+                'description': 'Первый день периода (YYYY-MM-DD); с from или to ответ - статистика за период'
+            },
+            {
+                'name': 'to',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'required': False,
+                'description': 'Последний день периода включительно (YYYY-MM-DD)'
+            },
+            {
+                'name': 'top',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Сколько лучших пользователей периода вернуть (по умолчанию 10, не больше 100)'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Статистические данные системы; за период - поля from, to, awards, points, '
+                               'active_users, top_users и days',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'max_achievements_user': {
+                            'type': 'object',
+                            'properties': {
+                                'total': {'type': 'integer'},
+                                'username': {'type': 'string'}
+                            }
+                        },
+                        'max_diff_users': {
+                            'type': 'object',
+                            'properties': {
+                                'total': {'type': 'integer'},
                                 'username1': {'type': 'string'},
                                 'username2': {'type': 'string'}
                             }
@@ -363,117 +1036,518 @@ def set_routes(app, logger):
                                     'username': {'type': 'string'}
                                 }
                             }
+                        },
+                        'awards': {'type': 'integer'},
+                        'points': {'type': 'integer'},
+                        'active_users': {'type': 'integer'},
+                        'top_users': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'user_id': {'type': 'integer'},
+                                    'username': {'type': 'string'},
+                                    'awards': {'type': 'integer'},
+                                    'points': {'type': 'integer'}
+                                }
+                            }
+                        },
+                        'days': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'day': {'type': 'string', 'format': 'date'},
+                                    'awards': {'type': 'integer'},
+                                    'points': {'type': 'integer'},
+                                    'active_users': {'type': 'integer'}
+                                }
+                            }
                         }
                     }
                 }
+            },
+            400: {
+                'description': 'Invalid period parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
             }
         }
     })
     def get_stats():
         """Возвращает статистические данные системы."""
-        # Пользователь с максимальным количеством достижений
-        max_achievements_user = db.session.query(
-            User.username,
-            func.count(UserAchievement.id).label('total')
-        ).join(UserAchievement).group_by(User.id, User.username).order_by(func.count(UserAchievement.id).desc()).first()
-
-        # Пользователь с максимальным количеством очков
-        max_points_user = db.session.query(
-            User.username,
-            func.sum(Achievement.points).label('total')
-        ).select_from(User).join(UserAchievement, User.id == UserAchievement.user_id).join(Achievement,
-                                                                                           UserAchievement.achievement_id == Achievement.id).group_by(
-            User.id).order_by(func.sum(Achievement.points).desc()).first()
-
-        # Пользователи с их суммой очков
-        user_achievements = db.session.query(
-            User.username,
-            func.sum(Achievement.points).label('total')
-        ).select_from(User).join(UserAchievement, User.id == UserAchievement.user_id).join(Achievement,
-                                                                                           UserAchievement.achievement_id == Achievement.id).group_by(
-            User.id).all()
-
-        # Пользователи с максимальной разностью очков
-        if len(user_achievements) > 1:
-            max_diff_user1 = max(user_achievements, key=lambda x: x.total)
-            max_diff_user2 = min(user_achievements, key=lambda x: x.total)
-        else:
-            max_diff_user1 = max_diff_user2 = None
-
-        sorted_user_achievements = sorted(user_achievements, key=lambda l: l.total)
-        min_diff_user1 = sorted_user_achievements[0]
-        min_diff_user2 = sorted_user_achievements[1]
-        min_length = min_diff_user2.total - min_diff_user1.total
-        for i in range(2, len(sorted_user_achievements)):
-            length = sorted_user_achievements[i].total - min_diff_user2.total
-            if length < min_length:
-                min_diff_user1 = min_diff_user2
-                min_diff_user2 = sorted_user_achievements[i]
-                min_length = length
-
-        # Пользователи, которые получали достижения 7 дней подряд
-        from collections import defaultdict
-
-        def get_user_achievements_dict():
-            users_achievements = db.session.query(
-                User.id,
-                User.username,
-                UserAchievement.date_awarded
-            ).join(UserAchievement).order_by(User.id, UserAchievement.date_awarded).all()
-
-            user_achievements_dict = defaultdict(list)
-
-            for user_id, username, date_awarded in users_achievements:
-                user_achievements_dict[username].append(date_awarded)
-
-            # функция, которая проверяет, есть ли в списке временных меток достижения в 7 последовательных дней
-            def has_streak_of_seven_days(dates):
-                # Сортируем даты на случай, если они не отсортированы
-                sorted_dates = sorted(dates)
-
-                streak = 1
-                for i in range(1, len(sorted_dates)):
-                    # Проверяем, является ли текущая дата следующей по отношению к предыдущей
-                    if sorted_dates[i].date() - sorted_dates[i - 1].date() == timedelta(days=1):
-                        streak += 1
-                        # Если нашли 7 последовательных дней, возвращаем True
-                        if streak == 7:
-                            return True
-                    else:
-                        streak = 1
-
-                return False
-
-            streak_users = []
-            for user_name, dates in user_achievements_dict.items():
-                if has_streak_of_seven_days(dates):
-                    streak_users.append(user_name)
-
-            return streak_users
-
-        streak_users = get_user_achievements_dict()
-
-        # Сбор статистики
-        stats = {
-            'max_achievements_user': {
-                'username': max_achievements_user.username if max_achievements_user else None,
-                'total': max_achievements_user.total if max_achievements_user else 0
-            },
-            'max_points_user': {
-                'username': max_points_user.username if max_points_user else None,
-                'total': max_points_user.total if max_points_user else 0
-            },
-            'max_diff_users': {
-                'username1': max_diff_user1.username if max_diff_user1 else None,
-                'username2': max_diff_user2.username if max_diff_user2 else None,
-                'total': max_diff_user1.total - max_diff_user2.total
-            },
-            'min_diff_users': {
-                'username1': min_diff_user1.username if min_diff_user1 else None,
-                'username2': min_diff_user2.username if min_diff_user2 else None,
-                'total': min_length
-            },
-            'streak_users': [{'username': username} for username in streak_users]
+        if 'from' in request.args or 'to' in request.args:
+            return get_period_stats()
+        if shard_router.enabled:
+            return jsonify(merge_stats(shard_router.scatter(partial_stats), usernames))
+        return jsonify(collect_stats())
+
+    def get_period_stats():
+        """Статистика за период из дневных итогов UserDailyStats."""
+        try:
+            since, until = get_date_arg('from'), get_date_arg('to')
+            top = get_int_arg('top', DEFAULT_TOP_USERS)
+        except PaginationError as e:
+            logger.warning('Invalid period parameters for stats: %s', e)
+            return jsonify({'error': str(e)}), 400
+        if since and until and since > until:
+            return jsonify({'error': 'from must not be later than to'}), 400
+        if not 0 < top <= MAX_TOP_USERS:
+            return jsonify({'error': f'top must be an integer from 1 to {MAX_TOP_USERS}'}), 400
+
+        first_day = since.toordinal() if since else None
+        last_day = until.toordinal() if until else None
+        parts = shard_router.scatter(lambda session: partial_period_stats(first_day, last_day, top, session))
+        result = merge_period_stats(parts, top)
+        result['from'] = since.isoformat() if since else None
+        result['to'] = until.isoformat() if until else None
+        return jsonify(result)
+
+    @app.route('/stats/streaks', methods=['GET'])
+    @cache.cached(tags=['stats'], ttl=10)
+    @swag_from({
+        'parameters': [
+            {
+                'name': 'days',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Минимальная длина серии в днях (по умолчанию 7)'
+            },
+            {
+                'name': 'limit',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Размер страницы (по умолчанию 100, не больше 1000)'
+            },
+            {
+                'name': 'cursor',
+                'in': 'query',
+                'type': 'string',
+                'required': False,
+                'description': 'Курсор следующей страницы из заголовка X-Next-Cursor'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Пользователи, получавшие достижения не меньше days дней подряд',
+                'headers': {
+                    'X-Next-Cursor': {
+                        'type': 'string',
+                        'description': 'Курсор следующей страницы, отсутствует на последней странице'
+                    }
+                },
+                'schema': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'user_id': {'type': 'integer'},
+                            'username': {'type': 'string'},
+                            'best_streak': {'type': 'integer'},
+                            'current_streak': {'type': 'integer'},
+                            'last_award_date': {'type': 'string', 'format': 'date'}
+                        }
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
         }
+    })
+    def get_streak_users():
+        """Возвращает пользователей с сериями выдач не короче заданной длины."""
+        try:
+            days, limit, after = streak_args()
+        except PaginationError as e:
+            logger.warning('Invalid pagination parameters for streaks: %s', e)
+            return jsonify({'error': str(e)}), 400
+
+        rows = shard_router.merge_pages(streak_users_query(days, limit, after),
+                                        lambda row: (-row.best_streak, row.user_id), limit)
+        rows, next_cursor = split_page(rows, limit, key=streak_cursor_key)
+        response = jsonify([serialize_streak(row) for row in rows])
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return response
 
-        return jsonify(stats)
+    @app.route('/user/<int:user_id>/stats/daily', methods=['GET'])
+    @cache.cached(tags=['user:{user_id}'])
+    @swag_from({
+        'parameters': [
+            {
+                'name': 'user_id',
+                'in': 'path',
+                'type': 'integer',
+                'required': True,
+                'description': 'ID пользователя'
+            },
+            {
+                'name': 'from',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'required': False,
+                'description': 'Первый день (YYYY-MM-DD)'
+            },
+            {
+                'name': 'to',
+                'in': 'query',
+                'type': 'string',
+                'format': 'date',
+                'required': False,
+                'description': 'Последний день включительно (YYYY-MM-DD)'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Дни с выдачами пользователя по возрастанию',
+                'schema': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'day': {'type': 'string', 'format': 'date'},
+                            'award_count': {'type': 'integer'},
+                            'points': {'type': 'integer'}
+                        }
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            404: {
+                'description': 'User not found',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    })
+    def get_user_daily_stats(user_id):
+        """Возвращает число выдач и очки пользователя по дням."""
+        try:
+            since, until = get_date_arg('from'), get_date_arg('to')
+        except PaginationError as e:
+            logger.warning('Invalid period parameters for user %s: %s', user_id, e)
+            return jsonify({'error': str(e)}), 400
+
+        rows = db.session.execute(user_daily_stats_query(
+            user_id, since.toordinal() if since else None, until.toordinal() if until else None
+        )).all()
+        if not rows and not db.session.get(User, user_id):
+            logger.warning('User with id %s not found', user_id)
+            return jsonify({'error': 'User not found'}), 404
+        return jsonify([{
+            'day': date.fromordinal(row.day).isoformat(),
+            'award_count': row.award_count,
+            'points': row.points
+        } for row in rows])
+
+    @app.route('/leaderboard', methods=['GET'])
+    @swag_from({
+        'parameters': [
+            {
+                'name': 'limit',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Сколько пользователей вернуть (по умолчанию 100, не больше 1000)'
+            },
+            {
+                'name': 'offset',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'С какой позиции рейтинга начать (по умолчанию 0)'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Пользователи по убыванию очков',
+                'schema': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'rank': {'type': 'integer'},
+                            'user_id': {'type': 'integer'},
+                            'username': {'type': 'string'},
+                            'points': {'type': 'integer'}
+                        }
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    })
+    def get_leaderboard():
+        """Возвращает рейтинг пользователей по очкам."""
+        try:
+            offset = get_int_arg('offset', 0)
+            limit = get_limit()
+        except PaginationError as e:
+            return jsonify({'error': str(e)}), 400
+        if offset < 0:
+            return jsonify({'error': 'offset must be a non-negative integer'}), 400
+
+        leaderboard.ensure_built()
+        entries = leaderboard.page(offset, limit)
+        names = usernames([user_id for _, user_id, _ in entries])
+        return jsonify([{
+            'rank': rank,
+            'user_id': user_id,
+            'username': names.get(user_id),
+            'points': points
+        } for rank, user_id, points in entries])
+
+    @app.route('/user/<int:user_id>/rank', methods=['GET'])
+    @swag_from({
+        'parameters': [
+            {
+                'name': 'user_id',
+                'in': 'path',
+                'type': 'integer',
+                'required': True,
+                'description': 'ID пользователя'
+            },
+            {
+                'name': 'around',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Сколько соседей выше и ниже пользователя вернуть (по умолчанию 0, не больше 50)'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Место пользователя в рейтинге',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'rank': {'type': 'integer'},
+                        'user_id': {'type': 'integer'},
+                        'username': {'type': 'string'},
+                        'points': {'type': 'integer'},
+                        'around': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'rank': {'type': 'integer'},
+                                    'user_id': {'type': 'integer'},
+                                    'username': {'type': 'string'},
+                                    'points': {'type': 'integer'}
+                                }
+                            }
+                        }
+                    }
+                }
+            },
+            400: {
+                'description': 'Invalid parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            404: {
+                'description': 'User not found',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    })
+    def get_user_rank(user_id):
+        """Возвращает место пользователя в рейтинге и его соседей."""
+        try:
+            around = min(max(get_int_arg('around', 0), 0), 50)
+        except PaginationError as e:
+            return jsonify({'error': str(e)}), 400
+        user = db.session.get(User, user_id)
+        if not user:
+            logger.warning('User with id %s not found', user_id)
+            return jsonify({'error': 'User not found'}), 404
+
+        leaderboard.ensure_built()
+        result = {
+            'rank': leaderboard.rank(user_id),
+            'user_id': user_id,
+            'username': user.username,
+            'points': leaderboard.points(user_id),
+            'around': []
+        }
+        if around:
+            position = leaderboard.position(user_id)
+            start = max(position - around, 0)
+            entries = leaderboard.page(start, position - start + around + 1)
+            names = usernames([entry_user_id for _, entry_user_id, _ in entries])
+            result['around'] = [{
+                'rank': rank,
+                'user_id': entry_user_id,
+                'username': names.get(entry_user_id),
+                'points': points
+            } for rank, entry_user_id, points in entries]
+        return jsonify(result)
+
+    @app.route('/events', methods=['GET'])
+    @swag_from({
+        'produces': [EVENT_MIMETYPE],
+        'parameters': [
+            {
+                'name': 'user_id',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Только выдачи этому пользователю'
+            },
+            {
+                'name': 'achievement_id',
+                'in': 'query',
+                'type': 'integer',
+                'required': False,
+                'description': 'Только выдачи этого достижения'
+            },
+            {
+                'name': 'Last-Event-ID',
+                'in': 'header',
+                'type': 'string',
+                'required': False,
+                'description': 'id последнего полученного события: сначала придут выдачи после него'
+            }
+        ],
+        'responses': {
+            200: {
+                'description': 'Поток server-sent events: событие award с полями user_id, achievement_id, points, '
+                               'date_awarded на каждую закоммиченную выдачу'
+            },
+            400: {
+                'description': 'Invalid filter parameters',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            },
+            503: {
+                'description': 'Too many clients',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'error': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    })
+    def get_events():
+        """Поток выдач достижений (server-sent events)."""
+        try:
+            user_id = get_int_arg('user_id')
+            achievement_id = get_int_arg('achievement_id')
+        except PaginationError as e:
+            logger.warning('Invalid event stream filter: %s', e)
+            return jsonify({'error': str(e)}), 400
+        # EventSource передаёт id последнего события в заголовке при переподключении
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            subscription, backlog = broadcaster.subscribe(user_id, achievement_id, last_event_id)
+        except TooManyClients as e:
+            logger.warning(str(e))
+            return jsonify({'error': str(e)}), 503
+        return Response(broadcaster.stream(subscription, backlog), mimetype=EVENT_MIMETYPE, headers={
+            'Cache-Control': 'no-cache',
+            # nginx не должен буферизовать поток
+            'X-Accel-Buffering': 'no'
+        })
+
+    @app.route('/internal/pool', methods=['GET'])
+    def get_pool_status():
+        """Состояние пула соединений с базой
+        ---
+        responses:
+            200:
+                description: Занятые и свободные соединения, число выдач, тайм-ауты и гистограмма ожидания (мс)
+                schema:
+                    type: object
+                    properties:
+                        pool:
+                            type: string
+                        size:
+                            type: integer
+                        checked_in:
+                            type: integer
+                        checked_out:
+                            type: integer
+                        overflow:
+                            type: integer
+                        timeout:
+                            type: number
+                        checkouts:
+                            type: integer
+                        timeouts:
+                            type: integer
+                        wait_ms:
+                            type: object
+                        replicas:
+                            type: object
+                            description: Последнее измеренное отставание реплик в секундах, null - реплика недоступна
+                        shards:
+                            type: object
+                            description: Состояние пулов соединений шардов
+        """
+        status = pool_status(db.engine)
+        if replica_router.replicas:
+            status['replicas'] = replica_router.status()
+        if shard_router.enabled:
+            status['shards'] = shard_router.status()
+        return jsonify(status)
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Метрики запросов, SQL и пула соединений в формате Prometheus
+        ---
+        produces:
+            - text/plain
+        responses:
+            200:
+                description: Счётчики и гистограммы задержек по маршрутам, числа и времени SQL-запросов на запрос
+        """
+        return app.response_class(metrics.render(), mimetype=PROMETHEUS_MIMETYPE)
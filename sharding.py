@@ -0,0 +1,252 @@
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+from operator import itemgetter
+
+from flask import current_app, request
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from etags import CATALOG
+from models import User, Achievement, DataVersion, UserDirectory, db
+from pagination import STREAM_BATCH_SIZE
+from pool import pool_status
+from stats import insert_for
+
+DEFAULT_BUCKETS = 1024
+# Параметр маршрута, по которому запрос направляется на шард пользователя
+USER_ARG = 'user_id'
+
+
+def parse_shard_map(value, buckets, shards):
+    """Разбирает SHARD_MAP: 'первый-последний=шард,...' -> список номер корзины -> номер шарда.
+
+    Без SHARD_MAP корзины делятся между шардами поровну непрерывными диапазонами.
+    """
+    if not value:
+        return [bucket * shards // buckets for bucket in range(buckets)]
+    mapping = [None] * buckets
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        span, _, shard = item.partition('=')
+        first, _, last = span.partition('-')
+        shard = int(shard)
+        if not 0 <= shard < shards:
+            raise ValueError(f'Shard {shard} in SHARD_MAP is not configured')
+        for bucket in range(int(first), int(last or first) + 1):
+            mapping[bucket] = shard
+    missing = [bucket for bucket, shard in enumerate(mapping) if shard is None]
+    if missing:
+        raise ValueError(f'SHARD_MAP does not cover bucket {missing[0]}')
+    return mapping
+
+
+class ShardRouter:
+    """Горизонтальное шардирование пользователей и их выдач по user_id.
+
+    Шарды задаются в DATABASE_SHARD_URLS и подключаются как binds
+    Flask-SQLAlchemy shard_0, shard_1, ... На шарде пользователя лежат его
+    User, UserAchievement, UserStats и ключи идемпотентности; каталог
+    Achievement копируется на каждый шард, поэтому выдача и чтение достижений
+    пользователя - запросы к одной базе. Основная база (DATABASE_URL) хранит
+    эталон каталога и справочник UserDirectory, выдающий глобальные id
+    пользователей и следящий за уникальностью username.
+
+    Пользователь попадает в корзину user_id % SHARD_BUCKETS, корзина - на
+    шард по SHARD_MAP: при добавлении шарда переносятся целые корзины.
+    Запросы с параметром маршрута user_id целиком идут на шард пользователя
+    (session.info['shard'], см. replicas.RoutingSession); маршруты по всем
+    пользователям опрашивают шарды параллельно и сливают частичные результаты.
+    Без DATABASE_SHARD_URLS всё хранится в основной базе, как раньше.
+    """
+
+    def __init__(self):
+        self.shards = []
+        self.buckets = DEFAULT_BUCKETS
+        self.shard_map = []
+        self._executor = None
+
+    def init_app(self, app):
+        """Добавляет шарды в SQLALCHEMY_BINDS; вызывается до db.init_app."""
+        urls = app.config.get('DATABASE_SHARD_URLS') or []
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        self.shards = []
+        for index, url in enumerate(urls):
+            key = f'shard_{index}'
+            binds[key] = url
+            self.shards.append(key)
+        self.buckets = app.config.get('SHARD_BUCKETS', DEFAULT_BUCKETS)
+        self.shard_map = parse_shard_map(app.config.get('SHARD_MAP'), self.buckets, len(self.shards)) \
+            if self.shards else []
+        if self.shards:
+            if app.config.get('AWARD_WRITE_BEHIND'):
+                # Номер последней записанной выдачи хранится в одной базе вместе с выдачами
+                raise RuntimeError('AWARD_WRITE_BEHIND is not supported with DATABASE_SHARD_URLS')
+            app.before_request(self._before_request)
+
+    @property
+    def enabled(self):
+        return bool(self.shards)
+
+    def shard_for(self, user_id):
+        """Bind шарда пользователя или None без шардирования."""
+        if not self.shards:
+            return None
+        return self.shards[self.shard_map[user_id % self.buckets]]
+
+    @contextmanager
+    def routed(self, key, session=None):
+        """Направляет запросы сессии на шард key (None - на основную базу) до выхода из блока."""
+        info = (session or db.session).info
+        previous = info.pop('shard', None)
+        if key is not None:
+            info['shard'] = key
+        try:
+            yield
+        finally:
+            info.pop('shard', None)
+            if previous is not None:
+                info['shard'] = previous
+
+    def group(self, items, user_id):
+        """Раскладывает items по шардам: словарь bind -> список в исходном порядке; user_id(item) - id пользователя."""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.shard_for(user_id(item)), []).append(item)
+        return groups
+
+    def each(self, session=None):
+        """По очереди направляет сессию на каждый шард и отдаёт его bind; без шардов - один проход по основной базе."""
+        for key in self.shards or [None]:
+            with self.routed(key, session):
+                yield key
+
+    def scatter(self, query):
+        """Выполняет query(session) на всех шардах параллельно, возвращает результаты в порядке шардов.
+
+        Каждый шард получает свою сессию в отдельном потоке; без шардов
+        query выполняется с db.session в текущем потоке.
+        """
+        if not self.shards:
+            return [query(db.session)]
+        engines = current_app.extensions['sqlalchemy'].engines
+
+        def run(key):
+            with Session(engines[key]) as session:
+                return query(session)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='shard')
+        return list(self._executor.map(run, self.shards))
+
+    def merge_pages(self, query, key, limit):
+        """Страница по всем шардам: query с limit + 1 строкой выполняется на каждом шарде, строки сливаются по key.
+
+        Возвращает до limit + 1 строк, как запрос к одной базе, - для split_page.
+        """
+        pages = self.scatter(lambda session: session.execute(query).all())
+        return list(islice(heapq.merge(*pages, key=key), limit + 1))
+
+    def iter_merged(self, query, key):
+        """Все строки query со всех шардов одним потоком в порядке key; с каждого шарда читаются пачками."""
+        engines = current_app.extensions['sqlalchemy'].engines
+        with ExitStack() as stack:
+            results = [stack.enter_context(engines[shard].connect())
+                       .execute(query.execution_options(yield_per=STREAM_BATCH_SIZE)) for shard in self.shards]
+            yield from heapq.merge(*results, key=key)
+
+    def assign_user(self, user, session=None):
+        """Выдаёт новому пользователю глобальный id и направляет сессию на его шард.
+
+        Имя резервируется в UserDirectory основной базы: занятое имя даёт
+        IntegrityError, как и уникальный индекс User без шардирования.
+        Коммит остаётся за вызывающим кодом.
+        """
+        session = session or db.session
+        if not self.shards:
+            return
+        entry = UserDirectory(username=user.username)
+        with self.routed(None, session):
+            session.add(entry)
+            session.flush()
+        user.id = entry.id
+        session.info['shard'] = self.shard_for(entry.id)
+
+    def import_users(self, rows, on_conflict, session=None):
+        """Пишет пачку импортируемых пользователей: имена - в UserDirectory, строки User - на их шарды.
+
+        on_conflict - политика importer для уже занятого username. Возвращает
+        число записанных пользователей; коммит остаётся за вызывающим кодом.
+        """
+        session = session or db.session
+        with self.routed(None, session):
+            stmt = insert_for(UserDirectory, session)
+            if on_conflict == 'skip':
+                stmt = stmt.on_conflict_do_nothing(index_elements=['username'])
+            elif on_conflict == 'update':
+                # Пустое обновление, чтобы RETURNING вернул id и уже существующих имён
+                stmt = stmt.on_conflict_do_update(index_elements=['username'],
+                                                  set_={'username': stmt.excluded.username})
+            ids = dict(session.execute(stmt.returning(UserDirectory.username, UserDirectory.id),
+                                       [{'username': row['username']} for row in rows]).all())
+        users = [dict(row, id=ids[row['username']]) for row in rows if row['username'] in ids]
+        for key, shard_users in self.group(users, itemgetter('id')).items():
+            with self.routed(key, session):
+                stmt = insert_for(User, session)
+                if on_conflict == 'update':
+                    stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'language': stmt.excluded.language})
+                session.execute(stmt, shard_users)
+        return len(users)
+
+    def sync_catalog(self, session=None):
+        """Копирует каталог достижений и его версию из основной базы на все шарды.
+
+        Вызывается после изменения каталога; повторный вызов безопасен и
+        догоняет шарды, на которые копирование не прошло.
+        """
+        if not self.shards:
+            return
+        session = session or db.session
+        with self.routed(None, session):
+            rows = [dict(row) for row in session.execute(select(
+                Achievement.id, Achievement.name, Achievement.points, Achievement.description
+            )).mappings()]
+            version = session.execute(select(DataVersion.name, DataVersion.value)
+                                      .where(DataVersion.name == CATALOG)).mappings().all()
+
+        def copy(shard_session):
+            for model, key, values in ((Achievement, 'id', rows), (DataVersion, 'name', version)):
+                if not values:
+                    continue
+                stmt = insert_for(model, shard_session)
+                shard_session.execute(stmt.on_conflict_do_update(
+                    index_elements=[key],
+                    set_={column: getattr(stmt.excluded, column) for column in values[0] if column != key}
+                ), [dict(value) for value in values])
+            shard_session.commit()
+
+        self.scatter(copy)
+
+    def status(self):
+        """Состояние пулов соединений шардов для служебного эндпоинта."""
+        engines = current_app.extensions['sqlalchemy'].engines
+        return {key: pool_status(engines[key]) for key in self.shards}
+
+    def _after_fork(self):
+        # Потоки пула не переживают fork: дочерний процесс создаст свой пул при первом запросе
+        self._executor = None
+
+    def _before_request(self):
+        # Сессия может пережить запрос, если контекст приложения открыт снаружи (CLI, тесты)
+        info = current_app.extensions['sqlalchemy'].session.info
+        info.pop('shard', None)
+        user_id = (request.view_args or {}).get(USER_ARG)
+        if user_id is not None:
+            info['shard'] = self.shard_for(user_id)
+
+
+shard_router = ShardRouter()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=shard_router._after_fork)
@@ -0,0 +1,633 @@
+import sqlite3
+from datetime import date, datetime, time
+
+from sqlalchemy import Integer, String, and_, bindparam, case, cast, delete, func, insert, literal, null, or_, \
+    select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from models import User, Achievement, UserAchievement, UserDailyStats, UserStats, db
+
+STATS_STREAK_DAYS = 7
+# Сколько лучших пользователей периода отдаёт /stats?from=&to=
+DEFAULT_TOP_USERS = 10
+MAX_TOP_USERS = 100
+
+
+class day_number(FunctionElement):
+    """Номер дня даты в том же счёте, что и date.toordinal()."""
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(day_number, 'postgresql')
+def _day_number_postgresql(element, compiler, **kw):
+    return "(CAST(%s AS DATE) - DATE '0001-01-01' + 1)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(day_number, 'sqlite')
+def _day_number_sqlite(element, compiler, **kw):
+    # julianday('0001-01-01') = 1721425.5, а toordinal() этой даты равен 1
+    return 'CAST(julianday(date(%s)) - 1721424.5 AS INTEGER)' % compiler.process(element.clauses, **kw)
+
+
+def window_functions_supported(session=None):
+    """Поддерживает ли база оконные функции; в SQLite они появились в 3.25."""
+    if (session or db.session).get_bind().dialect.name == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25, 0)
+    return True
+
+
+def insert_for(model, session=None):
+    """Возвращает INSERT с поддержкой ON CONFLICT для диалекта базы сессии."""
+    dialect = (session or db.session).get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    raise NotImplementedError(f'ON CONFLICT is not supported for dialect {dialect}')
+
+
+def apply_awards(awards, session=None):
+    """Обновляет агрегаты UserStats для выданных достижений.
+
+    awards - итерируемое из кортежей (user_id, points, date_awarded).
+    Вызывается в той же транзакции, что и вставка UserAchievement;
+    коммит остаётся за вызывающим кодом.
+
+    Серия дней обновляется инкрементально, если все новые выдачи пользователя
+    пришлись на один сегодняшний день. Выдачи задним числом или за несколько
+    дней сразу требуют пересчёта серии по истории этого пользователя.
+    Дневные итоги UserDailyStats увеличиваются тем же проходом.
+    """
+    session = session or db.session
+    today = datetime.utcnow().date().toordinal()
+    totals = {}
+    daily = {}
+    recompute = set()
+    for user_id, points, date_awarded in awards:
+        day = date_awarded.date().toordinal()
+        day_row = daily.setdefault((user_id, day), {'user_id': user_id, 'day': day, 'award_count': 0, 'points': 0})
+        day_row['award_count'] += 1
+        day_row['points'] += points
+        row = totals.setdefault(user_id, {
+            'user_id': user_id,
+            'achievements_count': 0,
+            'points_total': 0,
+            'last_awarded': date_awarded,
+            'last_award_day': day,
+            'current_streak': 1,
+            'best_streak': 1
+        })
+        row['achievements_count'] += 1
+        row['points_total'] += points
+        row['last_awarded'] = max(row['last_awarded'], date_awarded)
+        if day != row['last_award_day'] or day < today:
+            recompute.add(user_id)
+        row['last_award_day'] = max(row['last_award_day'], day)
+    if not totals:
+        return
+
+    stmt = insert_for(UserStats, session)
+    new_day = stmt.excluded.last_award_day
+    current_streak = case(
+        (UserStats.last_award_day == new_day, UserStats.current_streak),
+        (UserStats.last_award_day == new_day - 1, UserStats.current_streak + 1),
+        (UserStats.last_award_day < new_day, 1),
+        else_=UserStats.current_streak
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserStats.user_id],
+        set_={
+            'achievements_count': UserStats.achievements_count + stmt.excluded.achievements_count,
+            'points_total': UserStats.points_total + stmt.excluded.points_total,
+            'last_awarded': case(
+                (UserStats.last_awarded > stmt.excluded.last_awarded, UserStats.last_awarded),
+                else_=stmt.excluded.last_awarded
+            ),
+            'last_award_day': case(
+                (UserStats.last_award_day > new_day, UserStats.last_award_day),
+                else_=new_day
+            ),
+            'current_streak': current_streak,
+            'best_streak': case(
+                (current_streak > UserStats.best_streak, current_streak),
+                else_=UserStats.best_streak
+            )
+        }
+    )
+    session.execute(stmt, list(totals.values()))
+
+    stmt = insert_for(UserDailyStats, session)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[UserDailyStats.user_id, UserDailyStats.day],
+        set_={
+            'award_count': UserDailyStats.award_count + stmt.excluded.award_count,
+            'points': UserDailyStats.points + stmt.excluded.points
+        }
+    ), list(daily.values()))
+    if recompute:
+        recompute_streaks(recompute, session)
+
+
+def _streaks(days):
+    """Текущая (заканчивающаяся последним днём) и лучшая серии по отсортированным номерам дней."""
+    current = best = 0
+    previous = None
+    for day in days:
+        if previous is not None and day == previous:
+            continue
+        current = current + 1 if previous is not None and day == previous + 1 else 1
+        best = max(best, current)
+        previous = day
+    return current, best, previous
+
+
+def _streaks_query(user_ids=None):
+    """Серии по истории выдач одним запросом по схеме gaps-and-islands.
+
+    Номер дня минус порядковый номер дня у пользователя постоянен внутри
+    серии подряд идущих дней, поэтому группировка по этой разности даёт серии.
+    """
+    days = select(UserAchievement.user_id, day_number(UserAchievement.date_awarded).label('day')).distinct()
+    if user_ids is not None:
+        days = days.where(UserAchievement.user_id.in_(user_ids))
+    days = days.cte('days')
+    islands = select(
+        days.c.user_id,
+        days.c.day,
+        (days.c.day - func.row_number().over(partition_by=days.c.user_id, order_by=days.c.day)).label('island')
+    ).cte('islands')
+    runs = select(
+        islands.c.user_id,
+        func.count().label('length'),
+        func.max(islands.c.day).label('last_day')
+    ).group_by(islands.c.user_id, islands.c.island).cte('runs')
+    marked = select(
+        runs.c.user_id,
+        runs.c.length,
+        runs.c.last_day,
+        func.max(runs.c.last_day).over(partition_by=runs.c.user_id).label('user_last_day')
+    ).cte('marked')
+    return select(
+        marked.c.user_id,
+        func.max(case((marked.c.last_day == marked.c.user_last_day, marked.c.length))).label('current_streak'),
+        func.max(marked.c.length).label('best_streak'),
+        func.max(marked.c.last_day).label('last_award_day')
+    ).group_by(marked.c.user_id).order_by(marked.c.user_id)
+
+
+def _iter_user_streaks(user_ids=None, session=None):
+    """Серии по истории выдач: (user_id, current_streak, best_streak, last_award_day)."""
+    session = session or db.session
+    if window_functions_supported(session):
+        for row in session.execute(_streaks_query(user_ids).execution_options(yield_per=10000)):
+            yield row.user_id, row.current_streak, row.best_streak, row.last_award_day
+        return
+
+    query = select(UserAchievement.user_id, UserAchievement.date_awarded) \
+        .order_by(UserAchievement.user_id, UserAchievement.date_awarded)
+    if user_ids is not None:
+        query = query.where(UserAchievement.user_id.in_(user_ids))
+    user_id, days = None, []
+    for row in session.execute(query.execution_options(yield_per=10000)):
+        if row.user_id != user_id:
+            if days:
+                yield (user_id,) + _streaks(days)
+            user_id, days = row.user_id, []
+        days.append(row.date_awarded.date().toordinal())
+    if days:
+        yield (user_id,) + _streaks(days)
+
+
+def _update_streaks(streaks, session=None):
+    """Записывает серии в UserStats пачками."""
+    session = session or db.session
+    stmt = update(UserStats).where(UserStats.user_id == bindparam('b_user_id')).values(
+        current_streak=bindparam('b_current_streak'),
+        best_streak=bindparam('b_best_streak'),
+        last_award_day=bindparam('b_last_award_day')
+    )
+    batch = []
+    for user_id, current, best, last_day in streaks:
+        batch.append({'b_user_id': user_id, 'b_current_streak': current,
+                      'b_best_streak': best, 'b_last_award_day': last_day})
+        if len(batch) >= 1000:
+            session.connection().execute(stmt, batch)
+            batch = []
+    if batch:
+        session.connection().execute(stmt, batch)
+
+
+def recompute_streaks(user_ids, session=None):
+    """Пересчитывает серии пользователей по их истории выдач в текущей транзакции."""
+    _update_streaks(list(_iter_user_streaks(sorted(user_ids), session)), session)
+
+
+def _aggregate_query():
+    """Агрегаты, посчитанные заново по UserAchievement/Achievement."""
+    return db.session.query(
+        UserAchievement.user_id,
+        func.count(UserAchievement.id).label('achievements_count'),
+        func.sum(Achievement.points).label('points_total'),
+        func.max(UserAchievement.date_awarded).label('last_awarded')
+    ).join(Achievement, UserAchievement.achievement_id == Achievement.id).group_by(UserAchievement.user_id)
+
+
+def rebuild_user_stats():
+    """Пересобирает UserStats по всей истории выдач. Возвращает число строк."""
+    aggregates = _aggregate_query().subquery()
+    db.session.query(UserStats).delete(synchronize_session=False)
+    db.session.execute(insert(UserStats).from_select(
+        ['user_id', 'achievements_count', 'points_total', 'last_awarded'],
+        db.session.query(aggregates).statement
+    ))
+    _update_streaks(list(_iter_user_streaks()))
+    db.session.commit()
+    return db.session.query(func.count(UserStats.user_id)).scalar()
+
+
+def rebuild_daily_stats(since=None, session=None):
+    """Пересобирает UserDailyStats по истории выдач. Возвращает число записанных строк.
+
+    since - номер дня (date.toordinal()), с которого пересобирать; более
+    ранние дни не трогаются. После архивации секций (flask partitions
+    archive) старых выдач в UserAchievement уже нет, и полная пересборка
+    потеряла бы их дневные итоги, поэтому пересобирать нужно с дня после архива.
+    """
+    session = session or db.session
+    day = day_number(UserAchievement.date_awarded)
+    query = select(
+        UserAchievement.user_id,
+        day,
+        func.count(UserAchievement.id),
+        func.sum(Achievement.points)
+    ).join(Achievement, UserAchievement.achievement_id == Achievement.id).group_by(UserAchievement.user_id, day)
+    stale = delete(UserDailyStats)
+    if since is not None:
+        query = query.where(UserAchievement.date_awarded >= datetime.combine(date.fromordinal(since), time()))
+        stale = stale.where(UserDailyStats.day >= since)
+    session.execute(stale)
+    written = session.execute(insert(UserDailyStats).from_select(
+        ['user_id', 'day', 'award_count', 'points'], query
+    )).rowcount
+    session.commit()
+    return written
+
+
+def verify_user_stats():
+    """Сравнивает UserStats с пересчётом по истории, возвращает список расхождений."""
+    streaks = {user_id: streak for user_id, *streak in _iter_user_streaks()}
+    expected = {
+        row.user_id: (row.achievements_count, row.points_total, row.last_awarded, *streaks.get(row.user_id, ()))
+        for row in _aggregate_query().yield_per(1000)
+    }
+    mismatches = []
+    for stats in db.session.query(UserStats).yield_per(1000):
+        row = expected.pop(stats.user_id, None)
+        actual = (stats.achievements_count, stats.points_total, stats.last_awarded,
+                  stats.current_streak, stats.best_streak, stats.last_award_day)
+        if row is None:
+            if stats.achievements_count or stats.points_total:
+                mismatches.append({'user_id': stats.user_id, 'expected': None, 'actual': actual})
+        elif actual != row:
+            mismatches.append({'user_id': stats.user_id, 'expected': row, 'actual': actual})
+    for user_id, row in expected.items():
+        mismatches.append({'user_id': user_id, 'expected': row, 'actual': None})
+    return mismatches
+
+
+def streak_users_query(days, limit, after=None):
+    """Пользователи с серией не короче days дней, от длинных серий к коротким.
+
+    Читается по индексу (best_streak, user_id), поэтому время зависит только
+    от числа возвращённых пользователей. after - ключ (best_streak, user_id)
+    последней строки предыдущей страницы.
+    """
+    query = select(
+        UserStats.user_id,
+        User.username,
+        UserStats.best_streak,
+        UserStats.current_streak,
+        UserStats.last_award_day
+    ).join(User, User.id == UserStats.user_id).where(UserStats.best_streak >= days)
+    if after is not None:
+        after_streak, after_user_id = after
+        query = query.where(or_(
+            UserStats.best_streak < after_streak,
+            and_(UserStats.best_streak == after_streak, UserStats.user_id > after_user_id)
+        ))
+    return query.order_by(UserStats.best_streak.desc(), UserStats.user_id).limit(limit + 1)
+
+
+def stats_query(min_diff=True):
+    """Вся статистика /stats одним запросом.
+
+    Каждая часть - отдельная ветка UNION ALL с меткой kind. Минимальная разность
+    ищется через LAG по пользователям, отсортированным по очкам; без min_diff
+    (частичная статистика шарда, см. merge_stats) этой ветки нет.
+    """
+    totals = select(
+        UserStats.user_id,
+        User.username,
+        UserStats.achievements_count,
+        UserStats.points_total,
+        UserStats.best_streak
+    ).join(User, User.id == UserStats.user_id).cte('totals')
+    by_points = (totals.c.points_total, totals.c.user_id)
+    neighbours = select(
+        totals.c.user_id,
+        func.lag(totals.c.username).over(order_by=by_points).label('previous_username'),
+        totals.c.username,
+        (totals.c.points_total - func.lag(totals.c.points_total).over(order_by=by_points)).label('diff')
+    ).cte('neighbours')
+
+    def branch(kind, query):
+        subquery = query.subquery()
+        return select(literal(kind).label('kind'), *subquery.c)
+
+    no_username = cast(null(), String)
+    branches = [
+        branch('max_achievements', select(
+            totals.c.user_id, totals.c.username, no_username, totals.c.achievements_count
+        ).order_by(totals.c.achievements_count.desc(), totals.c.user_id).limit(1)),
+        branch('max_points', select(
+            totals.c.user_id, totals.c.username, no_username, totals.c.points_total
+        ).order_by(totals.c.points_total.desc(), totals.c.user_id.desc()).limit(1)),
+        branch('min_points', select(
+            totals.c.user_id, totals.c.username, no_username, totals.c.points_total
+        ).order_by(totals.c.points_total, totals.c.user_id).limit(1)),
+        branch('streak', select(
+            totals.c.user_id, totals.c.username, no_username, totals.c.best_streak
+        ).where(totals.c.best_streak >= STATS_STREAK_DAYS))
+    ]
+    if min_diff:
+        branches.append(branch('min_diff', select(
+            neighbours.c.user_id, neighbours.c.previous_username, neighbours.c.username, neighbours.c.diff
+        ).where(neighbours.c.diff.isnot(None)).order_by(neighbours.c.diff, neighbours.c.user_id).limit(1)))
+    return union_all(*branches)
+
+
+def stats_from_rows(rows):
+    """Собирает ответ /stats из строк запроса stats_query."""
+    parts = {}
+    streak_users = []
+    for kind, user_id, username1, username2, total in rows:
+        if kind == 'streak':
+            streak_users.append((user_id, username1))
+        else:
+            parts[kind] = (user_id, username1, username2, total)
+
+    max_achievements = parts.get('max_achievements')
+    max_points = parts.get('max_points')
+    min_points = parts.get('min_points')
+    min_diff = parts.get('min_diff')
+    if max_points and min_points and max_points[0] != min_points[0]:
+        max_diff = (max_points[1], min_points[1], max_points[3] - min_points[3])
+    else:
+        max_diff = (None, None, 0)
+
+    return {
+        'max_achievements_user': {
+            'username': max_achievements[1] if max_achievements else None,
+            'total': max_achievements[3] if max_achievements else 0
+        },
+        'max_points_user': {
+            'username': max_points[1] if max_points else None,
+            'total': max_points[3] if max_points else 0
+        },
+        'max_diff_users': {
+            'username1': max_diff[0],
+            'username2': max_diff[1],
+            'total': max_diff[2]
+        },
+        'min_diff_users': {
+            'username1': min_diff[1] if min_diff else None,
+            'username2': min_diff[2] if min_diff else None,
+            'total': min_diff[3] if min_diff else 0
+        },
+        'streak_users': [{'username': username} for _, username in sorted(streak_users)]
+    }
+
+
+def _collect_stats_fallback(session):
+    """Статистика несколькими запросами для баз без оконных функций."""
+    base = session.query(
+        UserStats.user_id,
+        User.username,
+        UserStats.achievements_count,
+        UserStats.points_total.label('total')
+    ).join(UserStats, User.id == UserStats.user_id)
+
+    # Пользователь с максимальным количеством достижений
+    max_achievements_user = base.order_by(UserStats.achievements_count.desc(), UserStats.user_id).first()
+
+    # Пользователи с максимальным и минимальным количеством очков
+    max_points_user = base.order_by(UserStats.points_total.desc(), UserStats.user_id.desc()).first()
+    min_points_user = base.order_by(UserStats.points_total.asc(), UserStats.user_id.asc()).first()
+
+    # Пользователи с максимальной разностью очков
+    if max_points_user and min_points_user and max_points_user.user_id != min_points_user.user_id:
+        max_diff_user1, max_diff_user2 = max_points_user, min_points_user
+        max_length = max_diff_user1.total - max_diff_user2.total
+    else:
+        max_diff_user1 = max_diff_user2 = None
+        max_length = 0
+
+    # Пользователи с минимальной разностью очков - соседние в отсортированном по очкам списке; как в stats_query,
+    # при равенстве разностей выбирается пара с наименьшим id второго пользователя
+    min_diff_user1 = min_diff_user2 = previous = best = None
+    min_length = 0
+    for row in base.order_by(UserStats.points_total, UserStats.user_id).yield_per(1000):
+        if previous is not None:
+            candidate = (row.total - previous.total, row.user_id)
+            if best is None or candidate < best:
+                best = candidate
+                min_diff_user1, min_diff_user2, min_length = previous, row, candidate[0]
+        previous = row
+
+    # Пользователи, которые получали достижения 7 дней подряд
+    streak_users = session.scalars(
+        select(User.username).join(UserStats, User.id == UserStats.user_id)
+        .where(UserStats.best_streak >= STATS_STREAK_DAYS).order_by(UserStats.user_id)
+    ).all()
+
+    return {
+        'max_achievements_user': {
+            'username': max_achievements_user.username if max_achievements_user else None,
+            'total': max_achievements_user.achievements_count if max_achievements_user else 0
+        },
+        'max_points_user': {
+            'username': max_points_user.username if max_points_user else None,
+            'total': max_points_user.total if max_points_user else 0
+        },
+        'max_diff_users': {
+            'username1': max_diff_user1.username if max_diff_user1 else None,
+            'username2': max_diff_user2.username if max_diff_user2 else None,
+            'total': max_length
+        },
+        'min_diff_users': {
+            'username1': min_diff_user1.username if min_diff_user1 else None,
+            'username2': min_diff_user2.username if min_diff_user2 else None,
+            'total': min_length
+        },
+        'streak_users': [{'username': username} for username in streak_users]
+    }
+
+
+def collect_stats(session=None):
+    """Собирает статистику системы по агрегатам UserStats."""
+    session = session or db.session
+    if window_functions_supported(session):
+        return stats_from_rows(session.execute(stats_query()))
+    return _collect_stats_fallback(session)
+
+
+def partial_stats(session=None):
+    """Частичная статистика одного шарда для merge_stats.
+
+    Крайние пользователи и серии - строки stats_query без минимальной
+    разности. Для неё - группы по значению points_total: наименьший, второй
+    по величине и наибольший user_id группы. Соседей по очкам из разных
+    шардов нельзя найти по одной минимальной разности на шард, а групп не
+    больше, чем различных сумм очков.
+    """
+    session = session or db.session
+    rows = [tuple(row) for row in session.execute(stats_query(min_diff=False))]
+    firsts = select(UserStats.points_total, func.min(UserStats.user_id).label('first_user_id')) \
+        .group_by(UserStats.points_total).subquery()
+    groups = session.execute(select(
+        UserStats.points_total,
+        func.min(UserStats.user_id),
+        func.min(case((UserStats.user_id > firsts.c.first_user_id, UserStats.user_id))),
+        func.max(UserStats.user_id)
+    ).join(firsts, firsts.c.points_total == UserStats.points_total).group_by(UserStats.points_total)).all()
+    return rows, [tuple(group) for group in groups]
+
+
+def merge_stats(parts, usernames):
+    """Собирает ответ /stats из частичной статистики шардов (partial_stats).
+
+    Крайние значения выбираются с тем же порядком при равенстве, что и в
+    stats_query. Минимальная разность ищется по объединённым группам очков:
+    два пользователя в одной группе дают разность 0, иначе сравниваются
+    соседние значения. usernames(user_ids) -> словарь user_id -> username
+    нужен только для пары с минимальной разностью.
+    """
+    order = {
+        'max_achievements': lambda row: (-row[4], row[1]),
+        'max_points': lambda row: (-row[4], -row[1]),
+        'min_points': lambda row: (row[4], row[1]),
+    }
+    best = {}
+    rows = []
+    groups = {}
+    for shard_rows, shard_groups in parts:
+        for row in shard_rows:
+            kind = row[0]
+            if kind not in order:
+                rows.append(row)
+            elif kind not in best or order[kind](row) < order[kind](best[kind]):
+                best[kind] = row
+        for points, first, second, last in shard_groups:
+            if points in groups:
+                known_first, known_second, known_last = groups[points]
+                ids = sorted(user_id for user_id in (known_first, known_second, first, second) if user_id is not None)
+                groups[points] = (ids[0], ids[1], max(known_last, last))
+            else:
+                groups[points] = (first, second, last)
+    rows.extend(best.values())
+
+    # Как в stats_query: наименьшая разность, при равенстве - наименьший id второго из пары
+    pair = None
+    previous = None
+    for points in sorted(groups):
+        first, second, last = groups[points]
+        if second is not None:
+            pair = min(pair or (0, second, first), (0, second, first))
+        if previous is not None:
+            candidate = (points - previous[0], first, previous[1])
+            pair = min(pair or candidate, candidate)
+        previous = (points, last)
+    if pair is not None:
+        diff, user_id, previous_user_id = pair
+        names = usernames([previous_user_id, user_id])
+        rows.append(('min_diff', user_id, names.get(previous_user_id), names.get(user_id), diff))
+    return stats_from_rows(rows)
+
+
+def _day_range(since, until):
+    """Условия на UserDailyStats.day для дней [since, until]; None - без ограничения с этой стороны."""
+    conditions = []
+    if since is not None:
+        conditions.append(UserDailyStats.day >= since)
+    if until is not None:
+        conditions.append(UserDailyStats.day <= until)
+    return conditions
+
+
+def partial_period_stats(since, until, top, session=None):
+    """Статистика за дни [since, until] только по UserDailyStats - частичная для merge_period_stats.
+
+    Дни - номера date.toordinal(). Возвращает итоги по дням (day, awards,
+    points, active_users), лучших top пользователей по очкам за период и
+    число активных пользователей. Время зависит от числа дней и активных в
+    них пользователей, а не от числа выдач.
+    """
+    session = session or db.session
+    conditions = _day_range(since, until)
+    days = session.execute(select(
+        UserDailyStats.day,
+        func.sum(UserDailyStats.award_count).label('awards'),
+        func.sum(UserDailyStats.points).label('points'),
+        func.count().label('active_users')
+    ).where(*conditions).group_by(UserDailyStats.day).order_by(UserDailyStats.day)).all()
+    totals = select(
+        UserDailyStats.user_id,
+        func.sum(UserDailyStats.award_count).label('awards'),
+        func.sum(UserDailyStats.points).label('points')
+    ).where(*conditions).group_by(UserDailyStats.user_id).subquery()
+    top_users = session.execute(
+        select(totals.c.user_id, User.username, totals.c.awards, totals.c.points)
+        .join(User, User.id == totals.c.user_id)
+        .order_by(totals.c.points.desc(), totals.c.user_id).limit(top)
+    ).all()
+    active_users = session.scalar(select(func.count()).select_from(totals))
+    return [tuple(row) for row in days], [tuple(row) for row in top_users], active_users
+
+
+def merge_period_stats(parts, top):
+    """Собирает ответ /stats за период из частичной статистики шардов (partial_period_stats).
+
+    Пользователи шардов не пересекаются, поэтому итоги по дням и число
+    активных пользователей складываются, а лучшие top выбираются из лучших
+    каждого шарда.
+    """
+    days = {}
+    top_users = []
+    active_users = 0
+    for shard_days, shard_top, shard_active in parts:
+        for day, awards, points, active in shard_days:
+            total = days.setdefault(day, [0, 0, 0])
+            total[0] += awards
+            total[1] += points
+            total[2] += active
+        top_users.extend(shard_top)
+        active_users += shard_active
+    top_users.sort(key=lambda row: (-row[3], row[0]))
+    return {
+        'awards': sum(total[0] for total in days.values()),
+        'points': sum(total[1] for total in days.values()),
+        'active_users': active_users,
+        'top_users': [{'user_id': user_id, 'username': username, 'awards': awards, 'points': points}
+                      for user_id, username, awards, points in top_users[:top]],
+        'days': [{'day': date.fromordinal(day).isoformat(), 'awards': awards, 'points': points,
+                  'active_users': active} for day, (awards, points, active) in sorted(days.items())]
+    }
+
+
+def user_daily_stats_query(user_id, since=None, until=None):
+    """Выдачи и очки пользователя по дням [since, until] в порядке дней, только по UserDailyStats."""
+    return select(UserDailyStats.day, UserDailyStats.award_count, UserDailyStats.points) \
+        .where(UserDailyStats.user_id == user_id, *_day_range(since, until)).order_by(UserDailyStats.day)
@@ -1,25 +1,23 @@
 import pytest
-from app import app, db
-from flask import Flask
-from sqlalchemy_utils import create_database, database_exists
-import os
 
+from app import create_app, db
 
-@pytest.fixture(scope='module')
-def test_client():
-    # Создание тестовой базы данных
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test.db'
-
-    if not database_exists(app.config['SQLALCHEMY_DATABASE_URI']):
-        create_database(app.config['SQLALCHEMY_DATABASE_URI'])
 
+@pytest.fixture
+def test_app():
+    # Каждый тест получает своё приложение с чистой базой SQLite в памяти
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+    })
     with app.app_context():
-        db.create_all()
-        yield app.test_client()
-        db.drop_all()
-        os.remove('test.db')
+        # Только основная база: binds реплик и шардов из других тестов остаются в db.metadatas
+        db.create_all(bind_key=None)
+    yield app
 
 
-@pytest.fixture(scope='module')
-def test_app():
-    return app
+@pytest.fixture
+def test_client(test_app):
+    with test_app.app_context():
+        yield test_app.test_client()
+        db.drop_all(bind_key=None)
@@ -1,4 +1,7 @@
+import asyncio
 import json
+from datetime import datetime, timedelta
+
 import pytest
 
 
@@ -107,3 +110,1088 @@ def test_get_stats(test_client):
     assert 'max_diff_users' in data
     assert 'min_diff_users' in data
     assert 'streak_users' in data
+
+
+def test_stats_values(test_client):
+    """Тест значений /stats и одинакового выбора пары с минимальной разностью в SQL и запасном пути."""
+    from models import db
+    from stats import _collect_stats_fallback, collect_stats
+
+    users = [json.loads(test_client.post('/user', json={'username': f'stat{i}', 'language': 'en'}).data)['user_id']
+             for i in range(3)]
+    achievements = {points: json.loads(test_client.post('/achievement', json={
+        'name': f'Stat {points}', 'points': points, 'description': 'Stat description'
+    }).data)['id'] for points in (5, 10, 20)}
+    # Очки: stat0 - 20, stat1 - 10, stat2 - 15; обе соседние пары различаются на 5, выбирается пара
+    # с наименьшим id второго пользователя: (stat2, stat0)
+    for user_id, points in ((users[0], 20), (users[1], 10), (users[2], 10), (users[2], 5)):
+        test_client.post(f'/user/{user_id}/achieve/{achievements[points]}')
+
+    data = json.loads(test_client.get('/stats').data)
+    assert data == {
+        'max_achievements_user': {'username': 'stat2', 'total': 2},
+        'max_points_user': {'username': 'stat0', 'total': 20},
+        'max_diff_users': {'username1': 'stat0', 'username2': 'stat1', 'total': 10},
+        'min_diff_users': {'username1': 'stat2', 'username2': 'stat0', 'total': 5},
+        'streak_users': []
+    }
+    assert _collect_stats_fallback(db.session) == collect_stats() == data
+
+
+def test_get_users_pagination(test_client):
+    """Тест постраничного получения пользователей."""
+    for i in range(3):
+        test_client.post('/user', json={'username': f'pageuser{i}', 'language': 'en'})
+    response = test_client.get('/users?limit=1')
+    assert response.status_code == 200
+    first_page = json.loads(response.data)
+    assert len(first_page) == 1
+    cursor = response.headers['X-Next-Cursor']
+
+    response = test_client.get(f'/users?limit=1&cursor={cursor}')
+    assert response.status_code == 200
+    second_page = json.loads(response.data)
+    assert second_page[0]['id'] > first_page[0]['id']
+
+
+def test_invalid_integer_parameters(test_client):
+    """Тест 400 на нечисловые limit, top, days, offset и around вместо значения по умолчанию."""
+    user_id = json.loads(test_client.post('/user', json={'username': 'intuser', 'language': 'en'}).data)['user_id']
+    for url in ('/users?limit=abc', '/achievements?limit=1.5', f'/user/{user_id}/achievements?limit=x',
+                '/stats?from=2024-01-01&top=ten', '/stats/streaks?days=abc', '/leaderboard?offset=abc',
+                f'/user/{user_id}/rank?around=abc'):
+        response = test_client.get(url)
+        assert response.status_code == 400, url
+        assert 'must be' in json.loads(response.data)['error']
+    assert test_client.get('/users?limit=').status_code == 200
+
+
+def test_get_users_ndjson(test_client):
+    """Тест потоковой выдачи пользователей в NDJSON."""
+    test_client.post('/user', json={
+        'username': 'ndjsonuser',
+        'language': 'en'
+    })
+    response = test_client.get('/users?format=ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    users = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert len(users) > 0
+    assert 'username' in users[0]
+
+
+def test_get_user_achievements_pagination(test_client):
+    """Тест постраничного получения достижений пользователя."""
+    user_response = test_client.post('/user', json={
+        'username': 'pageowner',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Paged Achievement',
+        'points': 5,
+        'description': 'Paged description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+    for _ in range(3):
+        test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+
+    response = test_client.get(f'/user/{user_id}/achievements?limit=2')
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 2
+    cursor = response.headers['X-Next-Cursor']
+
+    response = test_client.get(f'/user/{user_id}/achievements?limit=2&cursor={cursor}')
+    assert len(json.loads(response.data)) == 1
+    assert 'X-Next-Cursor' not in response.headers
+
+
+def test_get_user_achievements_invalid_cursor(test_client):
+    """Тест ответа на некорректный курсор."""
+    response = test_client.get('/user/1/achievements?cursor=invalid')
+    assert response.status_code == 400
+
+
+def test_award_batch(test_client):
+    """Тест пакетной выдачи достижений."""
+    user_response = test_client.post('/user', json={
+        'username': 'batchuser',
+        'language': 'ru'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Batch Achievement',
+        'points': 15,
+        'description': 'Batch description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+
+    response = test_client.post('/awards/batch', json={'awards': [
+        {'user_id': user_id, 'achievement_id': achievement_id},
+        [user_id, achievement_id, '2024-01-01T12:00:00'],
+        {'user_id': user_id, 'achievement_id': 999999},
+        {'user_id': 'invalid', 'achievement_id': achievement_id}
+    ]})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['awarded'] == 2
+    assert [result['status'] for result in data['results']] == [
+        'awarded', 'awarded', 'achievement_not_found', 'invalid'
+    ]
+
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert len(json.loads(response.data)) == 2
+
+
+def test_import_users(test_client):
+    """Тест импорта пользователей из CSV и NDJSON."""
+    response = test_client.post('/users/import', data='username,language\nimport1,en\nimport2,ru\nimport1,ru\n',
+                                content_type='text/csv')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['written'] == 2
+    assert data['skipped'] == 1
+
+    response = test_client.post('/users/import?on_conflict=error', data='{"username": "import1", "language": "en"}\n',
+                                content_type='application/x-ndjson')
+    assert response.status_code == 409
+
+    # Испорченный CSV - 400, а не 500
+    response = test_client.post('/users/import', data='username,language\n"broken,en\n', content_type='text/csv')
+    assert response.status_code == 400
+    assert 'invalid CSV' in json.loads(response.data)['error']
+
+
+def test_get_streak_users(test_client):
+    """Тест получения пользователей с сериями выдач."""
+    user_response = test_client.post('/user', json={
+        'username': 'streakuser',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Daily Achievement',
+        'points': 1,
+        'description': 'Daily description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+
+    now = datetime.utcnow()
+    test_client.post('/awards/batch', json={'awards': [
+        [user_id, achievement_id, (now - timedelta(days=days)).isoformat()] for days in range(3)
+    ]})
+
+    response = test_client.get('/stats/streaks?days=3')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    streak = next(row for row in data if row['user_id'] == user_id)
+    assert streak['username'] == 'streakuser'
+    assert streak['best_streak'] == 3
+
+    response = test_client.get('/stats/streaks?days=4')
+    assert user_id not in [row['user_id'] for row in json.loads(response.data)]
+
+
+def test_leaderboard(test_client):
+    """Тест рейтинга пользователей и места пользователя в нём."""
+    user_response = test_client.post('/user', json={
+        'username': 'leader',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Top Achievement',
+        'points': 100000,
+        'description': 'Top description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+    test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+
+    response = test_client.get('/leaderboard?limit=1')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data[0]['username'] == 'leader'
+    assert data[0]['rank'] == 1
+
+    response = test_client.get(f'/user/{user_id}/rank?around=1')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['rank'] == 1
+    assert data['points'] == 100000
+    assert data['around'][0]['user_id'] == user_id
+
+
+def test_leaderboard_rebuild_during_award(test_client, monkeypatch):
+    """Тест перестройки рейтинга: выдача, закоммиченная во время чтения снимка, не теряется."""
+    from leaderboard import Leaderboard, leaderboard
+
+    user_id = json.loads(test_client.post('/user', json={'username': 'racer', 'language': 'en'}).data)['user_id']
+    achievement_id = json.loads(test_client.post('/achievement', json={
+        'name': 'Race Achievement', 'points': 7, 'description': 'Race description'
+    }).data)['id']
+    test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+
+    read_totals = Leaderboard._read_totals
+    awarded = []
+
+    def read_then_award(user_ids=None):
+        totals = read_totals(user_ids)
+        if user_ids is None and not awarded:
+            # Выдача после чтения снимка, но до замены индекса
+            awarded.append(test_client.post(f'/user/{user_id}/achieve/{achievement_id}').status_code)
+        return totals
+
+    monkeypatch.setattr(Leaderboard, '_read_totals', staticmethod(read_then_award))
+    leaderboard.build()
+    assert awarded == [201]
+    assert leaderboard.points(user_id) == 14
+
+    # Устаревший индекс перестраивает один поток, остальные отвечают по старому
+    leaderboard.refresh_seconds = 1
+    leaderboard._built_at -= 10
+    built_at = leaderboard._built_at
+    with leaderboard._build_lock:
+        leaderboard.ensure_built()
+    assert leaderboard._built_at == built_at
+    leaderboard.ensure_built()
+    assert leaderboard._built_at > built_at
+    assert leaderboard.points(user_id) == 14
+
+
+def test_cache_invalidated_on_award(test_client):
+    """Тест сброса кэша списка достижений пользователя после выдачи."""
+    user_response = test_client.post('/user', json={
+        'username': 'cacheduser',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Cached Achievement',
+        'points': 3,
+        'description': 'Cached description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert json.loads(response.data) == []
+
+    test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert len(json.loads(response.data)) == 1
+
+
+
+def test_cache_background_refresh(test_app):
+    """Тест stale-while-revalidate: фоновое обновление проходит хуки запроса и сохраняет новый ответ."""
+    import threading
+
+    from flask import request
+
+    from cache import REFRESH_ENVIRON_KEY
+    from models import db
+
+    refreshes = []
+    test_app.before_request(lambda: refreshes.append(request.path) if request.environ.get(REFRESH_ENVIRON_KEY)
+                            else None)
+    with test_app.app_context():
+        client = test_app.test_client()
+        assert json.loads(client.get('/stats').data)['max_points_user']['username'] is None
+        user_id = json.loads(client.post('/user', json={'username': 'fresh', 'language': 'en'}).data)['user_id']
+        achievement_id = json.loads(client.post('/achievement', json={
+            'name': 'Fresh Achievement', 'points': 3, 'description': 'Fresh description'
+        }).data)['id']
+        client.post(f'/user/{user_id}/achieve/{achievement_id}')
+
+        # Устаревший ответ отдаётся сразу, новый считается в фоне
+        assert json.loads(client.get('/stats').data)['max_points_user']['username'] is None
+        for thread in threading.enumerate():
+            if thread.name == 'cache-refresh':
+                thread.join(timeout=5)
+        assert refreshes == ['/stats']
+        assert json.loads(client.get('/stats').data)['max_points_user']['username'] == 'fresh'
+        db.drop_all(bind_key=None)
+
+
+def test_cache_tag_versions_bounded():
+    """Тест вытеснения версий тегов: их число ограничено, а вытеснение не оживляет устаревшие записи."""
+    from cache import MemoryBackend
+
+    backend = MemoryBackend(max_entries=1, max_tags=2)
+    stored = backend.tag_versions(['user:1'])
+    backend.bump_tags(['user:1'])
+    backend.bump_tags(['user:2'])
+    backend.bump_tags(['user:3'])
+    assert len(backend._tags) == 2
+    assert backend.tag_versions(['user:1']) != stored
+
+
+def test_achievements_etag(test_client):
+    """Тест ответа 304 на неизменившийся каталог достижений."""
+    response = test_client.get('/achievements')
+    etag = response.headers['ETag']
+    response = test_client.get('/achievements', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    test_client.post('/achievement', json={
+        'name': 'Etag Achievement',
+        'points': 1,
+        'description': 'Etag description'
+    })
+    # Повтор имени - 409, а не ошибка при увеличении версии каталога
+    response = test_client.post('/achievement', json={
+        'name': 'Etag Achievement',
+        'points': 1,
+        'description': 'Etag description'
+    })
+    assert response.status_code == 409
+    response = test_client.get('/achievements', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_award_write_behind(test_client, test_app, tmp_path):
+    """Тест отложенной записи выдачи: 202 с award_id и запись после сброса очереди."""
+    from writebehind import award_queue
+
+    user_response = test_client.post('/user', json={
+        'username': 'writebehinduser',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Write Behind Achievement',
+        'points': 4,
+        'description': 'Write behind description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+
+    test_app.config.update(AWARD_WRITE_BEHIND=True, AWARD_JOURNAL_PATH=str(tmp_path / 'awards.journal'))
+    award_queue.init_app(test_app)
+    award_queue.start()
+    try:
+        response = test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+        assert response.status_code == 202
+        award_id = json.loads(response.data)['award_id']
+
+        response = test_client.post(f'/user/{user_id}/achieve/999999')
+        assert response.status_code == 404
+
+        award_queue.stop()
+        response = test_client.get(f'/awards/{award_id}')
+        assert json.loads(response.data)['status'] == 'committed'
+    finally:
+        award_queue.stop()
+        test_app.config['AWARD_WRITE_BEHIND'] = False
+        award_queue.init_app(test_app)
+
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert len(json.loads(response.data)) == 1
+
+
+def test_award_write_behind_failed_row(test_client, test_app, tmp_path):
+    """Тест отложенной записи группы с ошибочной выдачей: отбрасывается только она, журнал сжимается."""
+    from writebehind import award_queue
+
+    user_response = test_client.post('/user', json={
+        'username': 'failedrowuser',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Failed Row Achievement',
+        'points': 2,
+        'description': 'Failed row description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+
+    journal_path = tmp_path / 'awards.journal'
+    test_app.config.update(AWARD_WRITE_BEHIND=True, AWARD_JOURNAL_PATH=str(journal_path),
+                           AWARD_FLUSH_INTERVAL_MS=60000, AWARD_JOURNAL_COMPACT_ROWS=1)
+    award_queue.init_app(test_app)
+    award_queue.start()
+    try:
+        first = award_queue.submit(user_id, achievement_id)
+        # Выдача без пользователя проходит проверку кэша, но база отвергнет её по NOT NULL
+        award_queue._known_users.add(None)
+        failed = award_queue.submit(None, achievement_id)
+        second = award_queue.submit(user_id, achievement_id)
+        award_queue.flush()
+
+        assert [award_queue.status(award_id) for award_id in (first, failed, second)] == [
+            'committed', 'failed', 'committed'
+        ]
+        assert award_queue.pending_count() == 0
+        response = test_client.get(f'/user/{user_id}/achievements')
+        assert len(json.loads(response.data)) == 2
+
+        # В журнале остаются только незаписанные выдачи
+        third = award_queue.submit(user_id, achievement_id)
+        assert [json.loads(line)['award_id'] for line in journal_path.read_text().splitlines()] == [third]
+    finally:
+        award_queue.stop()
+        award_queue._known_users.discard(None)
+        test_app.config.update(AWARD_WRITE_BEHIND=False, AWARD_FLUSH_INTERVAL_MS=50, AWARD_JOURNAL_COMPACT_ROWS=100000)
+        award_queue.init_app(test_app)
+
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert len(json.loads(response.data)) == 3
+
+
+def test_award_write_behind_missing_achievement(test_client, test_app, tmp_path):
+    """Тест отложенной записи выдачи удалённого достижения: она отмечается failed, поток записи продолжает работу."""
+    from models import Achievement, db
+    from writebehind import award_queue
+
+    user_id = json.loads(test_client.post('/user', json={'username': 'goneuser', 'language': 'en'}).data)['user_id']
+    kept, gone = (json.loads(test_client.post('/achievement', json={
+        'name': name, 'points': 3, 'description': 'Gone description'
+    }).data)['id'] for name in ('Kept Achievement', 'Gone Achievement'))
+
+    test_app.config.update(AWARD_WRITE_BEHIND=True, AWARD_JOURNAL_PATH=str(tmp_path / 'awards.journal'),
+                           AWARD_FLUSH_INTERVAL_MS=60000)
+    award_queue.init_app(test_app)
+    award_queue.start()
+    try:
+        first = award_queue.submit(user_id, kept)
+        missing = award_queue.submit(user_id, gone)
+        db.session.execute(db.delete(Achievement).where(Achievement.id == gone))
+        db.session.commit()
+        award_queue.flush()
+        assert [award_queue.status(award_id) for award_id in (first, missing)] == ['committed', 'failed']
+        assert award_queue.pending_count() == 0
+    finally:
+        award_queue.stop()
+        test_app.config.update(AWARD_WRITE_BEHIND=False, AWARD_FLUSH_INTERVAL_MS=50)
+        award_queue.init_app(test_app)
+
+
+def test_award_journal_checkpoints(test_client, test_app, tmp_path):
+    """Тест журналов очереди: разные checkpoint у одноимённых журналов, следующий слот, выключение без слотов."""
+    from writebehind import AwardQueue
+
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    assert AwardQueue._checkpoint_for(str(tmp_path / 'a' / 'awards.journal')) != \
+        AwardQueue._checkpoint_for(str(tmp_path / 'b' / 'awards.journal'))
+    assert len(AwardQueue._checkpoint_for(str(tmp_path / 'a' / ('x' * 200)))) <= 40
+
+    (tmp_path / 'link').symlink_to(tmp_path / 'a')
+    queues = []
+    for path in (tmp_path / 'a' / 'awards.journal', tmp_path / 'link' / 'awards.journal'):
+        queue = AwardQueue()
+        queue.init_app(test_app)
+        queue.enabled, queue.journal_path, queue.journal_slots = True, str(path), 2
+        queues.append(queue)
+    queues[0].start()
+    queues[1].start()
+    try:
+        assert queues[1]._journal_path == str(tmp_path / 'link' / 'awards.journal.1')
+        assert queues[0]._checkpoint_name != queues[1]._checkpoint_name
+
+        queue = AwardQueue()
+        queue.init_app(test_app)
+        queue.enabled, queue.journal_path, queue.journal_slots = True, str(tmp_path / 'a' / 'awards.journal'), 2
+        queue._start_on_request()
+        assert not queue.enabled
+    finally:
+        queues[0].stop()
+        queues[1].stop()
+
+
+def test_pool_status(test_client):
+    """Тест эндпоинта состояния пула соединений."""
+    response = test_client.get('/internal/pool')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert {'pool', 'checkouts', 'timeouts', 'wait_ms'} <= data.keys()
+
+
+def test_metrics(test_client):
+    """Тест метрик маршрутов в формате Prometheus."""
+    test_client.get('/achievements')
+    response = test_client.get('/metrics')
+    assert response.status_code == 200
+    body = response.data.decode()
+    assert 'http_requests_total{route="/achievements",method="GET",status="200"}' in body
+    assert 'http_request_sql_statements_count{route="/achievements"}' in body
+
+
+def test_award_idempotency_key(test_client):
+    """Тест повторной выдачи с тем же Idempotency-Key."""
+    user_response = test_client.post('/user', json={
+        'username': 'retryuser',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Retry Achievement',
+        'points': 7,
+        'description': 'Retry description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+
+    headers = {'Idempotency-Key': 'retry-award-1'}
+    response = test_client.post(f'/user/{user_id}/achieve/{achievement_id}', headers=headers)
+    assert response.status_code == 201
+    response = test_client.post(f'/user/{user_id}/achieve/{achievement_id}', headers=headers)
+    assert response.status_code == 200
+
+    batch = {'awards': [[user_id, achievement_id]]}
+    test_client.post('/awards/batch', json=batch, headers={'Idempotency-Key': 'retry-batch-1'})
+    response = test_client.post('/awards/batch', json=batch, headers={'Idempotency-Key': 'retry-batch-1'})
+    assert json.loads(response.data)['results'][0]['status'] == 'duplicate'
+    # Тот же ключ с другой пачкой не выдаёт её и не помечает элементы повторами
+    other_batch = {'awards': [[user_id, achievement_id], [user_id, achievement_id]]}
+    response = test_client.post('/awards/batch', json=other_batch, headers={'Idempotency-Key': 'retry-batch-1'})
+    assert response.status_code == 422
+    # Ключ одиночной выдачи тоже нельзя переиспользовать для пачки
+    response = test_client.post('/awards/batch', json=batch, headers=headers)
+    assert response.status_code == 422
+
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert len(json.loads(response.data)) == 2
+    response = test_client.get(f'/user/{user_id}/rank')
+    assert json.loads(response.data)['points'] == 14
+
+
+def test_award_partitions(test_app, tmp_path):
+    """Тест имён месячных секций и пропуска обслуживания секций на несекционированной таблице."""
+    from datetime import date
+
+    from sqlalchemy import func, select
+
+    from models import AwardKey, db
+    from partitions import add_months, archive_partitions, ensure_partitions, partition_maintainer, partition_name
+
+    assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert partition_name(date(2025, 2, 1)) == 'user_achievement_y2025m02'
+    with test_app.app_context():
+        db.session.add(AwardKey(key='old-key', created_at=datetime(2020, 1, 1)))
+        db.session.commit()
+        assert ensure_partitions() == []
+        assert partition_maintainer.check() == []
+        # Фоновая проверка секций запускается только на PostgreSQL
+        test_app.test_client().get('/')
+        assert partition_maintainer._thread is None
+        # Не на PostgreSQL архивация ничего не выгружает и не удаляет, в том числе старые ключи
+        assert archive_partitions(date(2030, 1, 1), str(tmp_path / 'archive')) == []
+        assert not (tmp_path / 'archive').exists()
+        assert db.session.scalar(select(func.count()).select_from(AwardKey)) == 1
+        runner = test_app.test_cli_runner()
+        result = runner.invoke(args=['partitions', 'archive', '--before', '2020-01',
+                                     '--output-dir', str(tmp_path / 'archive')])
+        assert result.exit_code != 0
+        assert 'not partitioned' in result.output
+
+
+def test_bootstrap_command(tmp_path):
+    """Тест создания схемы командой flask bootstrap и повторного запуска на готовой базе."""
+    from sqlalchemy import inspect
+
+    from app import create_app, db
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "bootstrap.db"}'})
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['bootstrap'])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(args=['bootstrap'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        tables = inspect(db.engine).get_table_names()
+        db.engine.dispose()
+    assert {'user', 'achievement', 'user_achievement', 'award_key', 'alembic_version'} <= set(tables)
+
+
+def test_bootstrap_baseline_schema(tmp_path):
+    """Тест flask bootstrap на базе, созданной db.create_all() до миграций: статистика восстанавливается по выдачам."""
+    import sqlite3
+
+    from app import create_app, db
+    from stats import verify_user_stats
+
+    path = tmp_path / 'baseline.db'
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, language VARCHAR(2) NOT NULL,
+                           PRIMARY KEY (id), UNIQUE (username));
+        CREATE TABLE achievement (id INTEGER NOT NULL, name VARCHAR(80) NOT NULL, points INTEGER NOT NULL,
+                                  description VARCHAR(200) NOT NULL, PRIMARY KEY (id), UNIQUE (name));
+        CREATE TABLE user_achievement (id INTEGER NOT NULL, user_id INTEGER NOT NULL, achievement_id INTEGER NOT NULL,
+                                       date_awarded DATETIME NOT NULL, PRIMARY KEY (id),
+                                       FOREIGN KEY(user_id) REFERENCES user (id),
+                                       FOREIGN KEY(achievement_id) REFERENCES achievement (id));
+        INSERT INTO user VALUES (1, 'olduser', 'en');
+        INSERT INTO achievement VALUES (1, 'Old First', 10, 'Old'), (2, 'Old Second', 5, 'Old');
+        INSERT INTO user_achievement VALUES (1, 1, 1, '2024-05-01 10:00:00.000000'),
+                                            (2, 1, 2, '2024-05-02 11:00:00.000000');
+    """)
+    connection.commit()
+    connection.close()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    result = app.test_cli_runner().invoke(args=['bootstrap'])
+    assert result.exit_code == 0, result.output
+    assert 'stamped as d052ee39fb78' in result.output
+    with app.app_context():
+        # Выдачи, сделанные до появления user_stats, учтены в агрегатах так же, как flask stats rebuild
+        assert verify_user_stats() == []
+
+    client = app.test_client()
+    response = client.post('/achievement', json={'name': 'New', 'points': 1, 'description': 'New'})
+    assert response.status_code == 201
+    response = client.get('/stats')
+    assert response.status_code == 200
+    response = client.get('/stats/streaks?days=2')
+    assert response.status_code == 200
+    streaks = response.get_json()
+    assert [(row['user_id'], row['best_streak'], row['last_award_date']) for row in streaks] == [(1, 2, '2024-05-02')]
+    response = client.get('/user/1/rank')
+    assert response.status_code == 200
+    assert response.get_json()['points'] == 15
+    with app.app_context():
+        db.engine.dispose()
+
+
+def test_request_logging(tmp_path):
+    """Тест JSON-логов с id запроса и выборочной записи INFO-строк маршрута."""
+    from app import create_app, db
+    from logs import log_pipeline
+
+    log_file = tmp_path / 'app.log'
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'LOG_FILE': str(log_file),
+        'LOG_SAMPLE_RATES': '/achievement=0'
+    })
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        response = client.post('/user', json={'username': 'loguser', 'language': 'en'},
+                               headers={'X-Request-ID': 'req-1'})
+        assert response.headers['X-Request-ID'] == 'req-1'
+        response = client.post('/user', json={'username': 'loguser', 'language': 'en'})
+        assert len(response.headers['X-Request-ID']) == 32
+        client.post('/achievement', json={'name': 'Log Achievement', 'points': 1, 'description': 'Log'})
+    log_pipeline.stop()
+
+    entries = [json.loads(line) for line in log_file.read_text(encoding='utf-8').splitlines()]
+    added = [entry for entry in entries if entry['message'] == 'User loguser added successfully']
+    assert added[0]['request_id'] == 'req-1'
+    assert added[0]['route'] == '/user'
+    assert any(entry['level'] == 'WARNING' and entry['message'] == 'User loguser already exists' for entry in entries)
+    assert not any(entry['message'].startswith('Achievement Log Achievement') for entry in entries)
+
+
+def test_json_serialization(test_client):
+    """Тест кодирования ответов: даты в ISO 8601, спецификация Swagger с числовыми ключами."""
+    user_response = test_client.post('/user', json={
+        'username': 'jsonuser',
+        'language': 'en'
+    })
+    user_id = json.loads(user_response.data)['user_id']
+    achievement_response = test_client.post('/achievement', json={
+        'name': 'Json Achievement',
+        'points': 3,
+        'description': 'Json description'
+    })
+    achievement_id = json.loads(achievement_response.data)['id']
+    test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert response.mimetype == 'application/json'
+    data = json.loads(response.data)
+    assert data[0]['name'] == 'Json Achievement'
+    awarded = datetime.fromisoformat(data[0]['date_awarded'])
+    assert awarded.microsecond == 0
+    assert abs(datetime.utcnow() - awarded) < timedelta(minutes=1)
+
+    response = test_client.get('/apispec_1.json')
+    assert response.status_code == 200
+    assert '/user/{user_id}/achievements' in json.loads(response.data)['paths']
+
+
+def test_replica_routing(tmp_path):
+    """Тест чтения с реплики: маршруты чтения идут на реплику, запись и X-Read-Consistency: strong - на основной."""
+    from app import create_app, db
+    from models import User
+
+    def make_app(max_lag):
+        return create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "primary.db"}',
+            'DATABASE_REPLICA_URLS': [f'sqlite:///{tmp_path / "replica.db"}'],
+            'REPLICA_MAX_LAG_SECONDS': max_lag,
+            'CACHE_BACKEND': 'none'
+        })
+
+    app = make_app(1)
+    with app.app_context():
+        db.create_all()
+        with db.engines['replica_0'].begin() as connection:
+            User.__table__.create(connection)
+            connection.execute(User.__table__.insert(), {'username': 'replicauser', 'language': 'en'})
+        client = app.test_client()
+        response = client.post('/user', json={'username': 'primaryuser', 'language': 'en'})
+        assert response.status_code == 201
+
+        response = client.get('/users')
+        assert [user['username'] for user in json.loads(response.data)] == ['replicauser']
+        response = client.get('/users', headers={'X-Read-Consistency': 'strong'})
+        assert [user['username'] for user in json.loads(response.data)] == ['primaryuser']
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+    # Реплика, отстающая больше допустимого, не используется
+    app = make_app(-1)
+    with app.app_context():
+        response = app.test_client().get('/users')
+        assert [user['username'] for user in json.loads(response.data)] == ['primaryuser']
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_replica_cache_bypass(tmp_path):
+    """Тест кэша ответов с репликами: ответ реплики свеж не дольше допустимого отставания, strong и cookie мимо кэша."""
+    import time
+
+    from app import create_app, db
+    from models import User
+
+    def make_app(max_lag):
+        return create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "primary.db"}',
+            'DATABASE_REPLICA_URLS': [f'sqlite:///{tmp_path / "replica.db"}'],
+            'REPLICA_MAX_LAG_SECONDS': max_lag
+        })
+
+    app = make_app(0.5)
+    with app.app_context():
+        db.create_all()
+        with db.engines['replica_0'].begin() as connection:
+            User.__table__.create(connection)
+            connection.execute(User.__table__.insert(), {'username': 'replica1', 'language': 'en'})
+        client = app.test_client(use_cookies=False)
+        response = client.get('/users')
+        assert [user['username'] for user in json.loads(response.data)] == ['replica1']
+        with db.engines['replica_0'].begin() as connection:
+            connection.execute(User.__table__.insert(), {'username': 'replica2', 'language': 'en'})
+        response = client.get('/users')
+        assert [user['username'] for user in json.loads(response.data)] == ['replica1']
+        time.sleep(0.6)
+        response = client.get('/users')
+        assert [user['username'] for user in json.loads(response.data)] == ['replica1', 'replica2']
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+    # Реплика отстаёт: ответы основного сервера кэшируются, но не для клиентов, требующих свежих данных
+    app = make_app(-1)
+    with app.app_context():
+        client = app.test_client(use_cookies=False)
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.insert(), {'username': 'primary1', 'language': 'en'})
+        assert len(json.loads(client.get('/users').data)) == 1
+        with db.engine.begin() as connection:
+            connection.execute(User.__table__.insert(), {'username': 'primary2', 'language': 'en'})
+        assert len(json.loads(client.get('/users').data)) == 1
+        response = client.get('/users', headers={'X-Read-Consistency': 'strong'})
+        assert len(json.loads(response.data)) == 2
+        response = client.get('/users', headers={'Cookie': f'db_last_write={time.time():.3f}'})
+        assert len(json.loads(response.data)) == 2
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_sharding(tmp_path):
+    """Тест шардирования: пользователи и выдачи на шарде по user_id, /users и /stats собираются со всех шардов."""
+    from sqlalchemy import func, select
+
+    from app import create_app, db
+    from models import User, UserAchievement
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "main.db"}',
+        'DATABASE_SHARD_URLS': [f'sqlite:///{tmp_path / "shard0.db"}', f'sqlite:///{tmp_path / "shard1.db"}'],
+        'SHARD_BUCKETS': 2,
+        'CACHE_BACKEND': 'none'
+    })
+    with app.app_context():
+        for engine in db.engines.values():
+            db.metadata.create_all(engine)
+        client = app.test_client()
+        for username in ('alice', 'bob', 'carol'):
+            response = client.post('/user', json={'username': username, 'language': 'en'})
+            assert response.status_code == 201
+        assert client.post('/user', json={'username': 'bob', 'language': 'ru'}).status_code == 409
+        response = client.post('/users/import', data='username,language\ndave,ru\nbob,ru\n', content_type='text/csv')
+        assert json.loads(response.data)['written'] == 1
+        gold = json.loads(client.post('/achievement', json={'name': 'Gold', 'points': 10, 'description': 'g'}).data)['id']
+        silver = json.loads(client.post('/achievement', json={'name': 'Silver', 'points': 3, 'description': 's'}).data)['id']
+
+        # Нечётные id - на shard_1, чётные - на shard_0; каталог скопирован на оба шарда
+        with db.engines['shard_1'].connect() as connection:
+            assert connection.execute(select(User.username).order_by(User.id)).scalars().all() == ['alice', 'carol']
+        with db.engines['shard_0'].connect() as connection:
+            assert connection.execute(select(User.username).order_by(User.id)).scalars().all() == ['bob', 'dave']
+        assert db.session.scalar(select(func.count()).select_from(User)) == 0
+
+        assert client.post(f'/user/1/achieve/{gold}').status_code == 201
+        assert client.post(f'/user/2/achieve/{gold}').status_code == 201
+        response = client.post('/awards/batch', json={'awards': [[2, silver], [3, silver], [5, silver]]})
+        assert [result['status'] for result in json.loads(response.data)['results']] == \
+            ['awarded', 'awarded', 'user_not_found']
+        with db.engines['shard_0'].connect() as connection:
+            assert connection.execute(select(func.count()).select_from(UserAchievement)).scalar() == 2
+
+        response = client.get('/users?limit=2')
+        assert [user['id'] for user in json.loads(response.data)] == [1, 2]
+        response = client.get(f'/users?cursor={response.headers["X-Next-Cursor"]}')
+        assert [user['username'] for user in json.loads(response.data)] == ['carol', 'dave']
+        response = client.get('/users?format=ndjson')
+        assert [json.loads(line)['id'] for line in response.data.splitlines()] == [1, 2, 3, 4]
+
+        assert json.loads(client.get('/user/3').data)['username'] == 'carol'
+        response = client.get('/user/2/achievements')
+        assert sorted(item['name'] for item in json.loads(response.data)) == ['Gold', 'Silver']
+
+        stats = json.loads(client.get('/stats').data)
+        assert stats['max_points_user'] == {'username': 'bob', 'total': 13}
+        assert stats['max_diff_users'] == {'username1': 'bob', 'username2': 'carol', 'total': 10}
+        # Соседи по очкам с разных шардов: alice (10) и bob (13)
+        assert stats['min_diff_users'] == {'username1': 'alice', 'username2': 'bob', 'total': 3}
+        period = json.loads(client.get('/stats?from=2000-01-01&top=2').data)
+        assert (period['awards'], period['points'], period['active_users']) == (4, 26, 3)
+        assert [user['username'] for user in period['top_users']] == ['bob', 'alice']
+
+        response = client.get('/leaderboard')
+        assert [(entry['username'], entry['points']) for entry in json.loads(response.data)] == \
+            [('bob', 13), ('alice', 10), ('carol', 3)]
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_daily_stats(test_client):
+    """Тест дневных итогов: статистика за период и история пользователя читаются из UserDailyStats."""
+    from stats import rebuild_daily_stats
+
+    users = [json.loads(test_client.post('/user', json={'username': f'daily{i}', 'language': 'en'}).data)['user_id']
+             for i in range(2)]
+    achievement_id = json.loads(test_client.post('/achievement', json={
+        'name': 'Daily Achievement', 'points': 5, 'description': 'Daily description'
+    }).data)['id']
+    test_client.post('/awards/batch', json={'awards': [
+        [users[0], achievement_id, '2024-03-01T10:00:00'],
+        [users[0], achievement_id, '2024-03-01T23:00:00'],
+        [users[0], achievement_id, '2024-03-03T09:00:00'],
+        [users[1], achievement_id, '2024-03-03T12:00:00'],
+        [users[1], achievement_id, '2024-04-01T12:00:00'],
+    ]})
+
+    response = test_client.get(f'/user/{users[0]}/stats/daily')
+    assert json.loads(response.data) == [
+        {'day': '2024-03-01', 'award_count': 2, 'points': 10},
+        {'day': '2024-03-03', 'award_count': 1, 'points': 5}
+    ]
+    response = test_client.get(f'/user/{users[1]}/stats/daily?from=2024-03-02&to=2024-03-31')
+    assert [row['day'] for row in json.loads(response.data)] == ['2024-03-03']
+
+    response = test_client.get('/stats?from=2024-03-01&to=2024-03-31&top=1')
+    data = json.loads(response.data)
+    assert (data['awards'], data['points'], data['active_users']) == (4, 20, 2)
+    assert data['top_users'] == [{'user_id': users[0], 'username': 'daily0', 'awards': 3, 'points': 15}]
+    assert data['days'] == [
+        {'day': '2024-03-01', 'awards': 2, 'points': 10, 'active_users': 1},
+        {'day': '2024-03-03', 'awards': 2, 'points': 10, 'active_users': 2}
+    ]
+    assert test_client.get('/stats?from=2024-04-01&to=2024-03-01').status_code == 400
+    assert test_client.get('/stats?from=yesterday').status_code == 400
+
+    # Пересборка с дня даёт те же итоги и не трогает более ранние дни
+    assert rebuild_daily_stats(since=datetime(2024, 3, 3).date().toordinal()) == 3
+    response = test_client.get('/stats?from=2024-03-01', headers={'Cache-Control': 'no-cache'})
+    assert json.loads(response.data)['awards'] == 5
+
+
+def test_award_events(test_client):
+    """Тест потока /events: выдача приходит подписчику после коммита, Last-Event-ID дочитывает пропущенное."""
+    from events import Subscription, broadcaster
+
+    users = [json.loads(test_client.post('/user', json={'username': f'events{i}', 'language': 'en'}).data)['user_id']
+             for i in range(2)]
+    achievement_id = json.loads(test_client.post('/achievement', json={
+        'name': 'Events Achievement', 'points': 7, 'description': 'Events description'
+    }).data)['id']
+
+    # Нечисловой фильтр - ошибка, а не подписка на все выдачи
+    assert test_client.get('/events?user_id=abc').status_code == 400
+    assert test_client.get('/events?achievement_id=abc').status_code == 400
+    assert broadcaster.clients == 0
+
+    response = test_client.get(f'/events?user_id={users[0]}', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    test_client.post(f'/user/{users[1]}/achieve/{achievement_id}')
+    test_client.post(f'/user/{users[0]}/achieve/{achievement_id}')
+    lines = next(chunks).decode().splitlines()
+    first_id = lines[0][len('id: '):]
+    assert lines[1] == 'event: award'
+    data = json.loads(lines[2][len('data: '):])
+    assert (data['user_id'], data['achievement_id'], data['points']) == (users[0], achievement_id, 7)
+    response.close()
+    assert broadcaster.clients == 0
+
+    test_client.post('/awards/batch', json={'awards': [[users[0], achievement_id], [users[1], achievement_id]]})
+    response = test_client.get(f'/events?user_id={users[0]}', headers={'Last-Event-ID': first_id}, buffered=False)
+    chunks = iter(response.response)
+    next(chunks)
+    assert json.loads(next(chunks).decode().splitlines()[2][len('data: '):])['user_id'] == users[0]
+    response.close()
+
+    # Клиент, не успевающий читать, отключается при переполнении буфера
+    subscription = Subscription(buffer_size=1)
+    subscription.offer({'id': 'x-1', 'user_id': 1, 'achievement_id': 1})
+    subscription.offer({'id': 'x-2', 'user_id': 1, 'achievement_id': 1})
+    assert subscription.overflowed
+    assert list(broadcaster.stream(subscription, [])) == [b'retry: 3000\n\n']
+
+
+def test_achievement_translations(test_client):
+    """Тест переводов каталога: тексты на языке из lang, Accept-Language или языка пользователя."""
+    user_id = json.loads(test_client.post('/user', json={'username': 'rususer', 'language': 'ru'}).data)['user_id']
+    achievement_id = json.loads(test_client.post('/achievement', json={
+        'name': 'First Step', 'points': 5, 'description': 'Make the first step'
+    }).data)['id']
+    test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+    response = test_client.get('/achievements')
+    etag = response.headers['ETag']
+    assert json.loads(response.data)[0]['name'] == 'First Step'
+
+    response = test_client.put(f'/achievement/{achievement_id}/translations/ru', json={
+        'name': 'Первый шаг', 'description': 'Сделать первый шаг'
+    })
+    assert response.status_code == 200
+    assert test_client.put(f'/achievement/{achievement_id}/translations/de', json={
+        'name': 'Erster Schritt', 'description': 'Den ersten Schritt machen'
+    }).status_code == 400
+    assert test_client.put('/achievement/999/translations/ru', json={
+        'name': 'Нет', 'description': 'Нет'
+    }).status_code == 404
+
+    response = test_client.get('/achievements?lang=ru')
+    assert json.loads(response.data)[0]['name'] == 'Первый шаг'
+    response = test_client.get('/achievements', headers={'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8'})
+    assert json.loads(response.data)[0]['description'] == 'Сделать первый шаг'
+    # Без перевода на язык клиента отдаются исходные тексты, а изменение перевода меняет ETag
+    response = test_client.get('/achievements', headers={'Accept-Language': 'en', 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert json.loads(response.data)[0]['name'] == 'First Step'
+    assert test_client.get('/achievements?lang=xx').status_code == 400
+
+    # Достижения пользователя по умолчанию на его языке
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert json.loads(response.data)[0]['name'] == 'Первый шаг'
+    response = test_client.get(f'/user/{user_id}/achievements?lang=en')
+    assert json.loads(response.data)[0]['name'] == 'First Step'
+
+    test_client.put(f'/achievement/{achievement_id}/translations/ru', json={
+        'name': 'Шаг первый', 'description': 'Сделать первый шаг'
+    })
+    response = test_client.get(f'/user/{user_id}/achievements')
+    assert json.loads(response.data)[0]['name'] == 'Шаг первый'
+
+
+def test_user_stats_maintenance(test_client, test_app):
+    """Тест агрегатов UserStats: обновление при выдаче, поиск расхождений и пересборка командами flask stats."""
+    from models import UserStats, db
+
+    user_id = json.loads(test_client.post('/user', json={'username': 'statsuser', 'language': 'en'}).data)['user_id']
+    ids = [json.loads(test_client.post('/achievement', json={
+        'name': f'Stats Achievement {i}', 'points': points, 'description': 'Stats description'
+    }).data)['id'] for i, points in enumerate((10, 5))]
+    for achievement_id in ids:
+        test_client.post(f'/user/{user_id}/achieve/{achievement_id}')
+
+    stats = db.session.get(UserStats, user_id)
+    assert (stats.achievements_count, stats.points_total, stats.current_streak, stats.best_streak) == (2, 15, 1, 1)
+
+    runner = test_app.test_cli_runner()
+    result = runner.invoke(args=['stats', 'verify'])
+    assert result.exit_code == 0, result.output
+    assert 'UserStats is consistent' in result.output
+
+    stats.points_total = 1
+    db.session.commit()
+    result = runner.invoke(args=['stats', 'verify'])
+    assert result.exit_code != 0
+    assert f'user_id={user_id}' in result.output
+
+    result = runner.invoke(args=['stats', 'rebuild'])
+    assert result.exit_code == 0, result.output
+    db.session.expire_all()
+    assert db.session.get(UserStats, user_id).points_total == 15
+    assert runner.invoke(args=['stats', 'verify']).exit_code == 0
+
+
+def test_asgi_app(tmp_path):
+    """Смоук-тест асинхронного приложения asgi.py на SQLite через aiosqlite."""
+    from app import create_app, db
+    from asgi import create_asgi_app
+
+    url = f'sqlite:///{tmp_path / "async.db"}'
+    with create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': url}).app_context():
+        db.create_all(bind_key=None)
+    app = create_asgi_app(url)
+
+    async def scenario():
+        client = app.test_client()
+        response = await client.post('/user', json={'username': 'asyncuser', 'language': 'en'})
+        assert response.status_code == 201
+        user_id = (await response.get_json())['user_id']
+        assert (await client.post('/user', json={'username': 'asyncuser'})).status_code == 400
+        assert (await client.post('/user', json={'username': 'asyncuser', 'language': 'en'})).status_code == 409
+
+        response = await client.post('/achievement', json={
+            'name': 'Async Achievement',
+            'points': 5,
+            'description': 'Async description'
+        })
+        assert response.status_code == 201
+        achievement_id = (await response.get_json())['id']
+        assert (await client.post('/achievement', json={'name': 'Async'})).status_code == 400
+
+        response = await client.post(f'/user/{user_id}/achieve/{achievement_id}', headers={'Idempotency-Key': 'a1'})
+        assert response.status_code == 201
+        response = await client.post(f'/user/{user_id}/achieve/{achievement_id}', headers={'Idempotency-Key': 'a1'})
+        assert response.status_code == 200
+        assert (await client.post(f'/user/{user_id}/achieve/999999')).status_code == 404
+
+        response = await client.post('/awards/batch', json={'awards': [
+            {'user_id': user_id, 'achievement_id': achievement_id},
+            {'user_id': user_id, 'achievement_id': 999999}
+        ]})
+        assert (await response.get_json())['awarded'] == 1
+        assert (await client.post('/awards/batch', json={})).status_code == 400
+
+        response = await client.get('/users?limit=1')
+        assert [user['username'] for user in await response.get_json()] == ['asyncuser']
+        response = await client.get(f'/user/{user_id}/achievements')
+        assert len(await response.get_json()) == 2
+        assert (await client.get(f'/user/{user_id}/achievements?limit=abc')).status_code == 400
+        assert (await client.get('/user/999999/achievements')).status_code == 404
+
+        response = await client.get('/stats')
+        assert response.status_code == 200
+        assert (await response.get_json())['max_points_user']['username'] == 'asyncuser'
+        assert (await client.get('/stats/streaks?days=0')).status_code == 400
+        await app.config['ASYNC_ENGINE'].dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,96 @@
+import threading
+from operator import attrgetter
+
+from flask import g
+from sqlalchemy import select
+
+from etags import CATALOG, bump_version, current_catalog_version
+from models import AchievementTranslation, DataVersion, db
+from sharding import shard_router
+from stats import insert_for
+
+
+class TranslationCatalog:
+    """Переводы каталога достижений, собранные в памяти процесса по языкам.
+
+    Для каждого языка переводы один раз читаются из основной базы в словарь
+    achievement_id -> (name, description) и помечаются версией каталога
+    DataVersion, которую увеличивают и добавление достижения, и изменение
+    перевода. Словарь пересобирается, когда запрос видит более новую версию,
+    поэтому перевод ответа не добавляет JOIN к запросам достижений, а
+    изменения в других процессах подхватываются сразу.
+    """
+
+    def __init__(self):
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        with self._lock:
+            self._compiled = {}
+        app.before_request(self._reset_version)
+
+    @staticmethod
+    def _reset_version():
+        # Контекст приложения может пережить запрос (CLI, тесты): версия каталога читается заново в каждом запросе
+        g.pop('catalog_version', None)
+
+    def _compile(self, language, session):
+        # Переводы хранятся только в основной базе; версия читается раньше переводов, чтобы изменение,
+        # закоммиченное между запросами, привело к пересборке, а не потерялось
+        with shard_router.routed(None, session):
+            version = session.execute(
+                select(DataVersion.value).where(DataVersion.name == CATALOG)
+            ).scalar() or 0
+            rows = session.execute(
+                select(AchievementTranslation.achievement_id, AchievementTranslation.name,
+                       AchievementTranslation.description).where(AchievementTranslation.language == language)
+            ).all()
+        return version, {achievement_id: (name, description) for achievement_id, name, description in rows}
+
+    def texts(self, language, version=None, session=None):
+        """Переводы на language, собранные при версии каталога не ниже version (по умолчанию - текущей)."""
+        if version is None:
+            version = current_catalog_version()
+        compiled = self._compiled.get(language)
+        if compiled is None or compiled[0] < version:
+            with self._lock:
+                compiled = self._compiled.get(language)
+                if compiled is None or compiled[0] < version:
+                    compiled = self._compiled[language] = self._compile(language, session or db.session)
+        return compiled[1]
+
+    def localize(self, serialize, language, key='id'):
+        """Оборачивает сериализатор строк: name и description заменяются переводом на language.
+
+        key - атрибут строки с id достижения. Без языка или без переводов на него
+        сериализатор возвращается как есть.
+        """
+        texts = self.texts(language) if language else None
+        if not texts:
+            return serialize
+        get_key = attrgetter(key)
+
+        def localized(row):
+            item = serialize(row)
+            text = texts.get(get_key(row))
+            if text is not None:
+                item['name'], item['description'] = text
+            return item
+        return localized
+
+    @staticmethod
+    def save(achievement_id, language, name, description, session=None):
+        """Записывает перевод достижения и увеличивает версию каталога; коммит остаётся за вызывающим кодом."""
+        session = session or db.session
+        stmt = insert_for(AchievementTranslation, session).values(
+            achievement_id=achievement_id, language=language, name=name, description=description
+        )
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[AchievementTranslation.achievement_id, AchievementTranslation.language],
+            set_={'name': stmt.excluded.name, 'description': stmt.excluded.description}
+        ))
+        bump_version(CATALOG, session)
+
+
+translations = TranslationCatalog()
@@ -0,0 +1,378 @@
+import atexit
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError, SQLAlchemyError, \
+    TimeoutError as PoolTimeoutError
+
+from awards import record_awards
+from models import User, Achievement, DataVersion, db
+from stats import insert_for
+
+DEFAULT_FLUSH_INTERVAL_MS = 50
+DEFAULT_FLUSH_MAX_ROWS = 1000
+DEFAULT_MAX_PENDING = 100000
+DEFAULT_JOURNAL_COMPACT_ROWS = 100000
+DEFAULT_JOURNAL_SLOTS = 64
+DEFAULT_FLUSH_MAX_RETRIES = 5
+
+# Ошибки соединения, блокировок и пула, после которых группу стоит повторить целиком;
+# остальные (нарушение ограничений, неверные данные) повторяются с тем же результатом
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)
+
+logger = logging.getLogger(__name__)
+
+# Имена checkpoint в DataVersion, занятые запущенными очередями этого процесса, и пути их журналов
+_checkpoints = {}
+
+
+class QueueFull(Exception):
+    """Очередь отложенной записи переполнена, база не успевает за выдачами."""
+
+
+class AwardQueue:
+    """Отложенная запись выдач достижений с групповым коммитом (write-behind).
+
+    Выдача проверяется по кэшу известных id пользователей и достижений,
+    дописывается строкой в локальный журнал и ставится в очередь в памяти;
+    фоновый поток коммитит очередь группами раз в flush_interval_ms или по
+    набору flush_max_rows выдач. Каждой выдаче присваивается порядковый номер
+    award_id; номер последней записанной выдачи хранится в DataVersion в той
+    же транзакции, что и сами выдачи, поэтому после падения процесса из
+    журнала повторно записываются ровно незакоммиченные выдачи. Когда в журнале
+    набирается journal_compact_rows записанных выдач, он переписывается с одними
+    незаписанными, поэтому под постоянной нагрузкой не растёт без границ.
+
+    Журнал принадлежит одному процессу: процесс занимает первый незаблокированный
+    из journal_path, journal_path.1, ... journal_path.<journal_slots - 1>, поэтому
+    воркеры с общим journal_path пишут в разные файлы, а перезапущенный воркер
+    подхватывает журнал завершившегося.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL_MS / 1000
+        self.flush_max_rows = DEFAULT_FLUSH_MAX_ROWS
+        self.max_pending = DEFAULT_MAX_PENDING
+        self.flush_max_retries = DEFAULT_FLUSH_MAX_RETRIES
+        self.fsync = False
+        self.journal_path = None
+        self.journal_slots = DEFAULT_JOURNAL_SLOTS
+        self.journal_compact_rows = DEFAULT_JOURNAL_COMPACT_ROWS
+        self._app = None
+        self._journal = None
+        self._journal_path = None
+        self._checkpoint_name = None
+        self._journal_committed = 0
+        self._pending = deque()
+        self._failed = set()
+        self._next_id = 1
+        self._committed_id = 0
+        self._failed_flushes = 0
+        self._known_users = set()
+        self._known_achievements = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('AWARD_WRITE_BEHIND', False)
+        self.flush_interval = app.config.get('AWARD_FLUSH_INTERVAL_MS', DEFAULT_FLUSH_INTERVAL_MS) / 1000
+        self.flush_max_rows = app.config.get('AWARD_FLUSH_MAX_ROWS', DEFAULT_FLUSH_MAX_ROWS)
+        self.max_pending = app.config.get('AWARD_MAX_PENDING', DEFAULT_MAX_PENDING)
+        self.flush_max_retries = app.config.get('AWARD_FLUSH_MAX_RETRIES', DEFAULT_FLUSH_MAX_RETRIES)
+        self.fsync = app.config.get('AWARD_JOURNAL_FSYNC', False)
+        self.journal_path = app.config.get('AWARD_JOURNAL_PATH', 'awards.journal')
+        self.journal_slots = app.config.get('AWARD_JOURNAL_SLOTS', DEFAULT_JOURNAL_SLOTS)
+        self.journal_compact_rows = app.config.get('AWARD_JOURNAL_COMPACT_ROWS', DEFAULT_JOURNAL_COMPACT_ROWS)
+        self._app = app
+        if 'award_queue' not in app.extensions:
+            app.extensions['award_queue'] = self
+            # Журнал и поток открываются в рабочем процессе на первом запросе, а не при создании
+            # приложения: код можно предзагрузить и форкнуть до обращения к базе
+            app.before_request(self._start_on_request)
+
+    def _start_on_request(self):
+        # После явной остановки (stop) очередь не перезапускается
+        if self.enabled and self._thread is None and not self._stopping:
+            with self._start_lock:
+                try:
+                    self.start()
+                except RuntimeError as e:
+                    # Один раз за процесс: дальше выдачи этого процесса записываются сразу, без очереди
+                    self.enabled = False
+                    logger.error('Write-behind awards are disabled in process %s: %s', os.getpid(), e)
+
+    @staticmethod
+    def _checkpoint_for(path):
+        # Полный путь журнала не помещается в DataVersion.name (40 символов), поэтому хранится его хэш
+        return f'journal:{hashlib.sha256(os.path.realpath(path).encode()).hexdigest()[:32]}'
+
+    def _open_journal(self):
+        """Открывает и блокирует первый свободный журнал; возвращает (файл, путь)."""
+        for slot in range(self.journal_slots):
+            path = f'{self.journal_path}.{slot}' if slot else self.journal_path
+            checkpoint_name = self._checkpoint_for(path)
+            owner = _checkpoints.get(checkpoint_name)
+            if owner is not None:
+                if owner != os.path.realpath(path):
+                    raise RuntimeError(f'Award journal {path} has the same checkpoint '
+                                       f'{checkpoint_name} as the running journal {owner}')
+                continue
+            journal = open(path, 'a+', encoding='utf-8')
+            try:
+                fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                journal.close()
+                continue
+            return journal, path
+        raise RuntimeError(f'All {self.journal_slots} award journals {self.journal_path}[.N] are used by other '
+                           f'processes; raise AWARD_JOURNAL_SLOTS to at least the number of worker processes')
+
+    def start(self):
+        """Открывает журнал, дописывает в очередь незакоммиченные выдачи и запускает фоновую запись.
+
+        Вызывается в контексте приложения; повторный вызов ничего не делает.
+        """
+        if not self.enabled or self._thread is not None:
+            return
+        self._journal, self._journal_path = self._open_journal()
+        self._checkpoint_name = self._checkpoint_for(self._journal_path)
+        _checkpoints[self._checkpoint_name] = os.path.realpath(self._journal_path)
+
+        self._committed_id = db.session.execute(
+            select(DataVersion.value).where(DataVersion.name == self._checkpoint_name)
+        ).scalar() or 0
+        self._next_id = self._committed_id + 1
+        self._journal_committed = 0
+        self._journal.seek(0)
+        for line in self._journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Недописанная строка при падении процесса посреди записи
+                logger.warning('Skipping corrupted line in award journal %s', self._journal_path)
+                continue
+            if entry['award_id'] > self._committed_id:
+                entry['date_awarded'] = datetime.fromisoformat(entry['date_awarded'])
+                self._pending.append(entry)
+            else:
+                self._journal_committed += 1
+            self._next_id = max(self._next_id, entry['award_id'] + 1)
+        if self._pending:
+            logger.info('Replaying %s uncommitted awards from %s', len(self._pending), self._journal_path)
+
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='award-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Останавливает фоновый поток, дописав в базу оставшиеся выдачи."""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        self._thread.join()
+        self._thread = None
+        self._journal.close()
+        self._journal = None
+        _checkpoints.pop(self._checkpoint_name, None)
+
+    def _exists(self, model, known, object_id):
+        if object_id in known:
+            return True
+        # Пользователи и достижения не удаляются, поэтому кэшируются только найденные id
+        if db.session.get(model, object_id) is None:
+            return False
+        known.add(object_id)
+        return True
+
+    def submit(self, user_id, achievement_id, award_key=None):
+        """Ставит выдачу в очередь. Возвращает award_id или None, если пользователь или достижение не найдены.
+
+        Выдача с award_key, уже записанным в базу, при записи группы пропускается.
+        """
+        if not self._exists(User, self._known_users, user_id) or \
+                not self._exists(Achievement, self._known_achievements, achievement_id):
+            return None
+        date_awarded = datetime.utcnow()
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(f'{len(self._pending)} awards are waiting to be written')
+            award_id = self._next_id
+            self._next_id += 1
+            entry = {'award_id': award_id, 'user_id': user_id, 'achievement_id': achievement_id,
+                     'date_awarded': date_awarded, 'award_key': award_key}
+            self._journal.write(self._journal_line(entry))
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._pending.append(entry)
+            if len(self._pending) >= self.flush_max_rows:
+                self._wakeup.notify()
+        return award_id
+
+    def status(self, award_id):
+        """Состояние выдачи: pending, committed, failed или None для неизвестного award_id."""
+        with self._lock:
+            if award_id in self._failed:
+                return 'failed'
+            if award_id <= self._committed_id:
+                return 'committed'
+            if award_id < self._next_id:
+                return 'pending'
+            return None
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                with self._lock:
+                    if not self._stopping and len(self._pending) < self.flush_max_rows:
+                        self._wakeup.wait(self.flush_interval)
+                    stopping = self._stopping
+                try:
+                    self.flush()
+                    self._failed_flushes = 0
+                except SQLAlchemyError:
+                    self._failed_flushes += 1
+                    logger.exception('Award flush failed %s times in a row, will retry', self._failed_flushes)
+                    db.session.rollback()
+                    if stopping:
+                        return
+                    time.sleep(self.flush_interval)
+                finally:
+                    db.session.remove()
+                if stopping and not self.pending_count():
+                    return
+
+    def flush(self):
+        """Записывает накопленные выдачи группами по flush_max_rows, каждая группа - одна транзакция.
+
+        Группа, упавшая на ошибке данных, или после flush_max_retries неудачных
+        попыток подряд пишется по одной выдаче: выдачи с ошибкой данных
+        отмечаются failed, на ошибке соединения запись прерывается до повтора.
+        """
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    entries = [self._pending[i] for i in range(min(len(self._pending), self.flush_max_rows))]
+                if not entries:
+                    return
+                try:
+                    self._committed(entries, self._write(entries))
+                    continue
+                except (SQLAlchemyError, LookupError) as e:
+                    db.session.rollback()
+                    if isinstance(e, TRANSIENT_ERRORS) and self._failed_flushes < self.flush_max_retries:
+                        raise
+                    logger.warning('Award group of %s failed, writing awards one by one: %s', len(entries), e)
+                # Каждая выдача коммитится отдельно и сразу убирается из очереди
+                for entry in entries:
+                    try:
+                        self._committed([entry], self._write([entry]))
+                    except (SQLAlchemyError, LookupError) as e:
+                        db.session.rollback()
+                        if isinstance(e, TRANSIENT_ERRORS):
+                            raise
+                        logger.error('Award %s failed: %s', entry['award_id'], getattr(e, 'orig', None) or e)
+                        self._checkpoint(entry['award_id'])
+                        db.session.commit()
+                        self._committed([entry], entry['award_id'], failed=True)
+
+    def _write(self, entries):
+        """Записывает выдачи и checkpoint одной транзакцией; возвращает записанный в checkpoint award_id.
+
+        LookupError, если достижения выдачи уже нет в базе.
+        """
+        points = dict(db.session.execute(
+            select(Achievement.id, Achievement.points)
+            .where(Achievement.id.in_({entry['achievement_id'] for entry in entries}))
+        ).all())
+        missing = {entry['achievement_id'] for entry in entries} - points.keys()
+        if missing:
+            raise LookupError(f'Achievements {sorted(missing)} not found')
+        record_awards([{
+            'user_id': entry['user_id'],
+            'achievement_id': entry['achievement_id'],
+            'date_awarded': entry['date_awarded'],
+            'points': points[entry['achievement_id']],
+            'award_key': entry.get('award_key')
+        } for entry in entries])
+        checkpoint = entries[-1]['award_id']
+        self._checkpoint(checkpoint)
+        db.session.commit()
+        return checkpoint
+
+    def _checkpoint(self, award_id):
+        """Сохраняет номер последней записанной выдачи в текущей транзакции."""
+        stmt = insert_for(DataVersion).values(name=self._checkpoint_name, value=award_id)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[DataVersion.name], set_={'value': award_id}))
+
+    def _committed(self, entries, checkpoint, failed=False):
+        """Убирает из очереди записанные (или отброшенные) выдачи; checkpoint - award_id, сохранённый в базе."""
+        award_ids = {entry['award_id'] for entry in entries}
+        with self._lock:
+            # Очередь пополняется только с конца, поэтому обработанные выдачи обычно лежат в её начале
+            while self._pending and self._pending[0]['award_id'] in award_ids:
+                award_ids.discard(self._pending.popleft()['award_id'])
+            if award_ids:
+                self._pending = deque(entry for entry in self._pending if entry['award_id'] not in award_ids)
+            if failed:
+                self._failed.update(entry['award_id'] for entry in entries)
+            self._committed_id = max(self._committed_id, checkpoint)
+            self._journal_committed += len(entries)
+            if not self._pending:
+                # Всё записано - журнал можно начать заново, номера продолжатся с checkpoint в базе
+                self._journal.truncate(0)
+                self._journal_committed = 0
+            elif self._journal_committed >= max(self.journal_compact_rows, len(self._pending)):
+                self._compact_journal()
+
+    def _compact_journal(self):
+        """Переписывает журнал, оставляя в нём только незаписанные выдачи; вызывается под self._lock.
+
+        Новый журнал пишется во временный файл, блокируется и только затем
+        атомарно подменяет старый, поэтому при падении посреди сжатия на диске
+        остаётся один из двух полных журналов.
+        """
+        # Режим дозаписи, как у основного журнала: после truncate(0) запись снова идёт с начала файла
+        journal = open(f'{self._journal_path}.tmp', 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            journal.truncate(0)
+            journal.writelines(self._journal_line(entry) for entry in self._pending)
+            journal.flush()
+            os.fsync(journal.fileno())
+            os.replace(journal.name, self._journal_path)
+        except OSError:
+            journal.close()
+            logger.exception('Award journal compaction failed, keeping %s', self._journal_path)
+            return
+        self._journal.close()
+        self._journal = journal
+        self._journal_committed = 0
+
+    @staticmethod
+    def _journal_line(entry):
+        return json.dumps(dict(entry, date_awarded=entry['date_awarded'].isoformat())) + '\n'
+
+
+award_queue = AwardQueue()
+